@@ -4,15 +4,24 @@
 import os
 import sys
 import re
+import argparse
+import contextlib
+import hashlib
 import math
-from datetime import datetime, timedelta # Ensure timedelta is imported
-from collections import Counter, defaultdict
+import struct
+import time
+from datetime import timedelta
 from decimal import Decimal, getcontext
+from functools import lru_cache
 
 from colorama import Fore, Style, init
 
-init(autoreset=True)
-getcontext().prec = 10
+from headless import RecordWriter, add_output_arguments, plain_colors
+from ledger import LEDGER_FILE, append_entries, make_entry
+from market_data import CACHE_DIR, load_day_records
+from profiling import PROFILER, add_profile_argument, enable_profiling
+
+getcontext().prec = 10 # See DECIMAL_PREC
 
 # --- Configuration & Constants ---
 APP_NAME = "MATKA MATH ANK FINDER"
@@ -20,12 +29,17 @@ APP_VERSION = "v1.2" # Incremented for new features
 POWERED_BY = "Anuj & AI God (Inspired by Sachin)"
 BOX_WIDTH = 80
 DATA_DIR = "data"
-SUGGESTIONS_LOG_FILE = "daily_math_ank_suggestions.txt" # File to log daily suggestions
+LEDGER_ENGINE = "math-ank" # Engine name of this script's suggestions in the ledger (ledger.LEDGER_FILE)
 
 # Backtesting Config
 OPERATOR_VALUE_RANGE_SMALL = range(1, 51) 
 OPERATOR_VALUE_RANGE_LARGE = range(1, 201)
 MIN_TESTS_FOR_RELIABILITY = 3 
+ANKS_PER_SUGGESTION = 3 # extract_3_anks_from_result always gives 3 distinct anks
+DECIMAL_PREC = 10 # Must match getcontext().prec above
+FORMULA_BACKEND = "fast" # "fast" = exact integer path, "decimal" = original Decimal formulas (reference)
+ANK_TABLE_FILE = os.path.join(CACHE_DIR, "math_ank_table.bin") # Precomputed (formula, jodi, X) -> 3 anks
+ANK_TABLE_VERSION = 1 # Bump when FORMULAS or extract_3_anks_from_result change behaviour
 
 # Color Palette (Same as v1.1)
 C_PRIMARY_BRIGHT = Fore.CYAN + Style.BRIGHT; C_SECONDARY_BRIGHT = Fore.MAGENTA + Style.BRIGHT
@@ -39,6 +53,8 @@ C_BANNER_TITLE = C_SUCCESS_BRIGHT; C_BANNER_SUBTITLE = C_WARNING_BRIGHT; C_BANNE
 def print_box_top(w=BOX_WIDTH, c=C_SECONDARY_BRIGHT): print(c + f"╔{'═'*(w-2)}╗" + C_RESET)
 def print_box_bottom(w=BOX_WIDTH, c=C_SECONDARY_BRIGHT): print(c + f"╚{'═'*(w-2)}╝" + C_RESET)
 def print_box_sep(w=BOX_WIDTH, c=C_SECONDARY_BRIGHT): print(c + f"╠{'═'*(w-2)}╣" + C_RESET)
+def clear_screen(): # ANSI clear (colorama translates it on Windows) instead of spawning `clear` / `cls`
+    if sys.stdout.isatty(): print("\033[H\033[2J\033[3J", end="")
 def strip_ansi(t): return re.sub(r'\x1b\[[0-9;]*[mK]', '', t)
 def print_box_line(t, w=BOX_WIDTH, bc=C_SECONDARY_BRIGHT, tc="", align="left", p=2):
     st, cw = strip_ansi(t), w-2-(p*2); dsp_t = t; cl_diff = len(t)-len(st)
@@ -53,39 +69,19 @@ def print_box_line(t, w=BOX_WIDTH, bc=C_SECONDARY_BRIGHT, tc="", align="left", p
     print(f"{bc}║{' '*p}{final_text_segment}{' '*p}{bc}║{C_RESET}")
 
 def show_banner(): # Same as v1.1
-    os.system("clear" if os.name == 'posix' else 'cls'); print_box_top(BOX_WIDTH, C_BANNER_BORDER)
+    clear_screen(); print_box_top(BOX_WIDTH, C_BANNER_BORDER)
     print_box_line(f"{C_BANNER_TITLE}{APP_NAME}",BOX_WIDTH,C_BANNER_BORDER, tc=C_BANNER_TITLE, align="center")
     print_box_line(f"{C_BANNER_SUBTITLE}{APP_VERSION}",BOX_WIDTH,C_BANNER_BORDER, tc=C_BANNER_SUBTITLE, align="center")
     print_box_sep(BOX_WIDTH,C_BANNER_BORDER); print_box_line(f"{C_BANNER_TEXT}Discovering Single Ank Patterns with Math",BOX_WIDTH,C_BANNER_BORDER, tc=C_BANNER_TEXT, align="center")
     print_box_bottom(BOX_WIDTH,C_BANNER_BORDER); print("\n")
 
 # --- Data Parsing (Same as v1.1) ---
-def parse_line_for_math_ank(line_str):
-    try:
-        date_part_str, result_part_str = map(str.strip, line_str.split('/', 1))
-        p1, jodi_str, p2 = map(str.strip, result_part_str.split('-', 2))
-        if not (re.fullmatch(r"\d{3}",p1) and re.fullmatch(r"\d{2}",jodi_str) and re.fullmatch(r"\d{3}",p2)): return None 
-        dt_obj = datetime.strptime(date_part_str, "%d-%m-%Y")
-        jodi_val = int(jodi_str)
-        return {
-            "date_obj": dt_obj, "jodi_val": jodi_val, "jodi_str": jodi_str,
-            "p1": p1, "p2": p2, "open_ank_from_p1": p1[-1],
-            "close_ank_from_jodi": jodi_str[-1]
-        }
-    except Exception: return None
-
-def load_market_data_for_math(market_filename): # Same as v1.1
+def load_market_data_for_math(market_filename): # DayRecords, served from the compiled market cache
     filepath = os.path.join(DATA_DIR, market_filename)
     if not os.path.exists(filepath):
         print(C_ERROR_BRIGHT + f"Data file not found: {filepath}")
         return []
-    parsed_entries = []
-    with open(filepath, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip():
-                parsed = parse_line_for_math_ank(line)
-                if parsed: parsed_entries.append(parsed)
-    return parsed_entries
+    return load_day_records(filepath, sort_by_date=False)
 
 # --- Formula Definitions (Same as v1.1) ---
 FORMULAS = {
@@ -99,6 +95,90 @@ FORMULAS = {
     "sqrt_jodi_mul_X": lambda num, x: Decimal(math.sqrt(num)) * Decimal(x) if num >= 0 else Decimal(0),
 }
 
+# --- Fast Formula Backend ---
+# Same formulas as FORMULAS, evaluated with plain integers. Each returns exactly the
+# string str() gives for the Decimal result at DECIMAL_PREC, so the anks extracted by
+# extract_3_anks_from_result are identical. Division and sqrt reproduce Decimal's
+# exact-or-rounded (ROUND_HALF_EVEN) digit expansion and is memoized per input.
+_PREC_LIMIT = 10 ** DECIMAL_PREC
+
+def _round_half_even(coeff, exp, sticky=False):
+    """ Rounds coeff * 10**exp to DECIMAL_PREC digits. sticky=True means discarded non-zero digits beyond coeff. """
+    drop = len(str(coeff)) - DECIMAL_PREC
+    if drop <= 0: return coeff, exp
+    q, rem = divmod(coeff, 10 ** drop)
+    half = 5 * 10 ** (drop - 1)
+    if rem > half or (rem == half and (sticky or q % 2 == 1)): q += 1
+    if q == _PREC_LIMIT: q, drop = q // 10, drop + 1 # 9999999999.5 -> 1000000000E+1
+    return q, exp + drop
+
+def _decimal_str(coeff, exp):
+    """ Decimal.__str__ for a non-negative coeff * 10**exp. """
+    digits = str(coeff)
+    if exp == 0: return digits
+    adjusted = exp + len(digits) - 1
+    if exp < 0 and adjusted >= -6:
+        if -exp >= len(digits): return "0." + "0" * (-exp - len(digits)) + digits
+        return digits[:exp] + "." + digits[exp:]
+    mantissa = digits[0] + ("." + digits[1:] if len(digits) > 1 else "")
+    return f"{mantissa}E{'+' if adjusted >= 0 else ''}{adjusted}"
+
+def _int_str(value):
+    return str(value) if value < _PREC_LIMIT else _decimal_str(*_round_half_even(value, 0))
+
+@lru_cache(maxsize=None) # Domain is tiny (jodi or digit sum x operator range): expand each quotient once
+def _div_str(num, den):
+    """ str(Decimal(num) / Decimal(den)) for num >= 0, den > 0. """
+    if num == 0: return "0"
+    k, scaled = 0, num
+    while True: # Exact quotient with the fewest fractional digits, while it fits in DECIMAL_PREC digits
+        q, r = divmod(scaled, den)
+        if len(str(q)) > DECIMAL_PREC: break
+        if r == 0: return _decimal_str(q, -k)
+        k += 1; scaled *= 10
+    return _decimal_str(*_round_half_even(q, -k, sticky=r != 0))
+
+def _float_decimal_parts(value):
+    """ (coeff, exp) of Decimal(value) for a non-negative float (an exact conversion). """
+    n, d = value.as_integer_ratio()
+    j = d.bit_length() - 1 # d is a power of two
+    return n * 5 ** j, -j
+
+_SQRT_EXPANSIONS = [_float_decimal_parts(math.sqrt(n)) for n in range(100)] # Jodi domain 00-99
+
+@lru_cache(maxsize=None)
+def _sqrt_mul_str(num, x):
+    coeff, exp = _SQRT_EXPANSIONS[num] if num < len(_SQRT_EXPANSIONS) else _float_decimal_parts(math.sqrt(num))
+    return _decimal_str(*_round_half_even(coeff * x, exp))
+
+FAST_FORMULAS = {
+    "jodi_div_X": lambda num, x: _div_str(num, x) if x != 0 else "0",
+    "jodi_mul_X": lambda num, x: _int_str(num * x),
+    "jodi_add_X": lambda num, x: _int_str(num + x),
+    "jodi_sub_X": lambda num, x: _int_str(abs(num - x)),
+    "jodi_mod_X": lambda num, x: _int_str(num % x) if x != 0 else "0",
+    "sum_digits_jodi_div_X": lambda num, x: _div_str(num // 10 + num % 10, x) if 10 <= num <= 99 and x != 0 else "0",
+    "prod_digits_jodi_mul_X": lambda num, x: _int_str((num // 10) * (num % 10) * x) if 10 <= num <= 99 else "0",
+    "sqrt_jodi_mul_X": lambda num, x: _sqrt_mul_str(num, x) if num >= 0 else "0",
+}
+
+FORMULA_INDEX = {f_name: i for i, f_name in enumerate(FORMULAS)} # Row of each formula in the ank table
+
+def get_formulas(backend=None):
+    """ Formula table for the given backend ("fast" or "decimal"), default FORMULA_BACKEND. """
+    return FORMULAS if (backend or FORMULA_BACKEND) == "decimal" else FAST_FORMULAS
+
+def verify_fast_formulas(jodi_range=range(100), x_range=OPERATOR_VALUE_RANGE_LARGE):
+    """ Compares FAST_FORMULAS with the Decimal reference. Returns a list of mismatches (empty = identical). """
+    mismatches = []
+    for f_name, reference_func in FORMULAS.items():
+        fast_func = FAST_FORMULAS[f_name]
+        for num in jodi_range:
+            for x in x_range:
+                expected, got = str(reference_func(num, x)), fast_func(num, x)
+                if got != expected: mismatches.append((f_name, num, x, expected, got))
+    return mismatches
+
 # --- Ank Extraction Logic (Same as v1.1) ---
 def extract_3_anks_from_result(result_decimal):
     anks = set()
@@ -133,84 +213,281 @@ def extract_3_anks_from_result(result_decimal):
         current_padding_idx += 1
     return sorted(list(anks))[:3]
 
+# --- Precomputed Ank Table ---
+# The jodi input is always 00-99 and X is at most max(OPERATOR_VALUE_RANGE_LARGE), so every
+# (formula, jodi, X) -> 3 anks result is computed once into a dense uint8 table of shape
+# len(FORMULAS) x 100 x ANK_TABLE_X_MAX x 3. It is built lazily, saved under CACHE_DIR and
+# shared by every market and run. ANK_TABLE_NONE marks inputs where the formula raised.
+ANK_TABLE_JODIS = 100
+ANK_TABLE_X_MAX = max(OPERATOR_VALUE_RANGE_LARGE)
+ANK_TABLE_NONE = 255
+ANK_TABLE_MAGIC = b"ANKT"
+_ank_table = None # Loaded table (bytes), shared across markets in this process
+
+def _ank_table_key():
+    key_src = f"{ANK_TABLE_VERSION}|{DECIMAL_PREC}|{ANK_TABLE_X_MAX}|{'|'.join(FORMULAS)}"
+    return hashlib.sha1(key_src.encode("utf-8")).digest()
+
+def ank_table_offset(f_idx, jodi_val, x_val):
+    return ((f_idx * ANK_TABLE_JODIS + jodi_val) * ANK_TABLE_X_MAX + (x_val - 1)) * 3
+
+def build_ank_table():
+    table = bytearray([ANK_TABLE_NONE]) * (len(FORMULAS) * ANK_TABLE_JODIS * ANK_TABLE_X_MAX * 3)
+    for f_idx, formula_func in enumerate(get_formulas("fast").values()):
+        for jodi_val in range(ANK_TABLE_JODIS):
+            for x_val in range(1, ANK_TABLE_X_MAX + 1):
+                try: anks = extract_3_anks_from_result(formula_func(jodi_val, x_val))
+                except Exception: continue
+                o = ank_table_offset(f_idx, jodi_val, x_val)
+                table[o:o+len(anks)] = bytes(anks)
+    return bytes(table)
+
+def get_ank_table():
+    """ Returns the ank table, loading it from ANK_TABLE_FILE or building (and saving) it on first use. """
+    global _ank_table
+    if _ank_table is not None: return _ank_table
+    header = ANK_TABLE_MAGIC + _ank_table_key()
+    expected_size = len(header) + len(FORMULAS) * ANK_TABLE_JODIS * ANK_TABLE_X_MAX * 3
+    try:
+        with open(ANK_TABLE_FILE, 'rb') as f: raw = f.read()
+        if len(raw) == expected_size and raw.startswith(header): _ank_table = raw[len(header):]
+    except OSError: pass
+    if _ank_table is None:
+        print(C_INFO_BRIGHT + "Building ank lookup table (one-time)...")
+        _ank_table = build_ank_table()
+        try:
+            os.makedirs(os.path.dirname(ANK_TABLE_FILE), exist_ok=True)
+            with open(ANK_TABLE_FILE + ".tmp", 'wb') as f: f.write(header + _ank_table)
+            os.replace(ANK_TABLE_FILE + ".tmp", ANK_TABLE_FILE)
+        except OSError: pass # Table still works in memory
+    return _ank_table
+
+def _builtin_backend(formulas_to_test):
+    """ "fast" or "decimal" if formulas_to_test are that backend's built-in formulas, else None (custom formulas). """
+    for backend, table in (("fast", FAST_FORMULAS), ("decimal", FORMULAS)):
+        if all(func is table.get(name) for name, func in formulas_to_test.items()): return backend
+    return None
+
+def get_operator_range(f_name):
+    op_range_key_prefix = f_name.split('_')[1] 
+    op_range = OPERATOR_VALUE_RANGE_SMALL 
+    if "add" in op_range_key_prefix or "sub" in op_range_key_prefix : op_range = OPERATOR_VALUE_RANGE_LARGE
+    elif "mod" in op_range_key_prefix: op_range = [x for x in OPERATOR_VALUE_RANGE_SMALL if x > 0]
+    if f_name.endswith("_div_X") or f_name.endswith("_mod_X"): op_range = [x for x in op_range if x != 0]
+    return op_range
+
+def predict_anks(formulas_to_test, f_name, jodi_val, x_val, ank_table=None):
+    """ 3 predicted anks for (formula, jodi, X) from the table when possible. Returns None if the formula fails. """
+    if ank_table is not None and 0 <= jodi_val < ANK_TABLE_JODIS and 1 <= x_val <= ANK_TABLE_X_MAX:
+        o = ank_table_offset(FORMULA_INDEX[f_name], jodi_val, x_val)
+        anks = ank_table[o:o+3]
+        return None if anks[0] == ANK_TABLE_NONE else anks
+    try: return extract_3_anks_from_result(formulas_to_test[f_name](jodi_val, x_val))
+    except Exception: return None
+
 # --- Backtesting Engine (Same as v1.1) ---
-def run_backtester(historical_data, formulas_to_test, operator_ranges):
+def _backtest_shard(data_pairs, variants, formulas_to_test, ank_table=None, progress=None):
+    """
+    Backtests (f_name, x_val) variants over every (jodi, next open ank, next close ank) pair.
+    progress(days_done) is called after each day. Returns {(f_name, x_val): [tests, passes, first_day]},
+    where first_day is the first pair the variant produced anks for (fixes the serial result order).
+    """
+    formula_stats = {}
+    for i, (current_jodi, actual_next_open_ank, actual_next_close_ank) in enumerate(data_pairs):
+        for key in variants:
+            predicted_anks = predict_anks(formulas_to_test, key[0], current_jodi, key[1], ank_table)
+            if predicted_anks is None: continue
+            stats = formula_stats.get(key)
+            if stats is None: stats = formula_stats[key] = [0, 0, i]
+            stats[0] += 1
+            if actual_next_open_ank in predicted_anks or actual_next_close_ank in predicted_anks: stats[1] += 1
+        if progress: progress(i + 1)
+    return formula_stats
+
+def _progress_printer(total_days):
+    """ Prints backtest progress at each quarter of total_days; returns the callback, days_done -> None. """
+    step = max(1, total_days // 4); reported = [0]
+    def report(days_done):
+        mark = total_days if days_done >= total_days else days_done - days_done % step
+        if mark <= reported[0]: return
+        reported[0] = mark
+        # Removed date from progress line to keep it concise
+        print(f"{C_PRIMARY}  Backtesting progress: {mark / total_days * 100:.0f}% ({mark}/{total_days} days processed)")
+    return report
+
+# --- Sharded Backtest ---
+# The formula x X grid is split into shards run by a process pool. The (jodi, open, close)
+# pairs and the ank table go into one shared memory block, written once, which every shard
+# attaches to by name. The block starts with one uint32 progress slot per shard (days done);
+# each slot has a single writer, and the parent polls them to report progress.
+BACKTEST_WORKERS = None # Worker processes for run_backtester (None = one per CPU, 1 = serial)
+BACKTEST_SHARDS_PER_WORKER = 4 # More shards than workers keeps every core busy until the end
+SHARDED_MIN_WORK = 200000 # Below this many (day, variant) predictions the pool costs more than it saves
+PROGRESS_SLOT = struct.Struct("<I")
+
+def _backtest_shard_worker(shm_name, layout, shard_idx, variants, backend):
+    from multiprocessing import shared_memory
+    n_shards, n_pairs, table_len = layout
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        pairs_at = n_shards * PROGRESS_SLOT.size
+        raw = bytes(shm.buf[pairs_at:pairs_at + n_pairs * 3])
+        ank_table = bytes(shm.buf[pairs_at + n_pairs * 3:pairs_at + n_pairs * 3 + table_len]) if table_len else None
+        data_pairs = list(zip(raw[0::3], raw[1::3], raw[2::3]))
+        def progress(days_done): PROGRESS_SLOT.pack_into(shm.buf, shard_idx * PROGRESS_SLOT.size, days_done)
+        return _backtest_shard(data_pairs, variants, get_formulas(backend), ank_table, progress)
+    finally: shm.close()
+
+def _run_sharded_backtest(data_pairs, variants, backend, ank_table, workers):
+    from concurrent.futures import ProcessPoolExecutor, wait # Only sharded runs pay for multiprocessing
+    from multiprocessing import shared_memory
+    n_shards = min(len(variants), workers * BACKTEST_SHARDS_PER_WORKER)
+    shards = [variants[i::n_shards] for i in range(n_shards)] # Round-robin mixes cheap and costly formulas
+    ank_table = ank_table or b"" # No table (decimal backend): workers evaluate the formulas directly
+    layout = (n_shards, len(data_pairs), len(ank_table))
+    pairs_at = n_shards * PROGRESS_SLOT.size
+    shm = shared_memory.SharedMemory(create=True, size=pairs_at + len(data_pairs) * 3 + len(ank_table))
+    try:
+        shm.buf[:pairs_at] = bytes(pairs_at)
+        shm.buf[pairs_at:pairs_at + len(data_pairs) * 3] = bytes(v for pair in data_pairs for v in pair)
+        shm.buf[pairs_at + len(data_pairs) * 3:pairs_at + len(data_pairs) * 3 + len(ank_table)] = ank_table
+        report = _progress_printer(len(data_pairs))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_backtest_shard_worker, shm.name, layout, i, shard, backend) for i, shard in enumerate(shards)]
+            pending = futures
+            while pending:
+                pending = wait(pending, timeout=0.2)[1]
+                done = sum(PROGRESS_SLOT.unpack_from(shm.buf, i * PROGRESS_SLOT.size)[0] for i in range(n_shards))
+                report(done // n_shards)
+            formula_stats = {}
+            for future in futures: formula_stats.update(future.result()) # Shards are disjoint
+        return formula_stats
+    finally: shm.close(); shm.unlink()
+
+def run_backtester(historical_data, formulas_to_test, operator_ranges, workers=BACKTEST_WORKERS):
     results = []
     if len(historical_data) < 2:
         print(C_WARNING_BRIGHT + "Not enough historical data (need at least 2 entries).")
         return []
-    data_pairs = []
-    for i in range(len(historical_data) - 1):
-        data_pairs.append({
-            "current_date_obj": historical_data[i]["date_obj"], # Store date for context
-            "current_jodi_val": historical_data[i]["jodi_val"],
-            "next_day_date_obj": historical_data[i+1]["date_obj"], # Store date for context
-            "next_day_open_ank": historical_data[i+1]["open_ank_from_p1"],
-            "next_day_close_ank": historical_data[i+1]["close_ank_from_jodi"]
-        })
+    # (jodi, next day's open ank, next day's close ank) for every consecutive pair of days
+    data_pairs = [(historical_data[i].jodi, historical_data[i+1].open_ank, historical_data[i+1].close_ank)
+                  for i in range(len(historical_data) - 1)]
     if not data_pairs: return []
     
-    first_test_date = data_pairs[0]["current_date_obj"].strftime("%d-%m-%Y")
-    last_test_date_for_jodi = data_pairs[-1]["current_date_obj"].strftime("%d-%m-%Y")
+    first_test_date = historical_data[0].date_str
+    last_test_date_for_jodi = historical_data[-2].date_str
     print(C_INFO_BRIGHT + f"Starting backtesting with {len(data_pairs)} data points.")
     print(C_INFO_BRIGHT + f"  (Jodis from {first_test_date} to {last_test_date_for_jodi} predicting for subsequent days)")
 
-    formula_stats = defaultdict(lambda: {"tests": 0, "passes": 0})
-
-    for i, pair_data in enumerate(data_pairs):
-        current_jodi = pair_data["current_jodi_val"]
-        actual_next_open_ank = pair_data["next_day_open_ank"]
-        actual_next_close_ank = pair_data["next_day_close_ank"]
-        if (i + 1) % (max(1, len(data_pairs) // 4)) == 0 or i == len(data_pairs) -1 :
-            progress = (i + 1) / len(data_pairs) * 100
-            # Removed date from progress line to keep it concise
-            print(f"{C_PRIMARY}  Backtesting progress: {progress:.0f}% ({i+1}/{len(data_pairs)} days processed)")
-
-        for f_name, formula_func in formulas_to_test.items():
-            op_range_key_prefix = f_name.split('_')[1] 
-            op_range = OPERATOR_VALUE_RANGE_SMALL 
-            if "add" in op_range_key_prefix or "sub" in op_range_key_prefix : op_range = OPERATOR_VALUE_RANGE_LARGE
-            elif "mod" in op_range_key_prefix: op_range = [x for x in OPERATOR_VALUE_RANGE_SMALL if x > 0]
-            
-            for x_val in op_range:
-                if (f_name.endswith("_div_X") or f_name.endswith("_mod_X")) and x_val == 0: continue
-                try: result_val = formula_func(current_jodi, x_val)
-                except Exception: continue
-                predicted_anks = extract_3_anks_from_result(result_val)
-                key = (f_name, x_val); formula_stats[key]["tests"] += 1
-                is_pass = any(str(p_ank) == actual_next_open_ank or str(p_ank) == actual_next_close_ank for p_ank in predicted_anks)
-                if is_pass: formula_stats[key]["passes"] += 1
-    
-    for (f_name, x_val), stats in formula_stats.items():
-        if stats["tests"] >= MIN_TESTS_FOR_RELIABILITY:
-            pass_rate = (stats["passes"] / stats["tests"]) * 100 if stats["tests"] > 0 else 0
+    backend = _builtin_backend(formulas_to_test)
+    ank_table = get_ank_table() if backend == "fast" else None # The table holds the fast formulas' anks; decimal stays the reference
+    variants = [(f_name, x_val) for f_name in formulas_to_test for x_val in get_operator_range(f_name)]
+    workers = workers or os.cpu_count() or 1
+    if PROFILER.enabled: # Profiled runs backtest one formula at a time, serially, so each one's time is its own
+        formula_stats = {}
+        for f_name in formulas_to_test:
+            f_variants = [key for key in variants if key[0] == f_name]
+            start = time.perf_counter()
+            formula_stats.update(_backtest_shard(data_pairs, f_variants, formulas_to_test, ank_table))
+            PROFILER.add_formula(f_name, "ank table" if ank_table is not None else "direct", time.perf_counter() - start, len(data_pairs) * len(f_variants))
+    elif workers > 1 and backend and len(data_pairs) * len(variants) >= SHARDED_MIN_WORK:
+        formula_stats = _run_sharded_backtest(data_pairs, variants, backend, ank_table, workers)
+    else:
+        formula_stats = _backtest_shard(data_pairs, variants, formulas_to_test, ank_table, _progress_printer(len(data_pairs)))
+    with PROFILER.stage("ranking"):
+        from ranking import CHANCE_HUNDREDTHS_BY_SIZE, formula_scores, rank_formulas # numpy loads with the first backtest, not at startup
+        # Same order as a serial day-by-day pass: first day with a prediction, then grid position
+        # (the tie-break of rank_formulas)
+        variant_pos = {key: pos for pos, key in enumerate(variants)}
+        ordered_keys = sorted(formula_stats, key=lambda key: (formula_stats[key][2], variant_pos[key]))
+        reliable = [key for key in ordered_keys if formula_stats[key][0] >= MIN_TESTS_FOR_RELIABILITY]
+        # Every prediction is ANKS_PER_SUGGESTION distinct anks, so every test has the same chance rate
+        tests = [formula_stats[key][0] for key in reliable]
+        ranked = rank_formulas([formula_stats[key][1] for key in reliable], tests, [t * int(CHANCE_HUNDREDTHS_BY_SIZE[ANKS_PER_SUGGESTION]) / 100 for t in tests])
+
+        for i in ranked["order"]:
+            f_name, x_val = reliable[i]
+            tests, passes, _ = formula_stats[(f_name, x_val)]
+            pass_rate = (passes / tests) * 100 if tests > 0 else 0
             sample_pred_anks = ["-","-","-"]
             if historical_data:
-                 last_hist_jodi = historical_data[-1]["jodi_val"]
-                 try:
-                     sample_res = formulas_to_test[f_name](last_hist_jodi, x_val)
-                     sample_pred_anks = extract_3_anks_from_result(sample_res)
-                 except: pass
+                 sample_anks = predict_anks(formulas_to_test, f_name, historical_data[-1].jodi, x_val, ank_table)
+                 if sample_anks is not None: sample_pred_anks = list(sample_anks)
             results.append({
-                "name":f_name, "x":x_val, "tests":stats["tests"], "passes":stats["passes"], 
-                "rate":pass_rate, "sample_anks":sample_pred_anks
+                "name":f_name, "x":x_val, "tests":tests, "passes":passes, 
+                "rate":pass_rate, "sample_anks":sample_pred_anks, **formula_scores(ranked, i)
             })
-    return sorted(results, key=lambda r: (r["rate"], r["passes"]), reverse=True)
+        return results
+
+def ranking_fields(res):
+    """ The ranking scores of a run_backtester result as record fields, rates in percent like rate. """
+    return {"chance_rate": round(res["chance_rate"] * 100, 2), "shrunk_rate": round(res["shrunk_rate"] * 100, 2),
+            "p_value": round(res["p_value"], 6), "q_value": round(res["q_value"], 6)}
 
 # --- Saving Daily Suggestions ---
-def save_daily_suggestion(market_name, prediction_for_date_str, formula_name, x_value, suggested_anks):
-    """Appends the daily suggestion to the log file."""
-    today_str = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
-    anks_str = ' '.join(map(str, suggested_anks))
-    log_line = f"[{today_str}] Market: {market_name}, For_Date: {prediction_for_date_str}, Formula: {formula_name}(X={x_value}), Suggested_Anks: [{anks_str}]\n"
-    
+def suggestion_entry(market_name, prediction_for_date_str, formula_spec, suggested_anks):
+    """ Ledger entry (see ledger.make_entry) for the suggestion of a run_backtester result. """
+    return make_entry(LEDGER_ENGINE, market_name, prediction_for_date_str, f"{formula_spec['name']}(X={formula_spec['x']})", suggested_anks,
+                      formula_name=formula_spec['name'], x=formula_spec['x'], rate=round(formula_spec['rate'], 4),
+                      passes=formula_spec['passes'], tests=formula_spec['tests'], **ranking_fields(formula_spec))
+
+def save_daily_suggestions(entries):
+    """ Appends suggestion entries to the suggestion ledger in one locked write (already logged keys are skipped). """
     try:
-        with open(SUGGESTIONS_LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(log_line)
-        print(C_INFO_BRIGHT + f"Suggestion logged to: {C_SECONDARY_BRIGHT}{SUGGESTIONS_LOG_FILE}{C_RESET}")
+        with PROFILER.stage("log write"): written = append_entries(entries)
+        if written: print(C_INFO_BRIGHT + f"Suggestion logged to: {C_SECONDARY_BRIGHT}{LEDGER_FILE}{C_RESET}")
+        else: print(C_INFO_BRIGHT + f"Suggestion already in: {C_SECONDARY_BRIGHT}{LEDGER_FILE}{C_RESET}")
     except Exception as e:
         print(C_ERROR_BRIGHT + f"Error logging suggestion: {e}")
 
+def save_daily_suggestion(market_name, prediction_for_date_str, formula_spec, suggested_anks):
+    """ Logs the daily suggestion of the top run_backtester result to the suggestion ledger. """
+    save_daily_suggestions([suggestion_entry(market_name, prediction_for_date_str, formula_spec, suggested_anks)])
+
+
+# --- Headless Output (--format json / csv) ---
+HEADLESS_FIELDS = ("record", "market", "rank", "formula", "x", "tests", "passes", "rate",
+                   "chance_rate", "shrunk_rate", "p_value", "q_value", "anks", "for_date")
+
+def market_file_name(market): return market if market.endswith(".txt") else f"{market}.txt"
+def market_label(market_filename): return market_filename[:-4] if market_filename.endswith(".txt") else market_filename # As in the ledger and other scripts' records
+
+def market_records(market_filename, formulas, workers=BACKTEST_WORKERS, log_entries=None):
+    """
+    run_backtester results (formula_stat records, best first) and the next-day suggestion of the top
+    formula for one market file, without the display ([] if there is not enough data). The suggestion is
+    logged at once, or its ledger entry collected into log_entries if given.
+    """
+    historical_data = load_market_data_for_math(market_filename)
+    if len(historical_data) < 2:
+        print(C_ERROR_BRIGHT + f"Not enough data in {market_filename} (found {len(historical_data)}, need at least 2)."); return []
+    best_formulas = run_backtester(historical_data, formulas, {}, workers)
+    market = market_label(market_filename)
+    records = [{"record": "formula_stat", "market": market, "rank": rank, "formula": res["name"], "x": res["x"],
+                "tests": res["tests"], "passes": res["passes"], "rate": round(res["rate"], 4), **ranking_fields(res), "anks": res["sample_anks"]}
+               for rank, res in enumerate(best_formulas, 1)]
+    if not best_formulas: return records
+    top = best_formulas[0]
+    prediction_for_date_str = (historical_data[-1].date_obj + timedelta(days=1)).strftime("%d-%m-%Y")
+    try: predicted_anks = extract_3_anks_from_result(formulas[top["name"]](historical_data[-1].jodi, top["x"]))
+    except Exception as e: print(C_ERROR_BRIGHT + f"Error during prediction: {e}"); return records
+    records.append({"record": "suggestion", "market": market, "rank": 1, "formula": top["name"], "x": top["x"],
+                    "tests": top["tests"], "passes": top["passes"], "rate": round(top["rate"], 4), **ranking_fields(top),
+                    "anks": list(predicted_anks), "for_date": prediction_for_date_str})
+    if log_entries is None: save_daily_suggestion(market_filename, prediction_for_date_str, top, predicted_anks)
+    else: log_entries.append(suggestion_entry(market_filename, prediction_for_date_str, top, predicted_anks))
+    return records
+
+def run_headless(market_files, fmt, formulas, workers=BACKTEST_WORKERS):
+    """ Writes the records of every market file to stdout as JSON lines or CSV; progress and warnings go to stderr. """
+    writer, log_entries = RecordWriter(fmt, HEADLESS_FIELDS), []
+    for market_filename in market_files:
+        with contextlib.redirect_stdout(sys.stderr):
+            try: records = market_records(market_filename, formulas, workers, log_entries)
+            except Exception as e: print(C_ERROR_BRIGHT + f"[!] Analysis failed for {market_filename}: {e}"); records = []
+        writer.write_all(records)
+    if log_entries:
+        with contextlib.redirect_stdout(sys.stderr): save_daily_suggestions(log_entries)
 
 # --- Main Application ---
 def select_market_file(): # Same as v1.1
@@ -236,53 +513,82 @@ def select_market_file(): # Same as v1.1
             else: print(C_ERROR + "Invalid market number." + C_RESET)
         except ValueError: print(C_ERROR + "Invalid input. Please enter a number." + C_RESET)
 
-def main():
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description=f"{APP_NAME} {APP_VERSION}")
+    parser.add_argument("--backend", choices=["fast", "decimal"], default=FORMULA_BACKEND, help="Formula evaluation backend (decimal = reference mode)")
+    parser.add_argument("--verify-backend", action="store_true", help="Check the fast backend against the Decimal formulas and exit")
+    parser.add_argument("--workers", type=int, default=BACKTEST_WORKERS, help="Backtest worker processes (default: CPU count, 1 = serial; profiled runs are serial)")
+    add_profile_argument(parser)
+    add_output_arguments(parser, market_help="Market file (e.g. KALYAN or KALYAN.txt) to analyze without the menu (default with --format json/csv: all files)")
+    return parser.parse_args(argv)
+
+def main(args=None):
+    args = args or parse_args()
+    if args.format == "box": init(autoreset=True) # Colour/box display only; json/csv stdout stays a plain stream
+    else: plain_colors(globals()) # json/csv: progress and warnings on stderr without colour codes
+    enable_profiling(args.profile, APP_NAME)
+    if args.verify_backend:
+        mismatches = verify_fast_formulas()
+        if not mismatches: print(C_SUCCESS_BRIGHT + "Fast backend matches the Decimal formulas on the full jodi x operator domain.")
+        for f_name, num, x, expected, got in mismatches[:20]: print(C_ERROR + f"{f_name}({num}, X={x}): decimal={expected} fast={got}")
+        return
+    formulas = get_formulas(args.backend)
+    if args.format != "box":
+        market_files = [market_file_name(args.market)] if args.market else \
+            sorted(f for f in os.listdir(DATA_DIR) if f.endswith(".txt") and os.path.isfile(os.path.join(DATA_DIR, f)))
+        run_headless(market_files, args.format, formulas, args.workers); return
+
     show_banner()
-    selected_market = select_market_file()
+    selected_market = market_file_name(args.market) if args.market else select_market_file()
     if not selected_market:
         print(C_INFO_BRIGHT + "Exiting application.")
         return
 
     print(C_INFO_BRIGHT + f"\nLoading data for market: {C_SECONDARY_BRIGHT}{selected_market}{C_RESET}")
-    historical_data = load_market_data_for_math(selected_market)
+    with PROFILER.stage("load"): historical_data = load_market_data_for_math(selected_market)
 
     if len(historical_data) < 2: 
         print(C_ERROR_BRIGHT + f"Not enough data in {selected_market} (found {len(historical_data)}, need at least 2).")
         return
     
     print(C_SUCCESS_BRIGHT + f"Loaded {len(historical_data)} historical records.")
-    first_data_date = historical_data[0]["date_obj"].strftime("%d-%m-%Y")
-    last_data_date = historical_data[-1]["date_obj"].strftime("%d-%m-%Y")
+    first_data_date = historical_data[0].date_str
+    last_data_date = historical_data[-1].date_str
     print(C_INFO_BRIGHT + f"Data range: {C_ACCENT_BRIGHT}{first_data_date}{C_INFO_BRIGHT} to {C_ACCENT_BRIGHT}{last_data_date}{C_RESET}")
 
 
     operator_configs = {} # Not directly used by run_backtester in this version
-    best_formulas = run_backtester(historical_data, FORMULAS, operator_configs)
+    with PROFILER.stage("backtest"): best_formulas = run_backtester(historical_data, formulas, operator_configs, args.workers)
 
-    print_box_top(BOX_WIDTH, C_SUCCESS_BRIGHT)
-    print_box_line(f"{C_ACCENT_BRIGHT}Top Performing Formulas for {selected_market}", BOX_WIDTH, C_SUCCESS_BRIGHT, tc=C_ACCENT_BRIGHT, align="center")
-    print_box_sep(BOX_WIDTH, C_SUCCESS_BRIGHT)
-    header = f"{'Formula':<30} | {'X':>3} | {'Rate%':>6} | {'P/T':>7} | Anks (Sample)"
-    print_box_line(header, BOX_WIDTH, C_SUCCESS_BRIGHT, tc=C_WARNING_BRIGHT, p=1)
-    print_box_sep(BOX_WIDTH, C_SUCCESS_BRIGHT)
+    with PROFILER.stage("display"):
+        from ranking import CHANCE_HUNDREDTHS_BY_SIZE, SIGNIFICANCE_LEVEL
+        print_box_top(BOX_WIDTH, C_SUCCESS_BRIGHT)
+        print_box_line(f"{C_ACCENT_BRIGHT}Top Performing Formulas for {selected_market}", BOX_WIDTH, C_SUCCESS_BRIGHT, tc=C_ACCENT_BRIGHT, align="center")
+        print_box_sep(BOX_WIDTH, C_SUCCESS_BRIGHT)
+        header = f"{'Formula':<30} | {'X':>3} | {'Rate%':>6} | {'Shrunk':>6} | {'P/T':>7} | Anks"
+        print_box_line(header, BOX_WIDTH, C_SUCCESS_BRIGHT, tc=C_WARNING_BRIGHT, p=1)
+        print_box_sep(BOX_WIDTH, C_SUCCESS_BRIGHT)
 
-    if not best_formulas:
-        print_box_line("No formulas met reliability criteria.", BOX_WIDTH, C_SUCCESS_BRIGHT, tc=C_INFO_BRIGHT, align="center")
-    else:
-        for i, res in enumerate(best_formulas[:15]):
-            anks_str = ' '.join(map(str, res['sample_anks']))
-            line_str = f"{res['name']:<30} | {str(res['x']):>3} | {res['rate']:>6.2f} | {str(res['passes'])+'/'+str(res['tests']):>7} | {anks_str}"
-            print_box_line(line_str, BOX_WIDTH, C_SUCCESS_BRIGHT, tc=C_PRIMARY, p=1)
-    print_box_bottom(BOX_WIDTH, C_SUCCESS_BRIGHT)
+        if not best_formulas:
+            print_box_line("No formulas met reliability criteria.", BOX_WIDTH, C_SUCCESS_BRIGHT, tc=C_INFO_BRIGHT, align="center")
+        else:
+            for i, res in enumerate(best_formulas[:15]):
+                anks_str = ' '.join(map(str, res['sample_anks']))
+                line_str = f"{res['name']:<30} | {str(res['x']):>3} | {res['rate']:>6.2f} | {res['shrunk_rate'] * 100:>6.2f} | {str(res['passes'])+'/'+str(res['tests']):>7} | {anks_str}"
+                significant = res['q_value'] <= SIGNIFICANCE_LEVEL
+                print_box_line(line_str, BOX_WIDTH, C_SUCCESS_BRIGHT, tc=C_SUCCESS_BRIGHT if significant else C_PRIMARY, p=1)
+            print_box_sep(BOX_WIDTH, C_SUCCESS_BRIGHT)
+            print_box_line(f"Ranked by hit rate shrunk toward the {int(CHANCE_HUNDREDTHS_BY_SIZE[ANKS_PER_SUGGESTION])}% chance rate of {ANKS_PER_SUGGESTION} anks", BOX_WIDTH, C_SUCCESS_BRIGHT, tc=C_INFO_BRIGHT, p=1)
+        print_box_bottom(BOX_WIDTH, C_SUCCESS_BRIGHT)
 
     if best_formulas and historical_data:
-        latest_jodi_val = historical_data[-1]["jodi_val"]
-        latest_jodi_date_obj = historical_data[-1]["date_obj"]
+        latest_jodi_val = historical_data[-1].jodi
+        latest_jodi_date_obj = historical_data[-1].date_obj
         prediction_for_date_obj = latest_jodi_date_obj + timedelta(days=1) # Calculate next day's date
         prediction_for_date_str = prediction_for_date_obj.strftime("%d-%m-%Y")
 
         top_formula_spec = best_formulas[0]
-        formula_to_use = FORMULAS[top_formula_spec['name']]
+        formula_to_use = formulas[top_formula_spec['name']]
         x_to_use = top_formula_spec['x']
         try:
             prediction_result_val = formula_to_use(latest_jodi_val, x_to_use)
@@ -301,15 +607,21 @@ def main():
             print_box_bottom(BOX_WIDTH, C_PRIMARY_BRIGHT)
 
             # Save the suggestion
-            save_daily_suggestion(selected_market, prediction_for_date_str, top_formula_spec['name'], x_to_use, predicted_anks_for_tomorrow)
+            save_daily_suggestion(selected_market, prediction_for_date_str, top_formula_spec, predicted_anks_for_tomorrow)
 
         except Exception as e: print(C_ERROR_BRIGHT + f"Error during prediction: {e}")
 
-if __name__ == "__main__":
-    try: main()
-    except KeyboardInterrupt: print(C_WARNING_BRIGHT + "\n\n[!] User interrupted." + C_RESET)
+def run(argv=None, prog=None):
+    """ Command line entry point (also matka.py's subcommand): parse argv, run main, report crashes. """
+    cli_args = parse_args(argv, prog)
+    try: main(cli_args)
+    except KeyboardInterrupt: print(C_WARNING_BRIGHT + "\n\n[!] User interrupted." + C_RESET, file=sys.stderr)
     except Exception as e:
-        print(C_ERROR_BRIGHT + f"\n[!!!] Critical error: {e}")
+        print(C_ERROR_BRIGHT + f"\n[!!!] Critical error: {e}", file=sys.stderr)
         # import traceback; traceback.print_exc() 
-        print(C_ERROR_BRIGHT + "      Please report." + C_RESET)
-    finally: print(C_PRIMARY_BRIGHT + f"\n✨ Thank you for using {APP_NAME}! Good luck! ✨" + C_RESET)
+        print(C_ERROR_BRIGHT + "      Please report." + C_RESET, file=sys.stderr)
+    finally:
+        if cli_args.format == "box": print(C_PRIMARY_BRIGHT + f"\n✨ Thank you for using {APP_NAME}! Good luck! ✨" + C_RESET)
+
+if __name__ == "__main__":
+    run()
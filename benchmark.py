@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# MATKA BENCHMARK v1.0
+# Times the parse / backtest / suggestion stages of every analyzer on synthetic histories
+
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+from datetime import date, datetime, timedelta
+
+import market_data
+from matka import SUBCOMMANDS, load_script
+
+# --- Configuration & Constants ---
+APP_NAME = "MATKA BENCHMARK"
+APP_VERSION = "v1.0"
+DEFAULT_SIZES = [1000, 10000, 100000] # Days of synthetic history
+DEFAULT_SCRIPTS = ["mein", "otc_math_analyzer", "777", "main2"]
+DEFAULT_REPEAT = 3 # Each stage is run this many times; the fastest run is reported
+SYNTH_START_DATE = date(1990, 1, 1)
+SYNTH_SEED = 777
+BENCH_MARKET = "BENCH-{days}" # Synthetic market file name (without .txt)
+
+# --- Synthetic Histories ---
+# Panels follow the usual matka rule: three digits in ascending order with 0 ranked as 10,
+# and the jodi is (p1 digit sum % 10, p2 digit sum % 10).
+def random_panel(rng):
+    digits = sorted((rng.randint(0, 9) for _ in range(3)), key=lambda d: d or 10)
+    return "".join(map(str, digits))
+
+def synthetic_lines(days, seed=SYNTH_SEED):
+    """ Yields `days` result lines in the DD-MM-YYYY / PPP - JJ - PPP format, one per consecutive day. """
+    rng = random.Random(seed)
+    for i in range(days):
+        p1, p2 = random_panel(rng), random_panel(rng)
+        jodi = f"{sum(map(int, p1)) % 10}{sum(map(int, p2)) % 10}"
+        yield f"{(SYNTH_START_DATE + timedelta(days=i)).strftime('%d-%m-%Y')} / {p1} - {jodi} - {p2}\n"
+
+def write_synthetic_market(data_dir, days, seed=SYNTH_SEED):
+    filepath = os.path.join(data_dir, BENCH_MARKET.format(days=days) + ".txt")
+    with open(filepath, 'w', encoding='utf-8') as f: f.writelines(synthetic_lines(days, seed))
+    return filepath
+
+# --- Stages ---
+# Each bench_* function returns {stage: callable}; stages run in order and share `state`.
+def bench_mein(m, market, filepath, state):
+    def parse(): state["h"] = m.read_data_file(market)
+    def backtest(): state["stats"] = m.backtest_all_formulas(state["h"])
+    def suggest():
+        return m.get_otc_suggestions_for_tomorrow(state["h"][-1], m.eligible_formulas(state["stats"]))
+    return {"parse": parse, "backtest": backtest, "suggest": suggest}
+
+def bench_otc_math_analyzer(m, market, filepath, state):
+    def parse(): state["h"] = m.read_data_file(market)
+    def backtest(): state["stats"] = m.backtest_all_formulas(state["h"])
+    def suggest(): return m.get_otc_suggestions_for_tomorrow(state["h"][-1], state["stats"])
+    return {"parse": parse, "backtest": backtest, "suggest": suggest}
+
+def bench_777(m, market, filepath, state):
+    m.get_ank_table() # One-time table build is not part of any stage
+    def parse(): state["h"] = m.load_market_data_for_math(os.path.basename(filepath))
+    def backtest(): state["best"] = m.run_backtester(state["h"], m.get_formulas("fast"), {}, state.get("workers"))
+    def suggest():
+        top = state["best"][0]
+        return m.predict_anks(m.get_formulas("fast"), top["name"], state["h"][-1].jodi, top["x"], m.get_ank_table())
+    return {"parse": parse, "backtest": backtest, "suggest": suggest}
+
+def bench_main2(m, market, filepath, state):
+    def parse(): state["h"] = m.read_data_file(market)
+    def backtest():
+        state["tables"] = m.analyze_sequences(state["h"])
+        state["models"] = m.build_markov_models(state["h"])
+    def suggest():
+        j2j, oa2oa = state["tables"]
+        return (m.get_suggestions_from_sequences(state["h"][-1], j2j, m.NUM_JODI_SUGGESTIONS),
+                m.get_suggestions_from_sequences(state["h"][-1], oa2oa, m.NUM_OPEN_ANK_SUGGESTIONS),
+                [m.markov_suggestions(model, state["h"], m.NUM_MARKOV_SUGGESTIONS) for model in state["models"]])
+    return {"parse": parse, "backtest": backtest, "suggest": suggest}
+
+BENCHES = {"mein": bench_mein, "otc_math_analyzer": bench_otc_math_analyzer, "777": bench_777, "main2": bench_main2}
+
+def time_stage(func, repeat, before=None):
+    """ Fastest of `repeat` runs of func (seconds); before() runs untimed ahead of each run. """
+    best = None
+    for _ in range(repeat):
+        if before: before()
+        start = time.perf_counter(); func(); elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run_benchmarks(sizes, scripts, repeat, workers=None):
+    results = []
+    data_dir = tempfile.mkdtemp(prefix="matka_bench_")
+    try:
+        files = {days: write_synthetic_market(data_dir, days) for days in sizes}
+        for name in scripts:
+            module = load_script(name)
+            module.DATA_DIR = data_dir
+            for days in sizes:
+                market, filepath = BENCH_MARKET.format(days=days), files[days]
+                state = {"workers": workers}
+                with contextlib.redirect_stdout(io.StringIO()):
+                    stages = BENCHES[name](module, market, filepath, state)
+                    def drop_cache():
+                        try: os.remove(market_data.get_cache_filepath(filepath))
+                        except OSError: pass
+                    timings = {"parse_cold": time_stage(stages["parse"], repeat, drop_cache)} # Text parse + cache build
+                    for stage, func in stages.items(): timings[stage] = time_stage(func, repeat)
+                for stage, seconds in timings.items():
+                    results.append({"script": name, "days": days, "stage": stage, "seconds": round(seconds, 6)})
+                print(f"{name:<18} {days:>7} days  " + "  ".join(f"{stage} {seconds*1000:9.2f}ms" for stage, seconds in timings.items()), file=sys.stderr)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+        for days in sizes: # Compiled caches of the synthetic files live in the shared CACHE_DIR
+            try: os.remove(market_data.get_cache_filepath(os.path.join(data_dir, BENCH_MARKET.format(days=days) + ".txt")))
+            except OSError: pass
+    return results
+
+# --- Cold Start ---
+# Wall time of a fresh interpreter running `matka.py <command> --help`: interpreter startup,
+# the dispatcher and the import of one script, which is what every cron-driven call pays first.
+def run_cold_start(scripts, repeat):
+    matka_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "matka.py")
+    commands = {script: command for command, (script, _) in SUBCOMMANDS.items()}
+    runs = {"python": [sys.executable, "-c", "pass"], "matka": [sys.executable, matka_py, "--help"],
+            **{name: [sys.executable, matka_py, commands[name], "--help"] for name in scripts}}
+    results = []
+    for name, cmd in runs.items():
+        seconds = time_stage(lambda: subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True), repeat)
+        results.append({"script": name, "days": 0, "stage": "cold_start", "seconds": round(seconds, 6)})
+        print(f"{name:<18} cold start {seconds*1000:9.2f}ms", file=sys.stderr)
+    return results
+
+def compare_results(results, baseline_path):
+    """ Prints each stage's time against a previous JSON report to stderr (ratio > 1 = slower now). """
+    try:
+        with open(baseline_path, 'r', encoding='utf-8') as f: baseline = json.load(f)
+    except (OSError, ValueError) as e: print(f"[!] Could not read baseline {baseline_path}: {e}", file=sys.stderr); return
+    previous = {(r["script"], r["days"], r["stage"]): r["seconds"] for r in baseline.get("results", [])}
+    print(f"\nCompared with {baseline_path}:", file=sys.stderr)
+    for r in results:
+        before = previous.get((r["script"], r["days"], r["stage"]))
+        if not before: continue
+        ratio = r["seconds"] / before
+        flag = "  <-- slower" if ratio > 1.2 else ""
+        print(f"{r['script']:<18} {r['days']:>7} {r['stage']:<11} {before*1000:9.2f}ms -> {r['seconds']*1000:9.2f}ms  x{ratio:.2f}{flag}", file=sys.stderr)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=f"{APP_NAME} {APP_VERSION}")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="History lengths in days (default: 1k 10k 100k)")
+    parser.add_argument("--scripts", nargs="+", choices=list(BENCHES), default=DEFAULT_SCRIPTS, help="Analyzers to benchmark")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Runs per stage; the fastest is reported")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for 777.py's backtest (default: its own default)")
+    parser.add_argument("--cold-start", action="store_true", help="Also time a fresh `matka.py <command> --help` process per script")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file (default: stdout; progress and comparisons go to stderr)")
+    parser.add_argument("--compare", default=None, metavar="JSON", help="Previous JSON report to compare against")
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+    results = run_benchmarks(args.sizes, args.scripts, max(1, args.repeat), args.workers)
+    if args.cold_start: results += run_cold_start(args.scripts, max(1, args.repeat))
+    report = {
+        "app_version": APP_VERSION, "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+        "repeat": args.repeat, "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f: json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}", file=sys.stderr)
+    else: print(json.dumps(report, indent=2))
+    if args.compare: compare_results(results, args.compare)
+
+if __name__ == "__main__":
+    try: main()
+    except KeyboardInterrupt: print("\n[!] Benchmark interrupted.", file=sys.stderr)
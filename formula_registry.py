@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# FORMULA REGISTRY v1.0
+# OTC ank formula families, declared once and shared by the analyzer scripts
+
+from collections import OrderedDict
+from itertools import product
+
+from market_data import ank_mask
+
+# --- Family Registry ---
+# A family is declared once, with a builder and its default parameter grid. The builder
+# gets one grid point's params and returns a specialised evaluator, day -> 10-bit ank mask
+# (see market_data.ank_mask), with the params already parsed and bound. So evaluating a
+# formula costs one closure call, with no dict lookups, int() casts or try/except per day.
+FORMULA_FAMILIES = {}
+
+def param_grid(**axes):
+    """ Cartesian product of parameter axes as a list of params dicts, e.g. param_grid(X=range(3)). """
+    return [dict(zip(axes, values)) for values in product(*axes.values())]
+
+def formula_family(name, grid=None, formula_id=None, display=None):
+    """
+    Decorator registering a family builder under `name`.
+    grid: default list of params dicts (None = one parameterless variant).
+    formula_id / display: params -> str, the default formula id and display name of a variant.
+    """
+    def register(builder):
+        FORMULA_FAMILIES[name] = {
+            "name": name, "builder": builder, "grid": grid if grid is not None else [{}],
+            "formula_id": formula_id or (lambda p: name), "display": display or (lambda p: name),
+        }
+        return builder
+    return register
+
+def _family_variants(entry):
+    """ (f_id, params, display, family) for every grid point of a formula set entry, in grid order. """
+    family = FORMULA_FAMILIES[entry["family"]]
+    formula_id, display = entry.get("formula_id", family["formula_id"]), entry.get("display", family["display"])
+    return [(formula_id(p), p, display(p), family) for p in entry.get("grid", family["grid"])]
+
+def compile_formula_set(formula_set):
+    """
+    Compiles a script's formula set into its ALL_FORMULA_SPECS dict:
+        {f_id: {"func": evaluator(day) -> mask, "params", "display", "family", "type"}}
+    Each entry is {"family": name} plus optional "grid" / "formula_id" / "display" overrides.
+    A list of entries is interleaved variant by variant (for scripts that order them that way).
+    """
+    specs = {}
+    for entry in formula_set:
+        if isinstance(entry, list):
+            groups = [_family_variants(e) for e in entry]
+            variants = [v for row in zip(*groups) for v in row]
+        else: variants = _family_variants(entry)
+        for f_id, params, display, family in variants:
+            if f_id in specs: raise ValueError(f"Duplicate formula id: {f_id}")
+            specs[f_id] = {"func": family["builder"](**params), "params": params, "display": display,
+                           "family": family["name"], "type": "ank"}
+    return specs
+
+# --- Output Caches ---
+# A compiled evaluator is a pure function of the previous day's (p1, jodi, p2), and histories
+# repeat those inputs (more so across the markets of one run). So formula outputs are kept per
+# distinct day signature, in one cache per compiled specs dict: each signature is evaluated once,
+# whichever market or backtest meets it first. Only the OUTPUT_CACHE_SLOTS most recently used
+# specs dicts keep their cache, so the per-market dicts of --search runs (and the rebuilds of a
+# long-running service) are dropped instead of piling up; the shared registry dict stays hot.
+def day_signature(day):
+    """ A DayRecord's (p1, jodi, p2) packed into one int. """
+    return (day.p1 * 100 + day.jodi) * 1000 + day.p2
+
+class OutputCache:
+    """ The masks of every formula of a specs dict (in specs order), per day signature. """
+    def __init__(self, specs):
+        self.funcs = [spec["func"] for spec in specs.values()]
+        self.outputs = {} # signature -> tuple of masks
+
+    def masks(self, day, signature=None):
+        signature = day_signature(day) if signature is None else signature
+        masks = self.outputs.get(signature)
+        if masks is None: masks = self.outputs[signature] = tuple(evaluate(day) for evaluate in self.funcs)
+        return masks
+
+OUTPUT_CACHE_SLOTS = 8 # Specs dicts whose output cache is kept (least recently used is dropped first)
+_OUTPUT_CACHES = OrderedDict() # id(specs) -> (specs, cache); holding specs keeps its id from being reused
+
+def output_cache(specs, factory=OutputCache):
+    """ The output cache of a compiled specs dict, built by factory(specs) on first use (see above). """
+    entry = _OUTPUT_CACHES.get(id(specs))
+    if entry is None:
+        entry = _OUTPUT_CACHES[id(specs)] = (specs, factory(specs))
+        while len(_OUTPUT_CACHES) > OUTPUT_CACHE_SLOTS: _OUTPUT_CACHES.popitem(last=False)
+    else: _OUTPUT_CACHES.move_to_end(id(specs))
+    return entry[1]
+
+# --- Formula Families ---
+# Builders validate their params once (a bad grid fails at compile time, not per day).
+
+@formula_family("jodi_digits", formula_id=lambda p: "JodiDigits_default", display=lambda p: "Jodi Digits")
+def jodi_digits():
+    return lambda day: (1 << day.jodi_d1) | (1 << day.jodi_d2)
+
+@formula_family("open_close_anks", formula_id=lambda p: "OpenCloseAnks_default", display=lambda p: "Open & Close Anks")
+def open_close_anks():
+    return lambda day: (1 << day.open_ank) | (1 << day.close_ank)
+
+@formula_family("jodi_sum_diff", formula_id=lambda p: "JodiSumDiff_default", display=lambda p: "Jodi Sum & Diff")
+def jodi_sum_diff():
+    return lambda day: ank_mask((day.jodi_d1 + day.jodi_d2) % 10, abs(day.jodi_d1 - day.jodi_d2))
+
+@formula_family("fixed_offset", grid=param_grid(offset=range(10)),
+                formula_id=lambda p: f"FixedOffset_off{p['offset']}", display=lambda p: f"Fixed Offset Ank (X={p['offset']})")
+def fixed_offset(offset):
+    offset = int(offset)
+    return lambda day: (1 << (day.open_ank + offset) % 10) | (1 << (day.close_ank + offset) % 10)
+
+@formula_family("panel_sum_ank", grid=param_grid(panel_type=["p1", "p2"]),
+                formula_id=lambda p: f"PanelSumAnk_{p['panel_type']}", display=lambda p: f"{p['panel_type'].upper()} Panel Sum Ank")
+def panel_sum_ank(panel_type):
+    if panel_type == "p1": return lambda day: 1 << sum(day.p1_digits) % 10
+    if panel_type == "p2": return lambda day: 1 << sum(day.p2_digits) % 10
+    raise ValueError(f"Unknown panel_type: {panel_type}")
+
+@formula_family("sum_jodi_digits_plus_x", grid=param_grid(X=range(10)),
+                formula_id=lambda p: f"SumJodiDigits_X{p['X']}", display=lambda p: f"SumJodi+({p['X']})")
+def sum_jodi_digits_plus_x(X):
+    x = int(X)
+    return lambda day: 1 << (day.jodi_d1 + day.jodi_d2 + x) % 10
+
+@formula_family("diff_jodi_digits_plus_x", grid=param_grid(X=range(10)),
+                formula_id=lambda p: f"DiffJodiDigits_X{p['X']}", display=lambda p: f"DiffJodi+({p['X']})")
+def diff_jodi_digits_plus_x(X):
+    x = int(X)
+    return lambda day: 1 << (abs(day.jodi_d1 - day.jodi_d2) + x) % 10
+
+@formula_family("sum_oc_anks_plus_x", grid=param_grid(X=range(10)),
+                formula_id=lambda p: f"SumOCAnks_X{p['X']}", display=lambda p: f"SumO+C+({p['X']})")
+def sum_oc_anks_plus_x(X):
+    x = int(X)
+    return lambda day: 1 << (day.open_ank + day.close_ank + x) % 10
+
+def _ank_short(ank_type): return "OA" if ank_type == "open_ank" else "CA"
+
+@formula_family("ank_plus_x_and_cut", grid=param_grid(ank_type=["open_ank", "close_ank"], X=range(5)),
+                formula_id=lambda p: f"AnkPlusXCut_{_ank_short(p['ank_type'])}_X{p['X']}",
+                display=lambda p: f"{_ank_short(p['ank_type'])}+{p['X']} & Cut")
+def ank_plus_x_and_cut(ank_type, X):
+    """ Takes a specific ank (open or close), adds X, and returns that ank and its cut (+5). """
+    x = int(X)
+    if ank_type not in ("open_ank", "close_ank"): raise ValueError(f"Unknown ank_type: {ank_type}")
+    masks = [ank_mask((a + x) % 10, (a + x + 5) % 10) for a in range(10)] # Base ank and cut, per ank value
+    if ank_type == "open_ank": return lambda day: masks[day.open_ank]
+    return lambda day: masks[day.close_ank]
+
+PANEL_DIGIT_OPS = {"add": ("+", lambda a, b: a + b), "sub": ("-", lambda a, b: abs(a - b)), "mul": ("*", lambda a, b: a * b)}
+
+@formula_family("panel_digit_op_plus_x",
+                grid=[{"panel": panel, "idx1": i1, "idx2": i2, "op": op, "X": x} # Only few X for panel ops
+                      for panel in ["p1", "p2"] for i1, i2 in [(0, 1), (0, 2), (1, 2)] for op in PANEL_DIGIT_OPS for x in [0, 1, 5]],
+                formula_id=lambda p: f"PanelOp_{p['panel'].upper()}{p['idx1']}{PANEL_DIGIT_OPS[p['op']][0]}{p['idx2']}_X{p['X']}",
+                display=lambda p: f"{p['panel'].upper()}[{p['idx1']}]{PANEL_DIGIT_OPS[p['op']][0]}[{p['idx2']}]+{p['X']}")
+def panel_digit_op_plus_x(panel, idx1, idx2, op, X):
+    """ Operates on two digits of a panel and adds X. The op is resolved into a 10x10 lookup once. """
+    i1, i2, x = idx1, idx2, int(X)
+    if panel not in ("p1", "p2") or not (0 <= i1 <= 2 and 0 <= i2 <= 2): raise ValueError(f"Bad panel/idx: {panel} {idx1} {idx2}")
+    op_func = PANEL_DIGIT_OPS[op][1]
+    masks = [[1 << (op_func(a, b) + x) % 10 for b in range(10)] for a in range(10)]
+    if panel == "p1": return lambda day: masks[day.p1_digits[i1]][day.p1_digits[i2]]
+    return lambda day: masks[day.p2_digits[i1]][day.p2_digits[i2]]
+
+# --- Composed Formulas ---
+# Generated compositions of the primitive terms of a day (jodi digits, panel digits, O/C anks)
+# with add / sub / mul, plus an offset X and optionally the cut (+5) ank. An expression is
+# (terms, ops), evaluated left to right: ((t0 op0 t1) op1 t2) ...
+COMPOSE_TERMS = {
+    "jodi_d1": ("JD1", lambda day: day.jodi_d1), "jodi_d2": ("JD2", lambda day: day.jodi_d2),
+    "open_ank": ("OA", lambda day: day.open_ank), "close_ank": ("CA", lambda day: day.close_ank),
+    **{f"{panel}_{i}": (f"{panel.upper()}[{i}]", (lambda day, attr=f"{panel}_digits", i=i: getattr(day, attr)[i]))
+       for panel in ("p1", "p2") for i in range(3)},
+}
+COMPOSE_OPS = ("add", "sub", "mul") # Same ops as PANEL_DIGIT_OPS (sub = absolute difference)
+
+def generate_expressions(max_terms=3):
+    """
+    Every distinct composition of up to max_terms different terms, as (terms, ops) tuples.
+    add/sub/mul are commutative, so pairs are unordered; (a op b) op c with op in add/mul
+    on both sides is only kept once per set of terms.
+    """
+    names = list(COMPOSE_TERMS)
+    expressions = [((t,), ()) for t in names]
+    if max_terms < 2: return expressions
+    for i, a in enumerate(names):
+        for b in names[i+1:]:
+            expressions.extend(((a, b), (op,)) for op in COMPOSE_OPS)
+    if max_terms < 3: return expressions
+    for i, a in enumerate(names):
+        for j in range(i + 1, len(names)):
+            b = names[j]
+            for c in names:
+                if c in (a, b): continue
+                for op1 in COMPOSE_OPS:
+                    for op2 in COMPOSE_OPS:
+                        if op1 == op2 and op1 != "sub" and names.index(c) < j: continue # Same set as a+b+c in order
+                        expressions.append(((a, b, c), (op1, op2)))
+    return expressions
+
+def expression_str(terms, ops):
+    text = COMPOSE_TERMS[terms[0]][0]
+    for op, term in zip(ops, terms[1:]):
+        text = f"{text}{PANEL_DIGIT_OPS[op][0]}{COMPOSE_TERMS[term][0]}"
+        if term != terms[-1]: text = f"({text})"
+    return text
+
+def composed_grid(max_terms=3, x_values=range(10), cut_values=(False, True)):
+    """ Full params grid of the composed family: every expression x every X x cut / no cut. """
+    return [{"terms": terms, "ops": ops, "X": x, "cut": cut}
+            for terms, ops in generate_expressions(max_terms) for x in x_values for cut in cut_values
+            if not (cut and x % 10 >= 5)] # With the cut, X and X+5 give the same pair of anks
+
+@formula_family("composed", grid=[],
+                formula_id=lambda p: f"Compose_{expression_str(p['terms'], p['ops'])}_X{p['X']}" + ("_Cut" if p["cut"] else ""),
+                display=lambda p: f"{expression_str(p['terms'], p['ops'])}+{p['X']}" + (" & Cut" if p["cut"] else ""))
+def composed(terms, ops, X, cut):
+    """ Compiles an expression into nested closures; the result ank (and its cut) is a table lookup. """
+    if len(ops) != len(terms) - 1: raise ValueError(f"Bad expression: {terms} {ops}")
+    x = int(X)
+    value = COMPOSE_TERMS[terms[0]][1]
+    for op, term in zip(ops, terms[1:]):
+        value = (lambda left, right, op_func: lambda day: op_func(left(day), right(day)))(value, COMPOSE_TERMS[term][1], PANEL_DIGIT_OPS[op][1])
+    masks = [ank_mask((r + x) % 10, (r + x + 5) % 10) if cut else 1 << (r + x) % 10 for r in range(10)]
+    return lambda day: masks[value(day) % 10]
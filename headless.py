@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# HEADLESS OUTPUT v1.0
+# JSON lines / CSV record output for scheduled, non-interactive runs of the analyzer scripts
+
+import os
+import sys
+import csv
+import json
+
+# --- Configuration & Constants ---
+OUTPUT_FORMATS = ("box", "json", "csv") # box = the normal interactive colour/box display
+
+def add_output_arguments(parser, market_help="Market to analyze non-interactively (default with --format json/csv: all markets)"):
+    """ Adds the shared --format / --market options to a script's argument parser. """
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="box",
+                        help="Output format: box (interactive display), json (one JSON object per line) or csv. "
+                             "json/csv skip the banner, colours and boxes; progress and warnings go to stderr")
+    parser.add_argument("--market", default=None, help=market_help)
+
+def plain_colors(namespace):
+    """ Blanks the C_* colour constants of a script (pass its globals()) so headless stderr stays plain text. """
+    for name, value in list(namespace.items()):
+        if name.startswith("C_") and isinstance(value, str): namespace[name] = ""
+
+# --- Record Writer ---
+# A record is a flat dict with a "record" kind (e.g. "formula_stat", "suggestion") and a
+# "market". JSON lines write it as is; CSV writes one header of `fields` and one row per record,
+# leaving out fields a record does not have. Lists become space separated, dicts become JSON.
+class RecordWriter:
+    """ Writes result records to a stream as JSON lines or CSV. """
+    def __init__(self, fmt, fields, stream=None):
+        if fmt not in ("json", "csv"): raise ValueError(f"Not a headless format: {fmt}")
+        self.fmt, self.stream = fmt, stream or sys.stdout
+        self.csv_writer = csv.DictWriter(self.stream, fieldnames=list(fields), extrasaction="ignore") if fmt == "csv" else None
+        if self.csv_writer: self._quit_on_broken_pipe(self.csv_writer.writeheader)
+
+    def write(self, record):
+        if self.csv_writer: self.csv_writer.writerow({k: _csv_cell(v) for k, v in record.items()})
+        else: self.stream.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def write_all(self, records):
+        def write_and_flush():
+            for record in records: self.write(record)
+            self.stream.flush()
+        self._quit_on_broken_pipe(write_and_flush)
+
+    def _quit_on_broken_pipe(self, write):
+        # The reader went away (e.g. `... --format json | head`): point stdout at devnull so the exit
+        # flush cannot fail again, and stop quietly instead of raising through the crash report
+        try: write()
+        except BrokenPipeError:
+            if self.stream is sys.stdout: os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            raise SystemExit(1)
+
+def _csv_cell(value):
+    if isinstance(value, (list, tuple)): return " ".join(map(str, value))
+    if isinstance(value, dict): return json.dumps(value, separators=(",", ":"))
+    return value
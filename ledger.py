@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# SUGGESTION LEDGER v1.0
+# One append-only JSON lines ledger for the suggestions every analyzer logs
+
+import os
+import re
+import sys
+import json
+import argparse
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+try: import fcntl # POSIX advisory file locks
+except ImportError: fcntl = None
+try: import msvcrt # Windows byte-range locks
+except ImportError: msvcrt = None
+
+# --- Configuration & Constants ---
+APP_NAME = "SUGGESTION LEDGER"
+APP_VERSION = "v1.0"
+LEDGER_FILE = os.path.join("logs", "suggestions.jsonl")
+ENGINES = ("otc", "otc-math", "math-ank") # matka.py subcommands that log suggestions
+
+# --- Entries ---
+# One JSON object per line: {"market", "for_date", "engine", "formula", "anks", "logged_at", ...details}.
+# for_date (DD-MM-YYYY) is the result day the suggestion targets, i.e. the day after the last
+# result it was computed from. (market, for_date, engine, formula) identifies an entry: logging
+# the same key again is a no-op, so re-running an analyzer on the same data adds nothing.
+def entry_key(entry): return entry["market"], entry["for_date"], entry["engine"], entry["formula"]
+
+def make_entry(engine, market, for_date, formula, anks, **details):
+    """ A ledger entry; market may be a data file name (KALYAN.txt), anks ints or digit strings. """
+    if engine not in ENGINES: raise ValueError(f"Unknown engine: {engine}")
+    if market.endswith(".txt"): market = market[:-4]
+    return {"market": market, "for_date": for_date, "engine": engine, "formula": formula,
+            "anks": [int(a) for a in anks], "logged_at": datetime.now().isoformat(timespec="seconds"), **details}
+
+def _parse_lines(lines):
+    for line in lines:
+        try: entry = json.loads(line)
+        except ValueError: continue # Torn or hand-edited line
+        if isinstance(entry, dict) and all(k in entry for k in ("market", "for_date", "engine", "formula")): yield entry
+
+def read_entries(path=LEDGER_FILE):
+    """ Every entry in the ledger, in logged order ([] if there is no ledger yet). """
+    try:
+        with open(path, 'rb') as f: return list(_parse_lines(f))
+    except FileNotFoundError: return []
+
+def read_entries_from(path=LEDGER_FILE, offset=0):
+    """
+    (entries, end offset) of the complete lines after byte `offset`, for readers that follow the
+    ledger as it grows (a line still being written is returned by the next call).
+    """
+    try:
+        with open(path, 'rb') as f: f.seek(offset); data = f.read()
+    except FileNotFoundError: return [], offset
+    end = data.rfind(b"\n") + 1
+    return list(_parse_lines(data[:end].splitlines())), offset + end
+
+# --- Writing ---
+@contextmanager
+def _locked(f):
+    """ Holds an exclusive lock on an open ledger file; other writers wait for it. """
+    if fcntl: fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    elif msvcrt: f.seek(0); msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+    try: yield
+    finally:
+        if fcntl: fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        elif msvcrt: f.seek(0); msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def append_entries(entries, path=LEDGER_FILE):
+    """
+    Appends the entries whose key is not in the ledger yet, as one write under an exclusive lock,
+    so parallel runs (--all-markets workers, overlapping cron jobs) can share one ledger.
+    Returns the number of entries written.
+    """
+    if not entries: return 0
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'a+b') as f, _locked(f):
+        f.seek(0)
+        existing = f.read()
+        seen = {entry_key(e) for e in _parse_lines(existing.splitlines())}
+        lines = []
+        for entry in entries:
+            key = entry_key(entry)
+            if key in seen: continue
+            seen.add(key); lines.append(json.dumps(entry, separators=(",", ":")))
+        if lines:
+            torn = existing and not existing.endswith(b"\n") # A crashed writer's partial line stays on its own
+            f.write((("\n" if torn else "") + "\n".join(lines) + "\n").encode("utf-8"))
+            f.flush(); os.fsync(f.fileno())
+    return len(lines)
+
+# --- Legacy Text Logs ---
+# The per-script text logs written before the ledger: (engine, path, line pattern). Their formulas
+# are display names (math-ank: name(X=x)) and mein/otc dated them for the wall-clock tomorrow.
+_RATE = r"Rate: (?P<rate>\d+)% \((?P<hits>\d+)/(?P<tries>\d+)\)"
+LEGACY_LOGS = [
+    ("otc", os.path.join("logs", "otc_daily_suggestions.txt"),
+     re.compile(r"^[\d-]+ \(For (?P<for_date>[\d-]+)\) \| Market: (?P<market>[^|]+?) \| Formula: (?P<formula>.+?) \| " + _RATE + r" \| Suggested Anks: (?P<anks>[\d ]*)$")),
+    ("otc", os.path.join("logs", "daily_otc_ank_suggestions.txt"),
+     re.compile(r"^[\d-]+ \(For (?P<for_date>[\d-]+)\) \| Mkt: (?P<market>[^|]+?) \| Type: [^|]+ \| Formula: (?P<formula>.+?) \| " + _RATE + r" \| Sugg: (?P<anks>[\d ]*)$")),
+    ("otc-math", os.path.join("logs", "otc_math_daily_suggestions.txt"),
+     re.compile(r"^[\d-]+ \(For (?P<for_date>[\d-]+)\) \| Mkt: (?P<market>[^|]+?) \| Formula: (?P<formula>.+?) \| " + _RATE + r" \| Sugg\. Anks: (?P<anks>[\d ]*)$")),
+    ("math-ank", "daily_math_ank_suggestions.txt",
+     re.compile(r"^\[(?P<logged_at>[^\]]+)\] Market: (?P<market>[^,]+), For_Date: (?P<for_date>[\d-]+), Formula: (?P<formula>.+?), Suggested_Anks: \[(?P<anks>[\d ]*)\]$")),
+]
+
+def import_legacy_logs(path=LEDGER_FILE, legacy_logs=LEGACY_LOGS):
+    """ Copies the legacy text log lines into the ledger (once; repeated lines collapse on their key). Returns (read, written). """
+    entries = []
+    for engine, log_path, pattern in legacy_logs:
+        try:
+            with open(log_path, 'r', encoding='utf-8') as f: lines = f.read().splitlines()
+        except FileNotFoundError: continue
+        for line in lines:
+            m = pattern.match(line.strip())
+            if not m: continue
+            g = m.groupdict()
+            details = {"legacy": True}
+            if g.get("rate"): details.update(rate=float(g["rate"]), hits=int(g["hits"]), tries=int(g["tries"]))
+            entry = make_entry(engine, g["market"], g["for_date"], g["formula"], g["anks"].split(), **details)
+            if g.get("logged_at"):
+                try: entry["logged_at"] = datetime.strptime(g["logged_at"], "%d-%m-%Y %H:%M:%S").isoformat()
+                except ValueError: pass
+            entries.append(entry)
+    return len(entries), append_entries(entries, path)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=f"{APP_NAME} {APP_VERSION}")
+    parser.add_argument("--ledger", default=LEDGER_FILE, help=f"Ledger file (default: {LEDGER_FILE})")
+    parser.add_argument("--import-legacy", action="store_true", help="Copy the old per-script text logs into the ledger first")
+    return parser.parse_args(argv)
+
+def main(args=None):
+    args = args or parse_args()
+    if args.import_legacy:
+        read, written = import_legacy_logs(args.ledger)
+        print(f"Legacy logs: {read} lines read, {written} new entries written to {args.ledger}")
+    entries = read_entries(args.ledger)
+    print(f"{len(entries)} entries in {args.ledger}")
+    for (engine, market), count in sorted(Counter((e["engine"], e["market"]) for e in entries).items()):
+        print(f"  {engine:<9} {market:<16} {count:>5}")
+
+if __name__ == "__main__":
+    try: main()
+    except KeyboardInterrupt: print("\n[!] Interrupted.", file=sys.stderr)
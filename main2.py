@@ -4,13 +4,20 @@
 
 import os
 import sys
+import io
 import re
-from datetime import datetime, timedelta
+import argparse
+import contextlib
+from datetime import timedelta
 from collections import Counter, defaultdict
 
+import numpy as np
 from colorama import Fore, Style, init
 
-init(autoreset=True)
+from headless import RecordWriter, add_output_arguments, plain_colors
+from market_data import load_day_records
+from profiling import PROFILER, add_profile_argument, enable_profiling
+
 
 # --- Configuration & Constants ---
 APP_NAME = "SEQUENCE ANALYZER"
@@ -23,6 +30,18 @@ LOG_DIR = "logs" # For potential future logging
 NUM_JODI_SUGGESTIONS = 4
 NUM_OPEN_ANK_SUGGESTIONS = 3
 MIN_OCCURRENCES_FOR_STRONG_SUGGESTION = 2 # A sequence must have occurred at least this many times
+NUM_MARKOV_SUGGESTIONS = 3
+MIN_SEQUENCE_DAYS = 5 # Need at least a few days for sequence analysis
+# Markov chains: the last `order` values of `source` predict the next day's `target`.
+# Lookups back off to lower orders when the full context has no strong history.
+MARKOV_CHAINS = [
+    {"name": "Last 2 Jodis -> Jodi", "source": "jodi", "target": "jodi", "order": 2},
+    {"name": "Last 3 Jodis -> Jodi", "source": "jodi", "target": "jodi", "order": 3},
+    {"name": "Jodi -> Open Ank", "source": "jodi", "target": "open_ank", "order": 1},
+    {"name": "Last 2 Open Anks -> Open Ank", "source": "open_ank", "target": "open_ank", "order": 2},
+    {"name": "Panel 1 -> Close Ank", "source": "p1", "target": "close_ank", "order": 1},
+]
+MARKOV_MAX_ORDER = 7 # Contexts pack their order into the low 3 bits of the key
 
 # Color Palette
 C_PRIMARY_BRIGHT = Fore.CYAN + Style.BRIGHT; C_SECONDARY_BRIGHT = Fore.MAGENTA + Style.BRIGHT
@@ -43,6 +62,8 @@ MARKETS = [
 def print_box_top(w=BOX_WIDTH, c=C_SECONDARY_BRIGHT): print(c + f"╔{'═'*(w-2)}╗" + C_RESET)
 def print_box_bottom(w=BOX_WIDTH, c=C_SECONDARY_BRIGHT): print(c + f"╚{'═'*(w-2)}╝" + C_RESET)
 def print_box_sep(w=BOX_WIDTH, c=C_SECONDARY_BRIGHT): print(c + f"╠{'═'*(w-2)}╣" + C_RESET)
+def clear_screen(): # ANSI clear (colorama translates it on Windows) instead of spawning `clear` / `cls`
+    if sys.stdout.isatty(): print("\033[H\033[2J\033[3J", end="")
 def strip_ansi(t): return re.sub(r'\x1b\[[0-9;]*[mK]', '', t)
 def print_box_line(t, w=BOX_WIDTH, bc=C_SECONDARY_BRIGHT, tc="", align="left", p=2):
     st, cw = strip_ansi(t), w-2-(p*2); dsp_t = t; cl_diff = len(t)-len(st)
@@ -61,113 +82,159 @@ def print_box_line(t, w=BOX_WIDTH, bc=C_SECONDARY_BRIGHT, tc="", align="left", p
 
 # --- Core Logic Functions ---
 def show_banner():
-    os.system("clear" if os.name == 'posix' else 'cls'); print_box_top();
+    clear_screen(); print_box_top();
     print_box_line(f"{C_BANNER_TITLE}{APP_NAME}", align="center"); print_box_line(f"{C_BANNER_SUBTITLE}{APP_VERSION}", align="center")
     print_box_sep(); print_box_line(f"{C_BANNER_TEXT}Historical Sequence Pattern Suggester", align="center"); print_box_bottom(); print("\n")
 
-def parse_data_line(line_str):
-    try:
-        date_part_str, result_part_str = map(str.strip, line_str.split('/', 1))
-        p1, jodi, p2 = map(str.strip, result_part_str.split('-', 2))
-        if not (re.fullmatch(r"\d{3}",p1) and re.fullmatch(r"\d{2}",jodi) and re.fullmatch(r"\d{3}",p2)): return None
-        dt = datetime.strptime(date_part_str, "%d-%m-%Y")
-        return {"date_obj": dt, "date_str": date_part_str, "p1": p1, "jodi": jodi, "p2": p2, "open_ank": p1[-1], "close_ank": jodi[-1]}
-    except: return None
-
 def read_data_file(market_name):
     filepath = os.path.join(DATA_DIR, f"{market_name}.txt")
     try:
-        with open(filepath, 'r', encoding='utf-8') as f: lines = [line.strip() for line in f if line.strip()]
-        parsed_data = [parse_data_line(line) for line in lines]
-        # Sort by date just in case data is not perfectly ordered
-        return sorted([d for d in parsed_data if d is not None], key=lambda x: x['date_obj'])
+        # DayRecord objects, sorted by date just in case data is not perfectly ordered
+        return load_day_records(filepath)
     except FileNotFoundError: print(C_ERROR_BRIGHT + f"[!] File missing: {filepath}"); return []
     except Exception as e: print(C_ERROR_BRIGHT + f"[!] Read error {filepath}: {e}"); return []
 
+# --- Transition Matrices ---
+# field -> (number of distinct values, label format); values index the matrix rows/columns directly
+SEQUENCE_FIELDS = {"jodi": (100, "{:02d}"), "open_ank": (10, "{}"), "close_ank": (10, "{}"),
+                   "p1": (1000, "{:03d}"), "p2": (1000, "{:03d}")}
+
+def build_transition_table(field, values):
+    """
+    Dense next-day transition table for one field from its day-ordered int values
+    (jodi: 100x100, open_ank: 10x10), counted with a single np.add.at.
+    Returns dict: counts[a, b] = times b followed a, row totals, row-normalised probs, and
+    ranked[a] = next values by count desc, ties in first-seen order (as Counter.most_common).
+    """
+    size, label_fmt = SEQUENCE_FIELDS[field]
+    table = {"field": field, "labels": [label_fmt.format(v) for v in range(size)], "pairs": 0,
+             "counts": np.zeros((size, size), dtype=np.int64), "first_seen": np.zeros((size, size), dtype=np.int64)}
+    return extend_transition_table(table, values)
+
+def extend_transition_table(table, values):
+    """
+    Adds the transitions of day-ordered values to a table in place and re-ranks it. values[0] is
+    the last value already counted (so newly ingested days can be pushed in: [last] + new values).
+    first_seen[a, b] is the pair index of b's first appearance after a (the pair count if never seen).
+    """
+    prev_vals, next_vals = values[:-1], values[1:]
+    counts, start = table["counts"], table["pairs"]
+    pairs = start + len(prev_vals)
+    first_seen = np.full(counts.shape, pairs, dtype=np.int64)
+    np.minimum.at(first_seen, (prev_vals, next_vals), np.arange(start, pairs))
+    table["first_seen"] = np.where(counts > 0, table["first_seen"], first_seen)
+    np.add.at(counts, (prev_vals, next_vals), 1)
+    table["pairs"], table["totals"] = pairs, counts.sum(axis=1)
+    table["probs"] = counts / np.maximum(table["totals"], 1)[:, None]
+    table["ranked"] = np.lexsort((table["first_seen"], -counts), axis=-1)
+    return table
+
 def analyze_sequences(historical_data):
     """
     Analyzes sequences:
     - jodi_after_jodi: Counts which jodi follows a given jodi on the next day.
     - open_ank_after_open_ank: Counts which open_ank follows a given open_ank on the next day.
     Returns:
-        tuple: (jodi_after_jodi_counts, open_ank_after_open_ank_counts)
-               Each is a dict like: { "prev_value": Counter({"next_value1": count1, ...}), ... }
+        tuple: (jodi_after_jodi, open_ank_after_open_ank) transition tables (see build_transition_table)
     """
-    jodi_after_jodi = defaultdict(Counter)
-    open_ank_after_open_ank = defaultdict(Counter)
     # Add more sequence types here in future, e.g., open_ank_after_jodi
+    return tuple(build_transition_table(field, field_values(historical_data, field)) for field in ("jodi", "open_ank"))
 
-    if len(historical_data) < 2:
-        return jodi_after_jodi, open_ank_after_open_ank
+def extend_sequences(tables, days):
+    """ Pushes newly ingested days into analyze_sequences tables; days = [last day already counted] + new days. """
+    for table in tables: extend_transition_table(table, field_values(days, table["field"]))
+    return tables
 
-    for i in range(len(historical_data) - 1):
-        prev_day = historical_data[i]
-        curr_day = historical_data[i+1]
+def field_values(days, field):
+    return np.fromiter((getattr(d, field) for d in days), dtype=np.intp, count=len(days))
 
-        # Jodi -> Next Day's Jodi
-        jodi_after_jodi[prev_day["jodi"]][curr_day["jodi"]] += 1
-        
-        # Open Ank -> Next Day's Open Ank
-        open_ank_after_open_ank[prev_day["open_ank"]][curr_day["open_ank"]] += 1
-        
-    return jodi_after_jodi, open_ank_after_open_ank
+def top_transitions(table, prev_value, num_suggestions):
+    """ Row lookup: [(next_label, count, percentage_chance)] for the values most often seen after prev_value. """
+    if table["totals"][prev_value] == 0: return [] # No historical sequences found for this value
+    row, probs = table["counts"][prev_value], table["probs"][prev_value]
+    suggestions = []
+    for next_value in table["ranked"][prev_value][:num_suggestions]:
+        count = int(row[next_value])
+        if count >= max(MIN_OCCURRENCES_FOR_STRONG_SUGGESTION, 1): # Only suggest if it occurred a few times
+            suggestions.append((table["labels"][next_value], count, probs[next_value] * 100))
+    return suggestions
 
-def get_suggestions_from_sequences(latest_day_data, sequence_counts_dict, num_suggestions):
+def get_suggestions_from_sequences(latest_day_data, transition_table, num_suggestions):
     """
-    Gets suggestions based on the latest day's value and pre-calculated sequence counts.
+    Gets suggestions based on the latest day's value and a pre-calculated transition table.
     Args:
-        latest_day_value (str): The value from the latest day (e.g., last jodi or last open ank).
-        sequence_counts_dict (dict): The pre-calculated counts, e.g., jodi_after_jodi_counts.
+        latest_day_data (DayRecord): The latest day; the table's field (jodi / open_ank) is looked up on it.
+        transition_table (dict): From analyze_sequences / build_transition_table.
         num_suggestions (int): How many top suggestions to return.
     Returns:
         list: List of tuples (suggested_value, count, percentage_chance)
     """
     if not latest_day_data: return []
-    
-    # Determine the key to use from latest_day_data based on what sequence_counts_dict represents
-    # This is a bit implicit. Let's assume if sequence_counts_dict has keys like "00", "01" it's for jodi.
-    # If keys are "0", "1", it's for anks.
-    # A better way would be to pass the key explicitly.
-
-    latest_value_key = None
-    if all(len(k) == 2 and k.isdigit() for k in sequence_counts_dict.keys()): # Heuristic for jodi keys
-        latest_value_key = "jodi"
-    elif all(len(k) == 1 and k.isdigit() for k in sequence_counts_dict.keys()): # Heuristic for ank keys
-        latest_value_key = "open_ank" # Assuming open_ank for now
-    
-    if not latest_value_key or latest_value_key not in latest_day_data:
-        # Try to infer: if 'jodi' is in the name of the sequence_counts_dict variable (hacky)
-        # This part needs to be more robust. For now, this is a placeholder.
-        # The caller should ideally specify what 'latest_value' it's providing.
-        # For this version, we'll call this function specifically for jodi and anks.
-        print(C_WARNING + "Could not determine key for latest_day_data in get_suggestions_from_sequences")
-        return []
+    return top_transitions(transition_table, getattr(latest_day_data, transition_table["field"]), num_suggestions)
 
 
-    latest_value = latest_day_data[latest_value_key]
+# --- Markov Chains (order-k, cross-field) ---
+# Counts are sparse: {packed context: Counter(next target value)}, so memory grows with the
+# contexts actually seen, not with size**order. A context of order o over values v1..vo
+# (oldest first) packs to ((v1*size + v2)*size + ... + vo) * 8 + o.
 
-    if latest_value not in sequence_counts_dict:
-        return [] # No historical sequences found for this latest_value
-
-    following_counts = sequence_counts_dict[latest_value]
-    total_occurrences_after_latest = sum(following_counts.values())
-
-    if total_occurrences_after_latest == 0:
-        return []
-
-    suggestions = []
-    for suggested_val, count in following_counts.most_common():
-        if count >= MIN_OCCURRENCES_FOR_STRONG_SUGGESTION: # Only suggest if it occurred a few times
-            percentage = (count / total_occurrences_after_latest) * 100
-            suggestions.append((suggested_val, count, percentage))
-    
-    return suggestions[:num_suggestions]
+def pack_context(values, size):
+    ctx = 0
+    for v in values: ctx = ctx * size + v
+    return ctx * (MARKOV_MAX_ORDER + 1) + len(values)
 
+def build_markov_models(historical_data, chains=MARKOV_CHAINS):
+    """
+    Counts every chain, at every order 1..chain order (for backoff), in one pass over the history.
+    Returns a list of models: {"chain": spec, "counts": {ctx: Counter}, "totals": {ctx: int}}.
+    """
+    for chain in chains:
+        if not 1 <= chain["order"] <= MARKOV_MAX_ORDER: raise ValueError(f"Markov order must be 1-{MARKOV_MAX_ORDER}: {chain['name']}")
+    models = [{"chain": chain, "counts": defaultdict(Counter), "totals": Counter()} for chain in chains]
+    return extend_markov_models(models, [], historical_data)
 
-def display_sequence_suggestions(market_name, latest_day_data, jodi_suggestions, ank_suggestions):
-    tomorrow_date_str = (latest_day_data["date_obj"] + timedelta(days=1)).strftime('%d-%m-%Y (%A)')
-    last_jodi = latest_day_data["jodi"]
-    last_open_ank = latest_day_data["open_ank"]
+def extend_markov_models(models, recent_days, new_days):
+    """
+    Counts new_days into existing models in place. recent_days are the days already counted just
+    before them (oldest first; only the last max chain order are used), so newly ingested days
+    continue the contexts of the history. Returns models.
+    """
+    max_order = max((model["chain"]["order"] for model in models), default=0)
+    recent = list(recent_days[-max_order:]) if max_order else [] # Last max_order days before the current one, oldest first
+    for day in new_days:
+        for model in models:
+            chain = model["chain"]; size = SEQUENCE_FIELDS[chain["source"]][0]
+            next_value = getattr(day, chain["target"])
+            history = [getattr(d, chain["source"]) for d in recent[-chain["order"]:]]
+            for order in range(1, len(history) + 1):
+                ctx = pack_context(history[-order:], size)
+                model["counts"][ctx][next_value] += 1; model["totals"][ctx] += 1
+        recent.append(day)
+        if len(recent) > max_order: del recent[0]
+    return models
+
+def markov_suggestions(model, recent_days, num_suggestions):
+    """
+    Top next values for the context formed by recent_days (oldest first), backing off from the
+    chain's order to lower orders until a context has suggestions with enough occurrences.
+    Returns (order_used, [(label, count, percentage_chance)]); order_used is 0 if nothing qualified.
+    """
+    chain = model["chain"]; size = SEQUENCE_FIELDS[chain["source"]][0]; label_fmt = SEQUENCE_FIELDS[chain["target"]][1]
+    history = [getattr(d, chain["source"]) for d in recent_days[-chain["order"]:]]
+    for order in range(len(history), 0, -1):
+        ctx = pack_context(history[-order:], size)
+        total = model["totals"].get(ctx, 0)
+        if not total: continue
+        suggestions = [(label_fmt.format(value), count, count / total * 100)
+                       for value, count in model["counts"][ctx].most_common(num_suggestions)
+                       if count >= MIN_OCCURRENCES_FOR_STRONG_SUGGESTION]
+        if suggestions: return order, suggestions
+    return 0, []
+
+def display_sequence_suggestions(market_name, latest_day_data, jodi_suggestions, ank_suggestions, markov_results=None):
+    tomorrow_date_str = (latest_day_data.date_obj + timedelta(days=1)).strftime('%d-%m-%Y (%A)')
+    last_jodi = latest_day_data.jodi_str
+    last_open_ank = str(latest_day_data.open_ank)
 
     print_box_top(c=C_SUCCESS_BRIGHT)
     title = f"{C_ACCENT_BRIGHT}Sequence-Based Suggestions for {market_name} - {tomorrow_date_str}"
@@ -196,10 +263,127 @@ def display_sequence_suggestions(market_name, latest_day_data, jodi_suggestions,
             line = f"  {i+1}. {C_ACCENT_BRIGHT}{sugg_ank}{C_PRIMARY} (occurred {count} times, {percent:.0f}% chance)"
             print_box_line(C_PRIMARY + line, bc=C_SUCCESS_BRIGHT, p=1)
 
+    if markov_results:
+        print_box_sep(c=C_SUCCESS_BRIGHT)
+        print_box_line(f"{C_WARNING_BRIGHT}Markov Chain Suggestions:", bc=C_SUCCESS_BRIGHT, p=1)
+        for chain, order_used, suggestions in markov_results:
+            if not suggestions:
+                print_box_line(f"{C_PRIMARY}  {chain['name']}: no strong sequences found.", bc=C_SUCCESS_BRIGHT, p=1); continue
+            backoff = f" (backoff: order {order_used})" if order_used < chain["order"] else ""
+            picks = ", ".join(f"{C_ACCENT_BRIGHT}{val}{C_PRIMARY} {count}x/{percent:.0f}%" for val, count, percent in suggestions)
+            print_box_line(f"{C_PRIMARY}  {chain['name']}{backoff}: {picks}", bc=C_SUCCESS_BRIGHT, p=1)
+
     print_box_bottom(c=C_SUCCESS_BRIGHT)
 
 
-def main():
+def sequence_suggestions(market_name):
+    """
+    Load -> sequence analysis -> suggest for one market.
+    Returns (latest_day_data, jodi_suggestions, open_ank_suggestions, markov_results), or None if there is not enough data.
+    """
+    with PROFILER.stage("load"): historical_data = read_data_file(market_name)
+    if not historical_data or len(historical_data) < MIN_SEQUENCE_DAYS:
+        print(C_ERROR_BRIGHT+f"Not enough historical data for {market_name} (found {len(historical_data)}). Sequence analysis requires more entries."); return None
+
+    print(C_INFO_BRIGHT + f"Analyzing sequences from {len(historical_data)} historical records...")
+    with PROFILER.stage("backtest:transition tables"): tables = analyze_sequences(historical_data)
+    with PROFILER.stage("backtest:markov models"): markov_models = build_markov_models(historical_data)
+    return suggest_sequences(historical_data, tables, markov_models)
+
+def suggest_sequences(historical_data, tables, markov_models):
+    """ Suggestions from analyze_sequences tables and build_markov_models models (kept current with the extend_* functions). """
+    j2j_table, oa2oa_table = tables
+    latest_day_data = historical_data[-1]
+    with PROFILER.stage("ranking"):
+        jodi_suggestions = get_suggestions_from_sequences(latest_day_data, j2j_table, NUM_JODI_SUGGESTIONS)
+        open_ank_suggestions = get_suggestions_from_sequences(latest_day_data, oa2oa_table, NUM_OPEN_ANK_SUGGESTIONS)
+    markov_results = []
+    with PROFILER.stage("ranking"):
+        for model in markov_models:
+            order_used, suggestions = markov_suggestions(model, historical_data, NUM_MARKOV_SUGGESTIONS)
+            markov_results.append((model["chain"], order_used, suggestions))
+    return latest_day_data, jodi_suggestions, open_ank_suggestions, markov_results
+
+def analyze_market(market_name):
+    """ Load -> sequence analysis -> suggest -> display for one market. Returns False if there is not enough data. """
+    print(C_INFO_BRIGHT+f"\nAnalyzing Market: {C_ACCENT_BRIGHT}{market_name}{C_RESET}\n")
+    analyzed = sequence_suggestions(market_name)
+    if analyzed is None: return False
+    latest_day_data, jodi_suggestions, open_ank_suggestions, markov_results = analyzed
+
+    with PROFILER.stage("display"):
+        display_sequence_suggestions(market_name, latest_day_data, jodi_suggestions, open_ank_suggestions, markov_results)
+    return True
+
+# --- Headless Output (--format json / csv) ---
+HEADLESS_FIELDS = ("record", "market", "chain", "after", "order_used", "rank", "value", "count", "percent", "for_date")
+
+def market_records(market_name):
+    """ analyze_market without the display: one record per suggested jodi / open ank / Markov value ([] if not enough data). """
+    analyzed = sequence_suggestions(market_name)
+    if analyzed is None: return []
+    latest_day_data, jodi_suggestions, open_ank_suggestions, markov_results = analyzed
+    for_date = (latest_day_data.date_obj + timedelta(days=1)).strftime("%d-%m-%Y")
+    groups = [("jodi_suggestion", "Jodi -> Jodi", latest_day_data.jodi_str, 1, jodi_suggestions),
+              ("open_ank_suggestion", "Open Ank -> Open Ank", str(latest_day_data.open_ank), 1, open_ank_suggestions)]
+    groups += [("markov_suggestion", chain["name"], None, order_used, suggestions) for chain, order_used, suggestions in markov_results]
+    return [{"record": kind, "market": market_name, "chain": chain, "after": after, "order_used": order_used, "rank": rank,
+             "value": value, "count": count, "percent": round(percent, 2), "for_date": for_date}
+            for kind, chain, after, order_used, suggestions in groups
+            for rank, (value, count, percent) in enumerate(suggestions, 1)]
+
+def headless_market_batch(market_name):
+    """ Headless worker: one market's records; its progress and warnings go to stderr. """
+    plain_colors(globals()) # Workers that import the script afresh (spawn start method) start coloured
+    with contextlib.redirect_stdout(sys.stderr):
+        try: records = market_records(market_name)
+        except Exception as e: print(C_ERROR_BRIGHT+f"[!] Analysis failed for {market_name}: {e}"); records = []
+    return market_name, records, PROFILER.take()
+
+def run_headless(markets, fmt, max_workers=None):
+    """ Writes the records of every market to stdout as JSON lines or CSV, in market order (parallel for several markets). """
+    writer = RecordWriter(fmt, HEADLESS_FIELDS)
+    if len(markets) == 1: results = [headless_market_batch(markets[0])]
+    else:
+        from concurrent.futures import ProcessPoolExecutor # Only parallel runs pay for multiprocessing
+        with ProcessPoolExecutor(max_workers=max_workers) as pool: results = list(pool.map(headless_market_batch, markets))
+    for market_name, records, profile in results: writer.write_all(records); PROFILER.merge(profile)
+
+def run_market_batch(market_name):
+    """ --all-markets worker: analyzes one market with its output captured. """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try: analyze_market(market_name)
+        except Exception as e: print(C_ERROR_BRIGHT+f"[!] Analysis failed for {market_name}: {e}")
+    return market_name, output.getvalue(), PROFILER.take()
+
+def run_all_markets(max_workers=None):
+    """ Analyzes every market in parallel; output is printed in MARKETS order. """
+    from concurrent.futures import ProcessPoolExecutor
+    print(C_INFO_BRIGHT+f"Analyzing {len(MARKETS)} markets in parallel...")
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        for market_name, output, profile in pool.map(run_market_batch, MARKETS): print(output, end=""); PROFILER.merge(profile)
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description=f"{APP_NAME} {APP_VERSION}")
+    parser.add_argument("--all-markets", action="store_true", help="Analyze every market non-interactively, in parallel processes")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for --all-markets (default: CPU count)")
+    add_profile_argument(parser)
+    add_output_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(args=None):
+    args = args or parse_args()
+    if args.format == "box": init(autoreset=True) # Colour/box display only; json/csv stdout stays a plain stream
+    else: plain_colors(globals()) # json/csv: progress and warnings on stderr without colour codes
+    enable_profiling(args.profile, APP_NAME)
+    if args.format != "box":
+        run_headless([args.market] if args.market else MARKETS, args.format, args.workers); return
+    if args.all_markets: run_all_markets(args.workers); return
+    if args.market:
+        if not analyze_market(args.market): sys.exit(1)
+        return
+
     show_banner()
     # Market Selection
     print_box_top(w=BOX_WIDTH//2,c=C_PRIMARY_BRIGHT); print_box_line("Select Market",w=BOX_WIDTH//2,bc=C_PRIMARY_BRIGHT,align="center")
@@ -210,49 +394,19 @@ def main():
         try: mk_idx = int(input(C_PRIMARY_BRIGHT+"Enter market number: "+C_RESET))-1
         except ValueError: print(C_ERROR+"Invalid input.")
         if not (0 <= mk_idx < len(MARKETS)): print(C_ERROR+"Invalid choice.")
-    market_name = MARKETS[mk_idx]
-    print(C_INFO_BRIGHT+f"\nAnalyzing Market: {C_ACCENT_BRIGHT}{market_name}{C_RESET}\n")
-    
-    historical_data = read_data_file(market_name)
-    if not historical_data or len(historical_data) < 5: # Need at least a few days for sequence analysis
-        print(C_ERROR_BRIGHT+f"Not enough historical data for {market_name} (found {len(historical_data)}). Sequence analysis requires more entries."); sys.exit(1)
-
-    print(C_INFO_BRIGHT + f"Analyzing sequences from {len(historical_data)} historical records...")
-    j2j_counts, oa2oa_counts = analyze_sequences(historical_data)
+    if not analyze_market(MARKETS[mk_idx]): sys.exit(1)
 
-    latest_day_data = historical_data[-1]
-    
-    # Modify how get_suggestions_from_sequences is called to be more explicit
-    # For Jodi suggestions based on previous Jodi:
-    jodi_suggestions = []
-    if latest_day_data["jodi"] in j2j_counts:
-        following_counts = j2j_counts[latest_day_data["jodi"]]
-        total_occurrences = sum(following_counts.values())
-        if total_occurrences > 0:
-            for sugg_val, count in following_counts.most_common(NUM_JODI_SUGGESTIONS):
-                if count >= MIN_OCCURRENCES_FOR_STRONG_SUGGESTION:
-                    percentage = (count / total_occurrences) * 100
-                    jodi_suggestions.append((sugg_val, count, percentage))
-
-    # For Open Ank suggestions based on previous Open Ank:
-    open_ank_suggestions = []
-    if latest_day_data["open_ank"] in oa2oa_counts:
-        following_counts = oa2oa_counts[latest_day_data["open_ank"]]
-        total_occurrences = sum(following_counts.values())
-        if total_occurrences > 0:
-            for sugg_val, count in following_counts.most_common(NUM_OPEN_ANK_SUGGESTIONS):
-                if count >= MIN_OCCURRENCES_FOR_STRONG_SUGGESTION:
-                    percentage = (count / total_occurrences) * 100
-                    open_ank_suggestions.append((sugg_val, count, percentage))
-
-
-    display_sequence_suggestions(market_name, latest_day_data, jodi_suggestions, open_ank_suggestions)
 
+def run(argv=None, prog=None):
+    """ Command line entry point (also matka.py's subcommand): parse argv, run main, report crashes. """
+    cli_args = parse_args(argv, prog)
+    try: main(cli_args)
+    except KeyboardInterrupt: print(C_WARNING_BRIGHT+"\n\n[!] User interrupted."+C_RESET, file=sys.stderr)
+    except Exception as e:
+        print(C_ERROR_BRIGHT+f"\n[!!!] CRITICAL ERROR: {e}", file=sys.stderr); import traceback; traceback.print_exc()
+        print(C_ERROR_BRIGHT+"Please report this."+C_RESET, file=sys.stderr)
+    finally:
+        if cli_args.format == "box": print(C_PRIMARY_BRIGHT+f"\n✨ Thank you for using {APP_NAME}! ✨"+C_RESET)
 
 if __name__ == "__main__":
-    try: main()
-    except KeyboardInterrupt: print(C_WARNING_BRIGHT+"\n\n[!] User interrupted."+C_RESET)
-    except Exception as e:
-        print(C_ERROR_BRIGHT+f"\n[!!!] CRITICAL ERROR: {e}"); import traceback; traceback.print_exc()
-        print(C_ERROR_BRIGHT+"Please report this."+C_RESET)
-    finally: print(C_PRIMARY_BRIGHT+f"\n✨ Thank you for using {APP_NAME}! ✨"+C_RESET)
+    run()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# MARKET DATA STORE v1.0
+# Shared result parsing + compiled per-market cache used by all analyzer scripts
+
+import os
+import re
+import mmap
+import zlib
+import shutil
+import struct
+from datetime import date, datetime
+
+from profiling import PROFILER
+
+# --- Configuration & Constants ---
+CACHE_DIR = "cache"
+CACHE_MAGIC = b"MKTC"
+CACHE_VERSION = 3
+# Header: magic, version, source mtime (ns), source size, record count, records-in-date-order flag,
+# then how many source bytes the records were parsed from and their crc32 (see Incremental Ingest)
+CACHE_HEADER = struct.Struct("<4sHqqIBqI")
+# Record: date ordinal, p1 panel, jodi, p2 panel (all as integers)
+CACHE_RECORD = struct.Struct("<IHBH")
+
+# --- Ank Bitmasks ---
+# A set of anks (digits 0-9) is a 10-bit int: bit d set <=> ank d present. A formula
+# hit is then just `generated_mask & actual_mask != 0`, with no set/str allocation.
+ANK_MASK_DIGITS = [[str(d) for d in range(10) if m >> d & 1] for m in range(1 << 10)]
+
+def ank_mask(*anks):
+    """ Bitmask of integer anks, e.g. ank_mask(3, 7) == 0b0010001000. """
+    mask = 0
+    for a in anks: mask |= 1 << a
+    return mask
+
+def mask_to_anks(mask):
+    """ Sorted ank digit strings of a mask, for display (returns a fresh list). """
+    return list(ANK_MASK_DIGITS[mask])
+
+# --- Day Record ---
+class DayRecord:
+    """
+    One day's result with integer fields, shared by all analyzer scripts.
+    p1/jodi/p2 are ints (e.g. jodi 7 for "07"); the *_str properties give the zero-padded text.
+    """
+    __slots__ = ("ordinal", "p1", "jodi", "p2", "open_ank", "close_ank", "jodi_d1", "jodi_d2", "p1_digits", "p2_digits")
+
+    def __init__(self, ordinal, p1, jodi, p2):
+        self.ordinal, self.p1, self.jodi, self.p2 = ordinal, p1, jodi, p2
+        self.open_ank, self.close_ank = p1 % 10, jodi % 10
+        self.jodi_d1, self.jodi_d2 = jodi // 10, jodi % 10
+        self.p1_digits = (p1 // 100, p1 // 10 % 10, p1 % 10)
+        self.p2_digits = (p2 // 100, p2 // 10 % 10, p2 % 10)
+
+    @property
+    def date_obj(self): return datetime.fromordinal(self.ordinal)
+    @property
+    def date_str(self): return self.date_obj.strftime("%d-%m-%Y")
+    @property
+    def day_idx(self): return (self.ordinal - 1) % 7 # Monday = 0, same as datetime.weekday()
+    @property
+    def p1_str(self): return f"{self.p1:03d}"
+    @property
+    def jodi_str(self): return f"{self.jodi:02d}"
+    @property
+    def p2_str(self): return f"{self.p2:03d}"
+    @property
+    def all_digits_mask(self): return ank_mask(*self.p1_digits, self.jodi_d1, self.jodi_d2, *self.p2_digits)
+
+    def as_record(self): return (self.ordinal, self.p1, self.jodi, self.p2)
+    def __eq__(self, other): return isinstance(other, DayRecord) and self.as_record() == other.as_record()
+    def __hash__(self): return hash(self.as_record())
+    def __repr__(self): return f"DayRecord({self.date_str} / {self.p1_str} - {self.jodi_str} - {self.p2_str})"
+
+def parse_day_record(line_str):
+    """ Parses one result line into a DayRecord, or None if the line is not a valid result. """
+    record = parse_record(line_str)
+    return DayRecord(*record) if record else None
+
+# --- Line Parsing ---
+# One precompiled pattern validates and splits 'DD-MM-YYYY / PPP - JJ - PPP' in a single pass.
+RESULT_LINE_RE = re.compile(r"\s*(\d{1,2})-(\d{1,2})-(\d{4})\s*/\s*(\d{3})\s*-\s*(\d{2})\s*-\s*(\d{3})\s*")
+
+def parse_record(line_str):
+    """ Parses one result line into an (ordinal, p1, jodi, p2) int record, or None if invalid. """
+    m = RESULT_LINE_RE.fullmatch(line_str)
+    if not m: return None
+    day, month, year, p1, jodi, p2 = m.groups()
+    try: ordinal = date(int(year), int(month), int(day)).toordinal()
+    except ValueError: return None # e.g. 31-02-2025
+    return ordinal, int(p1), int(jodi), int(p2)
+
+def iter_market_file(filepath):
+    """ Lazily yields the (ordinal, p1, jodi, p2) records of a market file, in file order. """
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = parse_record(line)
+            if record: yield record
+
+# --- Incremental Ingest ---
+# Results are appended to a market file one line per day. A reader that remembers the byte
+# offset it has parsed up to, and the crc32 of those bytes, only has to parse what comes after
+# it. If the file got shorter than the offset, or the crc of its first `offset` bytes changed,
+# it was truncated or rewritten and has to be read in full again. (crc32 runs at memory speed,
+# far faster than parsing, so checking the whole prefix costs little even on long histories.)
+CRC_CHUNK = 1 << 20
+
+def prefix_crc(f, length):
+    """ crc32 of the first `length` bytes of binary file f (None if it is shorter); leaves f at `length`. """
+    f.seek(0)
+    crc, remaining = 0, length
+    while remaining > 0:
+        chunk = f.read(min(CRC_CHUNK, remaining))
+        if not chunk: return None
+        crc = zlib.crc32(chunk, crc); remaining -= len(chunk)
+    return crc
+
+def scan_lines(f, offset, crc):
+    """
+    Parses binary file f from its current position (`offset`, crc32 `crc` so far) to the end.
+    Yields (record or None, offset, crc) after each consumed line. A last line with no newline
+    that does not parse is not consumed: it may still be being written.
+    """
+    for raw in f:
+        record = parse_record(raw.decode('utf-8', 'replace'))
+        if record is None and not raw.endswith(b"\n"): return
+        offset += len(raw); crc = zlib.crc32(raw, crc)
+        yield record, offset, crc
+
+class MarketTail:
+    """
+    Follows one market file as results are appended. poll() returns one of
+        ("unchanged", []), ("appended", [new DayRecords]),
+        ("reload", [every DayRecord]) - first poll, file truncated or rewritten, or an appended date
+                                        earlier than the latest one already read.
+    DayRecords are in file order; after "appended" the history read so far stays in date order
+    if it was already (appends never go back in time).
+    """
+    __slots__ = ("filepath", "offset", "crc", "last_ordinal", "stat_key", "synced")
+
+    def __init__(self, filepath):
+        self.filepath, self.offset, self.crc, self.last_ordinal, self.stat_key, self.synced = filepath, 0, 0, -1, None, False
+
+    def poll(self):
+        st = os.stat(self.filepath)
+        stat_key = (st.st_mtime_ns, st.st_size)
+        if self.synced and stat_key == self.stat_key: return "unchanged", []
+        with open(self.filepath, 'rb') as f:
+            if self.synced and st.st_size >= self.offset and prefix_crc(f, self.offset) == self.crc:
+                records, offset, crc = self._read(f, self.offset, self.crc)
+                ordinals = [self.last_ordinal] + [r[0] for r in records]
+                if all(a <= b for a, b in zip(ordinals, ordinals[1:])):
+                    self._commit(stat_key, records, offset, crc)
+                    return "appended", [DayRecord(*r) for r in records]
+            f.seek(0); self.last_ordinal = -1
+            records, offset, crc = self._read(f, 0, 0)
+            self._commit(stat_key, records, offset, crc)
+            return "reload", [DayRecord(*r) for r in records]
+
+    def _read(self, f, offset, crc):
+        records = []
+        for record, offset, crc in scan_lines(f, offset, crc):
+            if record: records.append(record)
+        return records, offset, crc
+
+    def _commit(self, stat_key, records, offset, crc):
+        self.offset, self.crc, self.stat_key, self.synced = offset, crc, stat_key, True
+        self.last_ordinal = max([self.last_ordinal] + [r[0] for r in records])
+
+# --- Compiled Cache ---
+def get_cache_filepath(filepath):
+    return os.path.join(CACHE_DIR, os.path.basename(filepath) + ".bin")
+
+def _write_records(out, src, offset, crc, count, ordered, last_ordinal):
+    """ Appends the records parsed from src (at offset) to out; returns the updated (offset, crc, count, ordered). """
+    for record, offset, crc in scan_lines(src, offset, crc):
+        if record is None: continue
+        out.write(CACHE_RECORD.pack(*record))
+        count += 1
+        if record[0] < last_ordinal: ordered = False
+        last_ordinal = record[0]
+    return offset, crc, count, ordered
+
+def _build_cache(filepath, src_stat):
+    """ Streams the parsed records of a market file into its cache file (constant memory). """
+    cache_path = get_cache_filepath(filepath)
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    with open(filepath, 'rb') as src, open(cache_path + ".tmp", 'wb') as f:
+        f.write(bytes(CACHE_HEADER.size)) # Placeholder until the count is known
+        covered, crc, count, ordered = _write_records(f, src, 0, 0, 0, True, -1)
+        f.seek(0)
+        f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, src_stat.st_mtime_ns, src_stat.st_size, count, ordered, covered, crc))
+    os.replace(cache_path + ".tmp", cache_path)
+
+def _extend_cache(filepath, src_stat):
+    """
+    Brings a stale cache up to date by parsing only the text appended since it was built.
+    Returns False (nothing written) if there is no usable cache or the already-parsed part of
+    the file was truncated or rewritten, in which case the cache must be rebuilt.
+    """
+    cache_path = get_cache_filepath(filepath)
+    try: old = open(cache_path, 'rb')
+    except OSError: return False
+    with old:
+        header = old.read(CACHE_HEADER.size)
+        if len(header) < CACHE_HEADER.size: return False
+        magic, version, _, _, count, ordered, covered, covered_crc = CACHE_HEADER.unpack(header)
+        if (magic, version) != (CACHE_MAGIC, CACHE_VERSION) or \
+                os.fstat(old.fileno()).st_size != CACHE_HEADER.size + count * CACHE_RECORD.size: return False
+        last_ordinal = -1
+        if count:
+            old.seek(-CACHE_RECORD.size, os.SEEK_END); last_ordinal = CACHE_RECORD.unpack(old.read(CACHE_RECORD.size))[0]
+        with open(filepath, 'rb') as src:
+            if src_stat.st_size < covered or prefix_crc(src, covered) != covered_crc: return False
+            old.seek(CACHE_HEADER.size)
+            with open(cache_path + ".tmp", 'wb') as f: # Copy-on-write, so readers of the old cache are unaffected
+                f.write(bytes(CACHE_HEADER.size))
+                shutil.copyfileobj(old, f)
+                covered, covered_crc, count, ordered = _write_records(f, src, covered, covered_crc, count, ordered, last_ordinal)
+                f.seek(0)
+                f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, src_stat.st_mtime_ns, src_stat.st_size, count, ordered, covered, covered_crc))
+    os.replace(cache_path + ".tmp", cache_path)
+    return True
+
+def _refresh_cache(filepath, src_stat):
+    """ Extends the cache with appended results when possible, else rebuilds it from the full text. """
+    with PROFILER.stage("parse"):
+        if not _extend_cache(filepath, src_stat): _build_cache(filepath, src_stat)
+
+def _open_cache(filepath, src_stat):
+    """ Returns (file, mmap, count, date_ordered) for a cache matching src_stat, else None. """
+    try:
+        f = open(get_cache_filepath(filepath), 'rb')
+    except OSError: return None
+    try:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError): f.close(); return None # e.g. empty file
+    if len(mm) >= CACHE_HEADER.size:
+        magic, version, mtime_ns, size, count, ordered, _, _ = CACHE_HEADER.unpack_from(mm, 0)
+        if (magic, version, mtime_ns, size) == (CACHE_MAGIC, CACHE_VERSION, src_stat.st_mtime_ns, src_stat.st_size) \
+                and len(mm) == CACHE_HEADER.size + count * CACHE_RECORD.size:
+            return f, mm, count, bool(ordered)
+    mm.close(); f.close(); return None
+
+def _iter_cached(mm):
+    # unpack_from holds no buffer export between records, so the mmap can be closed mid-stream
+    for offset in range(CACHE_HEADER.size, len(mm), CACHE_RECORD.size):
+        yield CACHE_RECORD.unpack_from(mm, offset)
+
+def _cached_records(filepath):
+    """
+    (records, date_ordered) for a market file, served from the compiled cache. The cache is
+    keyed on the source file's mtime and size; when the text changes, only appended lines are
+    parsed (a truncated or rewritten file is parsed again in full).
+    Falls back to parsing the text when the cache cannot be written.
+    """
+    src_stat = os.stat(filepath)
+    opened = _open_cache(filepath, src_stat)
+    if opened is None:
+        try: _refresh_cache(filepath, src_stat); opened = _open_cache(filepath, src_stat)
+        except OSError: pass # Cache is an optimisation only; a read-only tree still works
+    if opened is None:
+        with PROFILER.stage("parse"): records = list(iter_market_file(filepath))
+        return records, all(a[0] <= b[0] for a, b in zip(records, records[1:]))
+    f, mm, count, ordered = opened
+    try:
+        with memoryview(mm) as view, view[CACHE_HEADER.size:] as body:
+            return list(CACHE_RECORD.iter_unpack(body)), ordered
+    finally: mm.close(); f.close()
+
+def load_day_records(filepath, sort_by_date=True):
+    """ DayRecords of a market file. With sort_by_date, sorts only if the file is not already in date order. """
+    records, ordered = _cached_records(filepath)
+    days = [DayRecord(*r) for r in records]
+    if sort_by_date and not ordered: days.sort(key=lambda d: d.ordinal)
+    return days
+
+def stream_day_records(filepath, sort_by_date=True):
+    """
+    Lazily yields the DayRecords of a market file. A file already in date order (the normal
+    case), or any file with sort_by_date=False, is streamed straight off the mmap'd cache in
+    constant memory; an out-of-order one is sorted in memory first. Raises FileNotFoundError when iterated.
+    """
+    src_stat = os.stat(filepath)
+    opened = _open_cache(filepath, src_stat)
+    if opened is None:
+        try: _refresh_cache(filepath, src_stat); opened = _open_cache(filepath, src_stat)
+        except OSError: pass
+    if opened is None: # Cache unwritable: stream the text instead
+        if sort_by_date: yield from load_day_records(filepath)
+        else:
+            for record in iter_market_file(filepath): yield DayRecord(*record)
+        return
+    f, mm, count, ordered = opened
+    try:
+        if sort_by_date and not ordered:
+            days = [DayRecord(*r) for r in _iter_cached(mm)]
+            days.sort(key=lambda d: d.ordinal)
+            yield from days
+        else:
+            for record in _iter_cached(mm): yield DayRecord(*record)
+    finally: mm.close(); f.close()
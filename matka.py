@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# MATKA TOOL v1.0
+# One entry point for every analyzer; a subcommand imports only the script it runs
+
+import os
+import sys
+import time
+import argparse
+import importlib.util
+
+START = time.perf_counter()
+
+# --- Configuration & Constants ---
+APP_NAME = "MATKA TOOL"
+APP_VERSION = "v1.0"
+# subcommand -> (script file name without .py, help)
+SUBCOMMANDS = {
+    "otc": ("mein", "OTC ank formulas: backtest, rank and suggest (mein.py)"),
+    "otc-math": ("otc_math_analyzer", "OTC math formula families with rolling windows and formula search (otc_math_analyzer.py)"),
+    "math-ank": ("777", "Jodi x operator ank formulas with an X parameter (777.py)"),
+    "sequence": ("main2", "Jodi / open ank transitions and Markov chains (main2.py)"),
+}
+
+# --- Script Loading ---
+def load_script(name):
+    """ Imports an analyzer script by file name (777.py is not a valid module name). """
+    module_name = name if name.isidentifier() else f"script_{name}"
+    if module_name in sys.modules: return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module # Needed by process pools that pickle the script's functions
+    spec.loader.exec_module(module)
+    return module
+
+def parse_args(argv=None):
+    """ (args, the subcommand's own argv). Everything after the subcommand is passed to its script untouched. """
+    parser = argparse.ArgumentParser(prog="matka.py", description=f"{APP_NAME} {APP_VERSION}",
+                                     epilog="Run 'matka.py <command> --help' for the options of a command.")
+    parser.add_argument("--timing", action="store_true", help="Print cold-start timing (import, run) to stderr")
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+    for command, (_, help_text) in SUBCOMMANDS.items(): commands.add_parser(command, help=help_text, add_help=False)
+    return parser.parse_known_args(argv)
+
+def main(argv=None):
+    args, command_argv = parse_args(argv)
+    script = SUBCOMMANDS[args.command][0]
+    import_start = time.perf_counter()
+    module = load_script(script)
+    import_seconds = time.perf_counter() - import_start
+    from profiling import PROFILER # Already imported by the script
+    PROFILER.add_stage("import", import_seconds) # Shows in the script's --profile report
+    run_start = time.perf_counter()
+    try: module.run(command_argv, prog=f"matka.py {args.command}")
+    finally:
+        if args.timing:
+            now = time.perf_counter()
+            print(f"[timing] {args.command}: startup {(import_start - START) * 1000:.1f} ms, import {script}.py {import_seconds * 1000:.1f} ms, "
+                  f"run {(now - run_start) * 1000:.1f} ms, total {(now - START) * 1000:.1f} ms", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# MATKA SUGGESTION SERVICE v1.0
+# Resident HTTP service: keeps every market's history and formula stats warm in memory
+
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import threading
+import contextlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import main2
+import otc_math_analyzer as otc
+from ledger import LEDGER_FILE
+from market_data import MarketTail
+from reconcile import Reconciler
+
+# --- Configuration & Constants ---
+APP_NAME = "MATKA SUGGESTION SERVICE"
+APP_VERSION = "v1.0"
+SERVICE_HOST = "127.0.0.1" # Local only by default
+SERVICE_PORT = 8777
+DATA_DIR = "data"
+WATCH_INTERVAL = 2.0 # Seconds between scans of DATA_DIR for new, changed or removed market files
+
+def log(message): print(f"[{datetime.now().strftime('%d-%m-%Y %H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+def encode(obj): return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+# --- Market State ---
+# One dict per market: its summary and every response already encoded as JSON bytes. A query
+# is a dict lookup plus a socket write; all analysis happens in the watcher thread, which builds
+# a new state and swaps it in whole (readers never see a half-built one).
+#
+# Behind each state the watcher keeps the market's analysis (history, OTC hit matrix, sequence
+# tables, Markov counts) and a market_data.MarketTail on its file. Appended results are parsed
+# from the file's tail and pushed into that analysis; only a truncated or rewritten file (or a
+# result dated before the latest one) is reloaded and analyzed from scratch.
+def new_analysis(days, window):
+    """ Analysis of a full history (DayRecords in date order). """
+    analysis = {"days": days, "window": window, "hit_state": None, "otc": None, "tables": None, "models": None}
+    return extend_analysis(analysis, [])
+
+def extend_analysis(analysis, new_days):
+    """ Pushes new DayRecords (dated after the history) into an analysis in place; sections are built once there is enough data. """
+    days, window = analysis["days"], analysis["window"]
+    if new_days:
+        last_day, recent = (days[-1], days[-main2.MARKOV_MAX_ORDER:]) if days else (None, [])
+        days.extend(new_days)
+    if analysis["hit_state"] is not None:
+        all_formula_stats = otc.extend_backtest(analysis["hit_state"], new_days, otc.ranking_windows(window))
+        analysis["otc"] = (all_formula_stats, analysis["otc"][1])
+    elif len(days) >= otc.MIN_BACKTEST_DAYS:
+        analysis["hit_state"] = {}
+        analysis["otc"] = otc.backtest_history(days, window, hit_state=analysis["hit_state"])[:2]
+    if analysis["tables"] is not None:
+        if new_days:
+            main2.extend_sequences(analysis["tables"], [last_day] + new_days)
+            main2.extend_markov_models(analysis["models"], recent, new_days)
+    elif len(days) >= main2.MIN_SEQUENCE_DAYS:
+        analysis["tables"], analysis["models"] = main2.analyze_sequences(days), main2.build_markov_models(days)
+    return analysis
+
+def otc_section(historical_data, all_formula_stats, formula_specs, window):
+    """ OTC math suggestions (otc_math_analyzer) from backtested formula stats. """
+    suggestions = otc.get_otc_suggestions_for_tomorrow(historical_data[-1], all_formula_stats, window, formula_specs)
+    return {"window": window, "formulas": len(all_formula_stats), "suggestions": [
+        {"rank": rank, "formula_id": sug["formula_id"], "display_name": sug["display_name"],
+         "params": formula_specs[sug["formula_id"]]["params"], "anks": sug["generated_anks"],
+         "hit_rate": round(sug["hit_rate"], 2), **otc.ranking_fields(sug), "hits_tries": sug["hits_tries_str"]}
+        for rank, sug in enumerate(suggestions, 1)]}
+
+def sequence_section(analyzed):
+    """ Sequence and Markov suggestions (main2) from a sequence_suggestions result. """
+    latest_day_data, jodi_suggestions, open_ank_suggestions, markov_results = analyzed
+    as_rows = lambda suggestions: [{"value": value, "count": count, "percent": round(percent, 2)} for value, count, percent in suggestions]
+    return {"after_jodi": latest_day_data.jodi_str, "after_open_ank": str(latest_day_data.open_ank),
+            "jodi": as_rows(jodi_suggestions), "open_ank": as_rows(open_ank_suggestions),
+            "markov": [{"chain": chain["name"], "order_used": order_used, "suggestions": as_rows(suggestions)}
+                       for chain, order_used, suggestions in markov_results]}
+
+def build_market_state(market_name, analysis, update, start):
+    """ State dict (summary + encoded responses) of one market's analysis; update is "reload" or "appended". """
+    days, window = analysis["days"], analysis["window"]
+    summary = {"market": market_name, "built_at": datetime.now().isoformat(timespec="seconds"), "days": len(days), "update": update}
+    sections = {}
+    if days:
+        last = days[-1]
+        summary.update(last_date=last.date_str, for_date=(last.date_obj + timedelta(days=1)).strftime("%d-%m-%Y"))
+    with contextlib.redirect_stdout(io.StringIO()): # The analyzers' console messages
+        if analysis["otc"] is not None: sections["otc"] = otc_section(days, *analysis["otc"], window)
+        if analysis["tables"] is not None: sections["sequence"] = sequence_section(main2.suggest_sequences(days, analysis["tables"], analysis["models"]))
+    if not sections: summary["error"] = f"Not enough data (found {len(days)} days)"
+    summary["build_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    full = {**summary, **sections}
+    responses = {"": encode(full), **{name: encode({**summary, name: section}) for name, section in sections.items()}}
+    return {"summary": summary, "responses": responses}
+
+def update_market(market_name, tail, analysis, window):
+    """ Polls a market file; returns (new state, analysis), or None when the file is unchanged. """
+    start = time.perf_counter()
+    status, records = tail.poll()
+    if status == "unchanged": return None
+    with contextlib.redirect_stdout(io.StringIO()):
+        if status == "appended" and analysis is not None: analysis = extend_analysis(analysis, records)
+        else: status, analysis = "reload", new_analysis(sorted(records, key=lambda d: d.ordinal), window)
+    return build_market_state(market_name, analysis, status, start), analysis
+
+# --- Service ---
+class SuggestionService:
+    """ Warm market states for every data file, kept current by a polling watcher thread. """
+    def __init__(self, data_dir=DATA_DIR, window=None, markets=None, interval=WATCH_INTERVAL, ledger_path=LEDGER_FILE):
+        self.data_dir, self.window, self.markets, self.interval = data_dir, window, markets, interval
+        self.states = {} # market -> state; replaced whole, so readers need no lock
+        self.tails, self.analyses = {}, {} # market -> MarketTail / analysis; watcher thread only
+        self.reconciler = Reconciler(ledger_path, data_dir, follow_data=False) # Fed the results read below; watcher thread only
+        self.accuracy = encode(self.reconciler.as_dict()) # Replaced whole, like the states
+        self.stop_event = threading.Event()
+        otc.DATA_DIR = main2.DATA_DIR = data_dir
+
+    def market_files(self):
+        try: names = sorted(f[:-4] for f in os.listdir(self.data_dir) if f.endswith(".txt"))
+        except OSError: return {}
+        return {m: os.path.join(self.data_dir, f"{m}.txt") for m in names if not self.markets or m in self.markets}
+
+    def refresh(self):
+        """ Updates the state of every new or changed market file and drops removed ones. Returns the markets updated. """
+        files, updated = self.market_files(), []
+        for market_name, filepath in files.items():
+            tail = self.tails.get(market_name)
+            if tail is None or tail.filepath != filepath: tail = self.tails[market_name] = MarketTail(filepath)
+            previous = self.analyses.get(market_name)
+            days_before = len(previous["days"]) if previous else 0 # The analysis is extended in place
+            try: updated_market = update_market(market_name, tail, previous, self.window)
+            except OSError: continue
+            except Exception as e:
+                log(f"[!] Could not analyze {market_name}: {e}")
+                del self.tails[market_name]; self.analyses.pop(market_name, None); continue # Start over from a full reload
+            if updated_market is None: continue
+            new_state, self.analyses[market_name] = updated_market
+            reload = new_state["summary"]["update"] == "reload"
+            self.reconciler.add_results(market_name, self.analyses[market_name]["days"][0 if reload else days_before:], reload=reload)
+            states = dict(self.states); states[market_name] = new_state; self.states = states
+            updated.append(market_name)
+            summary = new_state["summary"]
+            change = f"{summary['days']} days" if summary["update"] == "reload" else f"+{summary['days'] - days_before} -> {summary['days']} days"
+            log(f"{'Loaded' if previous is None else 'Updated'} {market_name}: {change} ({summary['update']}) in {summary['build_ms']} ms")
+        removed = [m for m in self.states if m not in files]
+        for m in [m for m in self.tails if m not in files]: del self.tails[m]; self.analyses.pop(m, None)
+        if removed:
+            self.states = {m: s for m, s in self.states.items() if m in files}
+            log(f"Removed {', '.join(removed)}")
+        ledger_offset = self.reconciler.ledger_offset
+        self.reconciler.poll_ledger()
+        if updated or self.reconciler.ledger_offset != ledger_offset: self.accuracy = encode(self.reconciler.as_dict())
+        return updated
+
+    def watch(self):
+        while not self.stop_event.wait(self.interval):
+            try: self.refresh()
+            except Exception as e: log(f"[!] Watcher error: {e}")
+
+    def start_watcher(self):
+        thread = threading.Thread(target=self.watch, name="data-watcher", daemon=True)
+        thread.start()
+        return thread
+
+    def route(self, path):
+        """ (status, body bytes) for a GET path. """
+        parts = [p for p in urlparse(path).path.split("/") if p]
+        if parts == ["health"]: return 200, encode({"status": "ok", "markets": len(self.states)})
+        if parts == ["markets"]: return 200, encode([state["summary"] for _, state in sorted(self.states.items())])
+        if parts == ["accuracy"]: return 200, self.accuracy
+        if len(parts) in (2, 3) and parts[0] == "suggestions":
+            state = self.states.get(parts[1])
+            if state is None: return 404, encode({"error": f"Unknown market: {parts[1]}"})
+            body = state["responses"].get(parts[2] if len(parts) == 3 else "")
+            if body is None: return 404, encode({"error": f"No {parts[2]} suggestions for {parts[1]}", **state["summary"]})
+            return 200, body
+        return 404, encode({"error": "Not found", "routes": ["/health", "/markets", "/accuracy", "/suggestions/<market>[/otc|/sequence]"]})
+
+def make_handler(service, verbose=False):
+    class ServiceHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, body = service.route(self.path)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, format, *args):
+            if verbose: super().log_message(format, *args)
+    return ServiceHandler
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=f"{APP_NAME} {APP_VERSION}")
+    parser.add_argument("--host", default=SERVICE_HOST, help=f"Address to listen on (default: {SERVICE_HOST})")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT, help=f"Port to listen on (default: {SERVICE_PORT})")
+    parser.add_argument("--data-dir", default=DATA_DIR, help=f"Directory of market .txt files (default: {DATA_DIR})")
+    parser.add_argument("--markets", nargs="+", default=None, help="Only serve these markets (default: every file in the data directory)")
+    parser.add_argument("--window", type=int, default=otc.RANKING_WINDOW, metavar="DAYS", help="Rank OTC formulas on their last DAYS days (default: all history)")
+    parser.add_argument("--ledger", default=LEDGER_FILE, help=f"Suggestion ledger scored on /accuracy (default: {LEDGER_FILE})")
+    parser.add_argument("--interval", type=float, default=WATCH_INTERVAL, help=f"Seconds between data directory scans (default: {WATCH_INTERVAL})")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+    if args.window is not None and args.window < 1: log("--window must be a positive number of days."); sys.exit(2)
+    service = SuggestionService(args.data_dir, args.window, args.markets, args.interval, args.ledger)
+    log(f"{APP_NAME} {APP_VERSION}: loading markets from {args.data_dir}/ ...")
+    service.refresh()
+    service.start_watcher()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service, args.verbose))
+    log(f"Serving {len(service.states)} markets on http://{args.host}:{args.port} (watching every {args.interval:g}s)")
+    try: server.serve_forever()
+    finally: service.stop_event.set(); server.server_close()
+
+if __name__ == "__main__":
+    try: main()
+    except KeyboardInterrupt: log("Service stopped.")
@@ -4,15 +4,27 @@
 
 import os
 import sys
+import io
 import shutil
 import re
+import argparse
+import contextlib
 from datetime import datetime, timedelta
-from collections import Counter, defaultdict
+from collections import Counter
+from functools import lru_cache
+from itertools import islice, repeat
 import json # For saving/loading formula performance
+import hashlib
+import zlib
 
 from colorama import Fore, Style, init
 
-init(autoreset=True)
+from formula_registry import compile_formula_set, day_signature, output_cache
+from headless import RecordWriter, add_output_arguments, plain_colors
+from ledger import LEDGER_FILE, append_entries, make_entry
+from market_data import CACHE_RECORD, ank_mask, load_day_records, mask_to_anks, stream_day_records
+from profiling import PROFILER, add_profile_argument, enable_profiling
+
 
 # --- Configuration & Constants ---
 APP_NAME = "OTC ANK ANALYZER"
@@ -21,12 +33,12 @@ POWERED_BY = "Anuj & AI God (Enhanced by Sachin & AI)"
 BOX_WIDTH = 80 
 DATA_DIR = "data"
 PERFORMANCE_DIR = "performance_stats" 
-LOG_DIR = "logs"
+PERFORMANCE_STATS_VERSION = 2 # Bump when the saved stats fields change (2: chance hits)
+LEDGER_ENGINE = "otc" # Engine name of this script's suggestions in the ledger
 
-# ***** MODIFIED HERE *****
-MIN_HIT_RATE_FOR_SUGGESTION = 0.39 # Lowered to 39% (shows 40%+ formulas)
-                                   # Set to 0.0 to always show suggestions from top formulas if MIN_TRIES met
-# *************************
+# Formulas are ranked on their hit rate shrunk toward the chance rate of the anks they play (ranking.py)
+MAX_FALSE_DISCOVERY_RATE = 0.1 # Highest q-value a suggested formula may have: at most 10% of suggested formulas only beat chance by luck
+                               # (short histories often have none: then there is no suggestion that day)
 MIN_TRIES_FOR_SUGGESTION = 10    
 NUM_SUGGESTIONS_TO_SHOW = 5      
 
@@ -52,6 +64,8 @@ DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturda
 def print_box_top(w=BOX_WIDTH, c=C_SECONDARY_BRIGHT): print(c + f"╔{'═'*(w-2)}╗" + C_RESET)
 def print_box_bottom(w=BOX_WIDTH, c=C_SECONDARY_BRIGHT): print(c + f"╚{'═'*(w-2)}╝" + C_RESET)
 def print_box_sep(w=BOX_WIDTH, c=C_SECONDARY_BRIGHT): print(c + f"╠{'═'*(w-2)}╣" + C_RESET)
+def clear_screen(): # ANSI clear (colorama translates it on Windows) instead of spawning `clear` / `cls`
+    if sys.stdout.isatty(): print("\033[H\033[2J\033[3J", end="")
 def strip_ansi(t): return re.sub(r'\x1b\[[0-9;]*[mK]', '', t)
 def print_box_line(t, w=BOX_WIDTH, bc=C_SECONDARY_BRIGHT, tc="", align="left", p=2):
     st, cw = strip_ansi(t), w-2-(p*2); dsp_t = t; cl_diff = len(t)-len(st)
@@ -71,120 +85,198 @@ def print_box_line(t, w=BOX_WIDTH, bc=C_SECONDARY_BRIGHT, tc="", align="left", p
 
 # --- Core Logic Functions ---
 def show_banner():
-    os.system("clear" if os.name == 'posix' else 'cls'); print_box_top(BOX_WIDTH, C_BANNER_BORDER)
+    clear_screen(); print_box_top(BOX_WIDTH, C_BANNER_BORDER)
     print_box_line(f"{C_BANNER_TITLE}{APP_NAME}",BOX_WIDTH,C_BANNER_BORDER,"","center")
     print_box_line(f"{C_BANNER_SUBTITLE}{APP_VERSION}",BOX_WIDTH,C_BANNER_BORDER,"","center")
     print_box_sep(BOX_WIDTH,C_BANNER_BORDER)
     print_box_line(f"{C_BANNER_TEXT}OTC Ank Formula Backtester & Suggester",BOX_WIDTH,C_BANNER_BORDER,"","center")
     print_box_bottom(BOX_WIDTH,C_BANNER_BORDER); print("\n")
 
-def parse_data_line(line_str):
-    try:
-        date_part_str, result_part_str = map(str.strip, line_str.split('/', 1))
-        p1, jodi, p2 = map(str.strip, result_part_str.split('-', 2))
-        if not (re.fullmatch(r"\d{3}",p1) and re.fullmatch(r"\d{2}",jodi) and re.fullmatch(r"\d{3}",p2)): return None
-        dt = datetime.strptime(date_part_str, "%d-%m-%Y")
-        return {
-            "date_obj": dt, "p1": p1, "jodi": jodi, "p2": p2,
-            "open_ank": p1[-1], "close_ank": jodi[-1], "day_idx": dt.weekday(),
-            "all_digits_today": {p1[0],p1[1],p1[2], jodi[0],jodi[1], p2[0],p2[1],p2[2]}
-        }
-    except: return None
-
 def read_data_file(market_name):
     filepath = os.path.join(DATA_DIR, f"{market_name}.txt")
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            lines = [line.strip() for line in f if line.strip()]
-        parsed_data = [parse_data_line(line) for line in lines]
-        return [d for d in parsed_data if d is not None]
+        return load_day_records(filepath, sort_by_date=False) # DayRecord objects, in file order
     except FileNotFoundError: print(C_ERROR_BRIGHT + f"[!] File missing: {filepath}"); return []
     except Exception as e: print(C_ERROR_BRIGHT + f"[!] Read error {filepath}: {e}"); return []
 
-# --- FORMULA DEFINITIONS ---
-def f_jodi_digits(prev_day_data, params=None):
-    if not prev_day_data or 'jodi' not in prev_day_data or len(prev_day_data['jodi']) != 2: return set()
-    return {prev_day_data['jodi'][0], prev_day_data['jodi'][1]}
-
-def f_open_close_anks(prev_day_data, params=None):
-    if not prev_day_data: return set()
-    return {prev_day_data['open_ank'], prev_day_data['close_ank']}
-
-def f_jodi_sum_and_diff(prev_day_data, params=None):
-    if not prev_day_data or 'jodi' not in prev_day_data or len(prev_day_data['jodi']) != 2: return set()
-    try:
-        d1, d2 = int(prev_day_data['jodi'][0]), int(prev_day_data['jodi'][1])
-        return {str((d1 + d2) % 10), str(abs(d1 - d2))}
-    except ValueError: return set()
-
-def f_panel_sum_ank(prev_day_data, params):
-    if not prev_day_data or not params or 'panel_type' not in params: return set()
-    panel_key = params['panel_type']
-    if panel_key not in prev_day_data or len(prev_day_data[panel_key]) != 3: return set()
-    try:
-        return {str(sum(int(d) for d in prev_day_data[panel_key]) % 10)}
-    except ValueError: return set()
+def read_data_stream(market_name):
+    """ Large-history mode: yields DayRecords lazily, in file order, without holding the history in memory. """
+    filepath = os.path.join(DATA_DIR, f"{market_name}.txt")
+    try: yield from stream_day_records(filepath, sort_by_date=False)
+    except FileNotFoundError: print(C_ERROR_BRIGHT + f"[!] File missing: {filepath}")
+    except Exception as e: print(C_ERROR_BRIGHT + f"[!] Read error {filepath}: {e}")
 
-def f_fixed_offset_from_ank(prev_day_data, params):
-    if not prev_day_data or not params or 'offset' not in params: return set()
-    try:
-        offset = int(params['offset'])
-        oa, ca = int(prev_day_data['open_ank']), int(prev_day_data['close_ank'])
-        return {str((oa + offset) % 10), str((ca + offset) % 10)}
-    except ValueError: return set()
-
-ALL_FORMULA_SPECS = {
-    "JodiDigits_default": {"func": f_jodi_digits, "params": {}, "display": "Jodi Digits"},
-    "OpenCloseAnks_default": {"func": f_open_close_anks, "params": {}, "display": "Open & Close Anks"},
-    "JodiSumDiff_default": {"func": f_jodi_sum_and_diff, "params": {}, "display": "Jodi Sum & Diff"},
-}
-for i in range(10):
-    ALL_FORMULA_SPECS[f"FixedOffset_off{i}"] = {
-        "func": f_fixed_offset_from_ank, "params": {"offset": i}, "display": f"Fixed Offset Ank (X={i})" }
-for pt in ['p1', 'p2']:
-    ALL_FORMULA_SPECS[f"PanelSumAnk_{pt}"] = {
-        "func": f_panel_sum_ank, "params": {"panel_type": pt}, "display": f"{pt.upper()} Panel Sum Ank" }
+# --- FORMULA DEFINITIONS ---
+# Families are declared in formula_registry; each compiles to an evaluator that takes the
+# previous day's DayRecord and returns its anks as a 10-bit mask (0 = no anks).
+OTC_FORMULA_SET = [
+    {"family": "jodi_digits"}, {"family": "open_close_anks"}, {"family": "jodi_sum_diff"},
+    {"family": "fixed_offset"}, {"family": "panel_sum_ank"},
+]
+# Compiled on first use, so importing the script (or running another subcommand of matka.py) skips it.
+@lru_cache(maxsize=None)
+def get_formula_specs():
+    """ ALL_FORMULA_SPECS: the compiled OTC_FORMULA_SET. """
+    return compile_formula_set(OTC_FORMULA_SET)
+
+def __getattr__(name): # Keeps ALL_FORMULA_SPECS available as a module attribute
+    if name == "ALL_FORMULA_SPECS": return get_formula_specs()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 # --- END FORMULA DEFINITIONS ---
 
-def get_performance_filepath(market_name): # Unused in this simplified version
+def get_performance_filepath(market_name):
     os.makedirs(PERFORMANCE_DIR, exist_ok=True)
     return os.path.join(PERFORMANCE_DIR, f"{market_name}_otc_formula_stats.json")
 
-def backtest_all_formulas(historical_data): # Simplified: no loading/saving of stats here
-    print(C_INFO_BRIGHT + f"Backtesting {len(ALL_FORMULA_SPECS)} formula variants...")
-    current_formula_stats = {}
-    for f_id, spec in ALL_FORMULA_SPECS.items():
-         current_formula_stats[f_id] = {"hits": 0, "tries": 0, "display_name": spec["display"], "params_str": str(spec["params"])}
+def get_formula_specs_hash():
+    """ Fingerprint of ALL_FORMULA_SPECS (ids, families, params); saved stats are dropped when it changes. """
+    spec_desc = [[f_id, spec["family"], spec["params"]] for f_id, spec in get_formula_specs().items()]
+    return hashlib.sha1(json.dumps([PERFORMANCE_STATS_VERSION, spec_desc], sort_keys=True).encode("utf-8")).hexdigest()
 
-    if len(historical_data) < 2:
+def load_performance_stats(market_name):
+    """ Returns the saved backtest state for a market, or None if missing, unreadable or stale. """
+    try:
+        with open(get_performance_filepath(market_name), 'r', encoding='utf-8') as f: saved = json.load(f)
+    except (OSError, ValueError): return None
+    if not isinstance(saved, dict) or saved.get("formula_hash") != get_formula_specs_hash(): return None
+    return saved
+
+def save_performance_stats(market_name, formula_stats, days_processed, last_day, history_crc):
+    filepath = get_performance_filepath(market_name)
+    saved = {
+        "formula_hash": get_formula_specs_hash(),
+        "days_processed": days_processed,
+        "last_date": last_day.date_str,
+        "history_crc": history_crc,
+        "stats": {f_id: {"hits": d["hits"], "tries": d["tries"], "chance": d["chance"]} for f_id, d in formula_stats.items()},
+    }
+    try:
+        with open(filepath + ".tmp", 'w', encoding='utf-8') as f: json.dump(saved, f)
+        os.replace(filepath + ".tmp", filepath)
+    except OSError: print(C_ERROR + f"Could not save formula stats: {filepath}")
+
+def fold_history_crc(days, state):
+    """ Passes days through, folding each into state["crc"]: the crc32 of their records packed as in the compiled cache. """
+    for day in days:
+        state["crc"] = zlib.crc32(CACHE_RECORD.pack(*day.as_record()), state["crc"])
+        yield day
+
+def backtest_day_stream(open_days, market_name=None):
+    """
+    Backtests every formula in one pass over a stream of DayRecords, holding only two days at a time.
+    open_days() returns a fresh iterator; it is reopened only if saved stats no longer match the history.
+    With market_name, stats are resumed from and saved to PERFORMANCE_DIR; they are only resumed if the
+    crc of the days they cover is unchanged (no result corrected, inserted or removed since).
+    Returns (stats, day_count, last_day).
+    """
+    print(C_INFO_BRIGHT + f"Backtesting {len(get_formula_specs())} formula variants...")
+    current_formula_stats = {}
+    for f_id, spec in get_formula_specs().items():
+         current_formula_stats[f_id] = {"hits": 0, "tries": 0, "chance": 0, "display_name": spec["display"], "params_str": str(spec["params"])}
+
+    formula_specs = PROFILER.instrument_specs(get_formula_specs()) # Per-formula timing with --profile
+    history = {"crc": 0}
+    days, day_count, prev_day_data, resumed_at = fold_history_crc(open_days(), history), 0, None, None
+    saved = load_performance_stats(market_name) if market_name else None
+    done = saved.get("days_processed", 0) if saved else 0
+    if isinstance(done, int) and done >= 2:
+        last_skipped = next(islice(days, done - 1, done), None) # Consumes the first `done` days
+        if (last_skipped is not None and last_skipped.date_str == saved.get("last_date")
+                and history["crc"] == saved.get("history_crc")):
+            for f_id, d in saved["stats"].items():
+                current_formula_stats[f_id].update(hits=d["hits"], tries=d["tries"], chance=d["chance"])
+            prev_day_data, day_count, resumed_at = last_skipped, done, done
+        else: # History was edited: rescan from the start
+            history["crc"] = 0
+            days = fold_history_crc(open_days(), history)
+
+    days_scored, prev_day_data = score_days(current_formula_stats, prev_day_data, days, formula_specs)
+    day_count += days_scored
+
+    if day_count < 2:
         print(C_WARNING + "Not enough historical data (need at least 2 days) for backtesting.")
-        return current_formula_stats
-
-    for i in range(1, len(historical_data)):
-        prev_day_data = historical_data[i-1]
-        current_day_data = historical_data[i]
-        actual_otc_relevant_anks = {current_day_data['open_ank'], current_day_data['close_ank']}
-        # To check against all digits that appeared:
-        # actual_otc_relevant_anks.update(current_day_data['all_digits_today'])
-
-        for f_id, spec in ALL_FORMULA_SPECS.items():
-            generated_otc_anks = spec["func"](prev_day_data, spec["params"])
-            current_formula_stats[f_id]["tries"] += 1
-            if generated_otc_anks and not actual_otc_relevant_anks.isdisjoint(generated_otc_anks):
-                current_formula_stats[f_id]["hits"] += 1
-    return current_formula_stats
+        return current_formula_stats, day_count, prev_day_data
+    if resumed_at is not None:
+        print(C_INFO + f"Resumed from saved stats ({saved['last_date']}), {day_count - resumed_at} new day(s) processed.")
+    if market_name: save_performance_stats(market_name, current_formula_stats, day_count, prev_day_data, history["crc"])
+    return current_formula_stats, day_count, prev_day_data
+
+def score_days(formula_stats, prev_day_data, days, formula_specs=None):
+    """
+    Adds the tries/hits of every formula over `days` to formula_stats, each day predicted from the
+    one before it. prev_day_data is the last day already scored (None at the start of a history), so
+    newly ingested days (market_data.MarketTail) can be pushed into existing stats.
+    Days are grouped by (previous day signature, actual ank mask): each group is scored once, with
+    the formula outputs of the run-wide cache (formula_registry.output_cache). "chance" sums the
+    chance hit rate of the anks each formula played, in hundredths (ranking.chance_rate).
+    Returns (number of days consumed, last day).
+    """
+    formula_specs = formula_specs or get_formula_specs()
+    outcomes, signature_days = Counter(), {} # (signature, actual mask) -> days; signature -> a day with it
+    day_count = 0
+    for current_day_data in days:
+        day_count += 1
+        if prev_day_data is not None:
+            signature = day_signature(prev_day_data)
+            signature_days.setdefault(signature, prev_day_data)
+            outcomes[signature, ank_mask(current_day_data.open_ank, current_day_data.close_ank)] += 1
+            # To check against all digits that appeared: | current_day_data.all_digits_mask
+        prev_day_data = current_day_data
+
+    from ranking import CHANCE_HUNDREDTHS_BY_MASK # numpy loads with the first backtest, not at startup
+    chance_by_mask = CHANCE_HUNDREDTHS_BY_MASK.tolist()
+    cache = output_cache(formula_specs)
+    stats_rows = [formula_stats[f_id] for f_id in formula_specs]
+    scored = sum(outcomes.values())
+    for stats in stats_rows: stats["tries"] += scored
+    for (signature, actual_otc_mask), count in outcomes.items():
+        for stats, generated_otc_mask in zip(stats_rows, cache.masks(signature_days[signature], signature)):
+            stats["chance"] += count * chance_by_mask[generated_otc_mask]
+            if generated_otc_mask & actual_otc_mask: stats["hits"] += count
+    return day_count, prev_day_data
+
+def backtest_all_formulas(historical_data, market_name=None):
+    """ Backtests every formula over an in-memory, date-ordered list of DayRecords. """
+    return backtest_day_stream(lambda: iter(historical_data), market_name)[0]
+
+def rank_formula_stats(formula_stats):
+    """
+    (f_id, stats) of every tried formula, best first (ranking.rank_formulas). The stats are copies
+    with the formula's chance_rate, shrunk_rate, p_value and q_value added.
+    """
+    from ranking import formula_scores, rank_formulas
+    f_ids = list(formula_stats)
+    ranked = rank_formulas(*([formula_stats[f_id][key] for f_id in f_ids] for key in ("hits", "tries")),
+                           [formula_stats[f_id]["chance"] / 100 for f_id in f_ids])
+    return [(f_ids[i], {**formula_stats[f_ids[i]], **formula_scores(ranked, i)}) for i in ranked["order"]]
+
+def is_eligible(perf_data):
+    """ Whether a rank_formula_stats entry may be suggested: enough tries, a shrunk rate above chance and a low enough q-value. """
+    return (perf_data["tries"] >= MIN_TRIES_FOR_SUGGESTION and perf_data["shrunk_rate"] > perf_data["chance_rate"]
+            and perf_data["q_value"] <= MAX_FALSE_DISCOVERY_RATE)
+
+def eligible_formulas(formula_stats):
+    """ The rank_formula_stats entries that may be suggested, best first. """
+    return [(f_id, d) for f_id, d in rank_formula_stats(formula_stats) if is_eligible(d)]
+
+def ranking_fields(perf_data):
+    """ The ranking scores of a rank_formula_stats entry (or suggestion) as record fields, rates in percent like hit_rate. """
+    if perf_data.get("q_value") is None: return {}
+    return {"chance_rate": round(perf_data["chance_rate"] * 100, 2), "shrunk_rate": round(perf_data["shrunk_rate"] * 100, 2),
+            "p_value": round(perf_data["p_value"], 6), "q_value": round(perf_data["q_value"], 6)}
 
 def get_otc_suggestions_for_tomorrow(latest_day_data, top_formulas_perf):
     suggestions = []
     if not latest_day_data: return suggestions
+    for_date = (latest_day_data.date_obj + timedelta(days=1)).strftime("%d-%m-%Y") # The result day the anks are for
     for f_id, perf_data in top_formulas_perf:
-        spec = ALL_FORMULA_SPECS.get(f_id)
+        spec = get_formula_specs().get(f_id)
         if not spec: continue
-        generated_otc_anks = spec["func"](latest_day_data, spec["params"])
+        generated_otc_anks = mask_to_anks(spec["func"](latest_day_data)) # Sorted ank strings
         hit_rate = (perf_data['hits'] / perf_data['tries'] * 100) if perf_data['tries'] > 0 else 0
         
         # Ensure we provide up to 3 anks. If formula gives fewer, pad. If more, truncate.
-        final_suggested_anks = sorted(list(generated_otc_anks))
+        final_suggested_anks = list(generated_otc_anks)
         if len(final_suggested_anks) > 3:
             final_suggested_anks = final_suggested_anks[:3] # Take first 3 if more
         while len(final_suggested_anks) < 3 and len(final_suggested_anks) > 0 : # Pad if 1 or 2 anks and non-empty
@@ -204,44 +296,53 @@ def get_otc_suggestions_for_tomorrow(latest_day_data, top_formulas_perf):
             "formula_id": f_id,
             "display_name": perf_data.get("display_name", spec["display"]),
             "params_str": perf_data.get("params_str", str(spec["params"])),
-            "generated_anks": sorted(list(generated_otc_anks)), # These are the raw anks from formula
+            "generated_anks": generated_otc_anks, # These are the raw anks from formula
+            "for_date": for_date,
             "hit_rate": hit_rate,
-            "hits_tries_str": f"{perf_data['hits']}/{perf_data['tries']}"
+            "hits_tries_str": f"{perf_data['hits']}/{perf_data['tries']}",
+            **{key: perf_data.get(key) for key in ("chance_rate", "shrunk_rate", "p_value", "q_value")} # From rank_formula_stats
         })
     return suggestions
 
-def log_top_suggestion(market_name, suggestion):
-    os.makedirs(LOG_DIR, exist_ok=True)
-    log_file = os.path.join(LOG_DIR, "otc_daily_suggestions.txt")
-    today_str = datetime.now().strftime("%d-%m-%Y")
-    tomorrows_date_str = (datetime.now() + timedelta(days=1)).strftime("%d-%m-%Y")
-    log_entry = (
-        f"{today_str} (For {tomorrows_date_str}) | Market: {market_name} | "
-        f"Formula: {suggestion['display_name']} {suggestion['params_str']} | "
-        f"Rate: {suggestion['hit_rate']:.0f}% ({suggestion['hits_tries_str']}) | "
-        f"Suggested Anks: {' '.join(suggestion['generated_anks'])}\n")
+def format_log_entry(market_name, suggestion):
+    """ Ledger entry (see ledger.make_entry) of a suggestion from get_otc_suggestions_for_tomorrow. """
+    hits, tries = map(int, suggestion['hits_tries_str'].split("/"))
+    return make_entry(LEDGER_ENGINE, market_name, suggestion['for_date'], suggestion['formula_id'], suggestion['generated_anks'],
+                      display_name=suggestion['display_name'], params_str=suggestion['params_str'],
+                      rate=round(suggestion['hit_rate'], 2), hits=hits, tries=tries, **ranking_fields(suggestion))
+
+def write_log_entries(log_entries):
+    """ Appends a run's collected entries to the suggestion ledger in one locked write (already logged keys are skipped). """
+    if not log_entries: return
     try:
-        with open(log_file, 'a') as f: f.write(log_entry)
-    except IOError: print(C_ERROR + f"Could not write to log file: {log_file}")
+        with PROFILER.stage("log write"): append_entries(log_entries)
+    except OSError as e: print(C_ERROR + f"Could not write to suggestion ledger {LEDGER_FILE}: {e}")
+
+def log_top_suggestion(market_name, suggestion):
+    write_log_entries([format_log_entry(market_name, suggestion)])
 
 def display_performance_summary(all_stats):
     print_box_top(c=C_INFO_BRIGHT); print_box_line(f"{C_ACCENT_BRIGHT}Formula Performance Summary (All Tested)", bc=C_INFO_BRIGHT, align="center")
     print_box_sep(c=C_INFO_BRIGHT)
     header = f"{'Formula Name'.ljust(30)} | {'Params'.ljust(15)} | {'Hit Rate'.rjust(8)} | {'Hits/Tries'.rjust(10)}"
     print_box_line(C_WARNING_BRIGHT + header, bc=C_INFO_BRIGHT, p=1); print_box_sep(c=C_INFO_BRIGHT)
-    sorted_stats = sorted(all_stats.items(), key=lambda x: (x[1]['hits']/x[1]['tries'] if x[1]['tries']>0 else 0, x[1]['tries']), reverse=True)
+    sorted_stats = rank_formula_stats(all_stats)
     for f_id, data in sorted_stats[:15]:
         rate = (data['hits'] / data['tries'] * 100) if data['tries'] > 0 else 0
         name_str = data.get('display_name', f_id.split('_')[0])[:28]
-        param_str = data.get('params_str', str(ALL_FORMULA_SPECS[f_id]['params']))[:13]
-        line_color = C_SUCCESS if rate >= MIN_HIT_RATE_FOR_SUGGESTION*100 and data['tries'] >= MIN_TRIES_FOR_SUGGESTION else C_PRIMARY
+        param_str = data.get('params_str', str(get_formula_specs()[f_id]['params']))[:13]
+        line_color = C_SUCCESS if is_eligible(data) else C_PRIMARY
         data_line = f"{name_str.ljust(30)} | {param_str.ljust(15)} | {f'{rate:.0f}%'.rjust(8)} | {f'''{data['hits']}/{data['tries']}'''.rjust(10)}"
         print_box_line(line_color + data_line, bc=C_INFO_BRIGHT, p=1)
-    if len(sorted_stats) > 15: print_box_line("... and more ...", bc=C_INFO_BRIGHT, align="center", p=1)
+    if len(all_stats) > 15: print_box_line("... and more ...", bc=C_INFO_BRIGHT, align="center", p=1)
+    print_box_line(C_INFO + "Ranked by hit rate shrunk toward the chance rate of each formula's anks", bc=C_INFO_BRIGHT, align="center", p=1)
     print_box_bottom(c=C_INFO_BRIGHT)
 
-def display_otc_suggestions(market_name, suggestions_for_tomorrow):
-    tomorrows_date_str = (datetime.now() + timedelta(days=1)).strftime('%d-%m-%Y (%A)')
+def display_otc_suggestions(market_name, suggestions_for_tomorrow, log_entries=None):
+    """ Shows the suggestion table. The top suggestion is logged at once, or collected into log_entries if given. """
+    from ranking import SIGNIFICANCE_LEVEL
+    for_date = suggestions_for_tomorrow[0]["for_date"] if suggestions_for_tomorrow else (datetime.now() + timedelta(days=1)).strftime('%d-%m-%Y')
+    tomorrows_date_str = datetime.strptime(for_date, '%d-%m-%Y').strftime('%d-%m-%Y (%A)') # The day after the latest result, as logged
     print_box_top(c=C_SUCCESS_BRIGHT)
     print_box_line(f"{C_ACCENT_BRIGHT}OTC Ank Suggestions for {market_name} - {tomorrows_date_str}", bc=C_SUCCESS_BRIGHT, align="center")
     print_box_sep(c=C_SUCCESS_BRIGHT)
@@ -263,7 +364,8 @@ def display_otc_suggestions(market_name, suggestions_for_tomorrow):
             # For display table:
             name_str = sug['display_name'][:23]; param_str = sug['params_str'][:13]
             anks_str = ' '.join(sug['generated_anks'])[:8]; rate_str = f"{sug['hit_rate']:.0f}%"
-            line_color = C_SUCCESS_BRIGHT if sug['hit_rate'] >= MIN_HIT_RATE_FOR_SUGGESTION * 100 else C_PRIMARY_BRIGHT
+            significant = sug.get('q_value') is not None and sug['q_value'] <= SIGNIFICANCE_LEVEL
+            line_color = C_SUCCESS_BRIGHT if significant else C_PRIMARY_BRIGHT
             data_line = f"{str(i+1).ljust(4)} | {name_str.ljust(25)} | {param_str.ljust(15)} | {anks_str.ljust(10)} | {rate_str.rjust(7)}"
             print_box_line(line_color + data_line, bc=C_SUCCESS_BRIGHT, p=1)
 
@@ -276,7 +378,9 @@ def display_otc_suggestions(market_name, suggestions_for_tomorrow):
                              reason_details.append(f"{ank} (from {sug['display_name']} @{sug['hit_rate']:.0f}%)")
 
 
-            if i == 0: log_top_suggestion(market_name, sug) # Log the absolute top one
+            if i == 0: # Log the absolute top one
+                if log_entries is None: log_top_suggestion(market_name, sug)
+                else: log_entries.append(format_log_entry(market_name, sug))
 
         # Display the combined "Daily 3 OTC"
         print_box_sep(c=C_SUCCESS_BRIGHT)
@@ -294,7 +398,134 @@ def display_otc_suggestions(market_name, suggestions_for_tomorrow):
 
     print_box_bottom(c=C_SUCCESS_BRIGHT)
 
-def main():
+def backtest_market(market_name, large_history=False):
+    """
+    Load -> backtest for one market. Returns (formula_stats, latest_day_data), or None if there is not enough data.
+    With large_history the data file is streamed through the backtest instead of loaded into memory.
+    """
+    min_days = max(2, MIN_TRIES_FOR_SUGGESTION // 2) # Looser check for running backtest
+    if large_history:
+        with PROFILER.stage("backtest"): # Includes loading: the file is streamed through the backtest
+            current_formula_stats, day_count, latest_day_data = backtest_day_stream(lambda: read_data_stream(market_name), market_name)
+        if day_count < min_days:
+            print(C_ERROR_BRIGHT + f"Not enough historical data for {market_name} (found {day_count}). Meaningful backtesting requires more entries."); return None
+        return current_formula_stats, latest_day_data
+    with PROFILER.stage("load"): historical_data = read_data_file(market_name)
+    if not historical_data or len(historical_data) < min_days:
+        print(C_ERROR_BRIGHT + f"Not enough historical data for {market_name} (found {len(historical_data)}). Meaningful backtesting requires more entries."); return None
+    with PROFILER.stage("backtest"): current_formula_stats = backtest_all_formulas(historical_data, market_name)
+    return current_formula_stats, historical_data[-1]
+
+def analyze_market(market_name, log_entries=None, large_history=False):
+    """ Load -> backtest -> suggest for one market. Returns False if there is not enough data. """
+    print(C_INFO_BRIGHT + f"\nAnalyzing Market: {C_ACCENT_BRIGHT}{market_name}{C_RESET}\n")
+    backtested = backtest_market(market_name, large_history)
+    if backtested is None: return False
+    current_formula_stats, latest_day_data = backtested
+
+    with PROFILER.stage("display"):
+        if current_formula_stats: display_performance_summary(current_formula_stats)
+        else: print(C_WARNING + "No formula performance data from backtest.")
+
+    with PROFILER.stage("ranking"): eligible = eligible_formulas(current_formula_stats)
+    with PROFILER.stage("suggest"): suggestions_for_tomorrow = get_otc_suggestions_for_tomorrow(latest_day_data, eligible)
+
+    if suggestions_for_tomorrow:
+        with PROFILER.stage("display"): display_otc_suggestions(market_name, suggestions_for_tomorrow, log_entries)
+    else:
+        print(C_WARNING_BRIGHT + f"\nNo formulas for {market_name} significantly beat the chance rate of their anks (min tries {MIN_TRIES_FOR_SUGGESTION}, "
+                                 f"max q-value {MAX_FALSE_DISCOVERY_RATE:g}) for a suggestion today.")
+    return True
+
+# --- Headless Output (--format json / csv) ---
+HEADLESS_FIELDS = ("record", "market", "rank", "formula_id", "display_name", "params", "hits", "tries", "hit_rate",
+                   "chance_rate", "shrunk_rate", "p_value", "q_value", "anks", "for_date")
+
+def market_records(market_name, log_entries, large_history=False):
+    """
+    analyze_market without the display: formula_stat records for every formula, then suggestion
+    records in rank order ([] if there is not enough data). The top suggestion is added to log_entries.
+    """
+    backtested = backtest_market(market_name, large_history)
+    if backtested is None: return []
+    current_formula_stats, latest_day_data = backtested
+    with PROFILER.stage("ranking"): ranked = dict(rank_formula_stats(current_formula_stats))
+    records = [{"record": "formula_stat", "market": market_name, "formula_id": f_id, "display_name": d["display_name"],
+                "params": get_formula_specs()[f_id]["params"], "hits": d["hits"], "tries": d["tries"],
+                "hit_rate": round(d["hits"] / d["tries"] * 100, 2) if d["tries"] else 0.0, **ranking_fields(ranked.get(f_id, {}))}
+               for f_id, d in current_formula_stats.items()]
+    eligible = [(f_id, d) for f_id, d in ranked.items() if is_eligible(d)]
+    with PROFILER.stage("suggest"): suggestions = get_otc_suggestions_for_tomorrow(latest_day_data, eligible)
+    for rank, sug in enumerate(suggestions, 1):
+        perf = current_formula_stats[sug["formula_id"]]
+        records.append({"record": "suggestion", "market": market_name, "rank": rank, "formula_id": sug["formula_id"],
+                        "display_name": sug["display_name"], "params": get_formula_specs()[sug["formula_id"]]["params"], "hits": perf["hits"], "tries": perf["tries"],
+                        "hit_rate": round(sug["hit_rate"], 2), **ranking_fields(ranked[sug["formula_id"]]), "anks": sug["generated_anks"], "for_date": sug["for_date"]})
+    if suggestions: log_entries.append(format_log_entry(market_name, suggestions[0]))
+    return records
+
+def headless_market_batch(market_name, large_history=False):
+    """ Headless worker: one market's records; its progress and warnings go to stderr. """
+    plain_colors(globals()) # Workers that import the script afresh (spawn start method) start coloured
+    log_entries = []
+    with contextlib.redirect_stdout(sys.stderr):
+        try: records = market_records(market_name, log_entries, large_history)
+        except Exception as e: print(C_ERROR_BRIGHT + f"[!] Analysis failed for {market_name}: {e}"); records = []
+    return market_name, records, log_entries, PROFILER.take()
+
+def run_headless(markets, fmt, max_workers=None, large_history=False):
+    """ Writes the records of every market to stdout as JSON lines or CSV, in market order (parallel for several markets). """
+    writer = RecordWriter(fmt, HEADLESS_FIELDS)
+    if len(markets) == 1: results = [headless_market_batch(markets[0], large_history)]
+    else:
+        from concurrent.futures import ProcessPoolExecutor # Only parallel runs pay for multiprocessing
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(headless_market_batch, markets, repeat(large_history)))
+    all_log_entries = []
+    for market_name, records, log_entries, profile in results:
+        writer.write_all(records); all_log_entries.extend(log_entries); PROFILER.merge(profile)
+    with contextlib.redirect_stdout(sys.stderr): write_log_entries(all_log_entries)
+
+def run_market_batch(market_name, large_history=False):
+    """ --all-markets worker: analyzes one market with its output captured and log writes deferred. """
+    output, log_entries = io.StringIO(), []
+    with contextlib.redirect_stdout(output):
+        try: analyze_market(market_name, log_entries, large_history)
+        except Exception as e: print(C_ERROR_BRIGHT + f"[!] Analysis failed for {market_name}: {e}")
+    return market_name, output.getvalue(), log_entries, PROFILER.take()
+
+def run_all_markets(max_workers=None, large_history=False):
+    """ Analyzes every market in parallel; output is printed in MARKETS order and logs are written once. """
+    from concurrent.futures import ProcessPoolExecutor
+    print(C_INFO_BRIGHT + f"Analyzing {len(MARKETS)} markets in parallel...")
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(run_market_batch, MARKETS, repeat(large_history)))
+    all_log_entries = []
+    for market_name, output, log_entries, profile in results:
+        print(output, end=""); all_log_entries.extend(log_entries); PROFILER.merge(profile)
+    write_log_entries(all_log_entries)
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description=f"{APP_NAME} {APP_VERSION}")
+    parser.add_argument("--all-markets", action="store_true", help="Analyze every market non-interactively, in parallel processes")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for --all-markets (default: CPU count)")
+    parser.add_argument("--large-history", action="store_true", help="Stream data files through the backtest in constant memory")
+    add_profile_argument(parser)
+    add_output_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(args=None):
+    args = args or parse_args()
+    if args.format == "box": init(autoreset=True) # Colour/box display only; json/csv stdout stays a plain stream
+    else: plain_colors(globals()) # json/csv: progress and warnings on stderr without colour codes
+    enable_profiling(args.profile, APP_NAME)
+    if args.format != "box":
+        run_headless([args.market] if args.market else MARKETS, args.format, args.workers, args.large_history); return
+    if args.all_markets: run_all_markets(args.workers, args.large_history); return
+    if args.market:
+        if not analyze_market(args.market, large_history=args.large_history): sys.exit(1)
+        return
+
     show_banner()
     print_box_top(w=BOX_WIDTH // 2, c=C_PRIMARY_BRIGHT) # Market Selection Box
     print_box_line("Select Market", w=BOX_WIDTH // 2, bc=C_PRIMARY_BRIGHT, align="center")
@@ -307,48 +538,19 @@ def main():
         except ValueError: print(C_ERROR+"Invalid input.")
         if not (0 <= market_choice_idx < len(MARKETS)): print(C_ERROR+"Invalid choice.")
 
-    market_name = MARKETS[market_choice_idx]
-    print(C_INFO_BRIGHT + f"\nAnalyzing Market: {C_ACCENT_BRIGHT}{market_name}{C_RESET}\n")
-    historical_data = read_data_file(market_name)
-
-    if not historical_data or len(historical_data) < max(2, MIN_TRIES_FOR_SUGGESTION // 2) : # Looser check for running backtest
-        print(C_ERROR_BRIGHT + f"Not enough historical data for {market_name} (found {len(historical_data)}). Meaningful backtesting requires more entries."); sys.exit(1)
+    if not analyze_market(MARKETS[market_choice_idx], large_history=args.large_history): sys.exit(1)
 
-    current_formula_stats = backtest_all_formulas(historical_data)
-    if current_formula_stats: display_performance_summary(current_formula_stats)
-    else: print(C_WARNING + "No formula performance data from backtest.")
-
-    eligible_formulas = []
-    for f_id, data in current_formula_stats.items():
-        if data['tries'] >= MIN_TRIES_FOR_SUGGESTION:
-            hit_rate = data['hits'] / data['tries']
-            if hit_rate >= MIN_HIT_RATE_FOR_SUGGESTION: # Use the (potentially lowered) threshold
-                eligible_formulas.append((f_id, data))
-    
-    eligible_formulas.sort(key=lambda x: ((x[1]['hits']/x[1]['tries']), x[1]['tries']), reverse=True)
-    latest_day_data = historical_data[-1] if historical_data else None
-    suggestions_for_tomorrow = get_otc_suggestions_for_tomorrow(latest_day_data, eligible_formulas)
-
-    if suggestions_for_tomorrow:
-        display_otc_suggestions(market_name, suggestions_for_tomorrow)
-    else: # This message will show if MIN_HIT_RATE is high and nothing meets it
-        print(C_WARNING_BRIGHT + f"\nNo formulas for {market_name} met the required hit rate ({MIN_HIT_RATE_FOR_SUGGESTION*100:.0f}%) and min tries ({MIN_TRIES_FOR_SUGGESTION}) for a suggestion today.")
-        # Fallback: Show top N even if they don't meet criteria, if user wants "always suggest"
-        if MIN_HIT_RATE_FOR_SUGGESTION < 0.1: # Check if user set it to effectively zero
-            print(C_INFO + "Showing top formulas by tries even if below hit rate threshold...")
-            all_tried_formulas = sorted(
-                [(f_id, data) for f_id, data in current_formula_stats.items() if data['tries'] >= MIN_TRIES_FOR_SUGGESTION],
-                key=lambda x: ((x[1]['hits']/x[1]['tries']), x[1]['tries']), reverse=True
-            )
-            fallback_suggestions = get_otc_suggestions_for_tomorrow(latest_day_data, all_tried_formulas)
-            if fallback_suggestions:
-                display_otc_suggestions(market_name, fallback_suggestions)
 
+def run(argv=None, prog=None):
+    """ Command line entry point (also matka.py's subcommand): parse argv, run main, report crashes. """
+    cli_args = parse_args(argv, prog)
+    try: main(cli_args)
+    except KeyboardInterrupt: print(C_WARNING_BRIGHT+"\n\n[!] User interrupted."+C_RESET, file=sys.stderr)
+    except Exception as e:
+        print(C_ERROR_BRIGHT+f"\n[!!!] CRITICAL ERROR: {e}", file=sys.stderr); import traceback; traceback.print_exc()
+        print(C_ERROR_BRIGHT+"Please report this issue."+C_RESET, file=sys.stderr)
+    finally:
+        if cli_args.format == "box": print(C_PRIMARY_BRIGHT+f"\n✨ Thank you for using {APP_NAME}! ✨"+C_RESET)
 
 if __name__ == "__main__":
-    try: main()
-    except KeyboardInterrupt: print(C_WARNING_BRIGHT+"\n\n[!] User interrupted."+C_RESET)
-    except Exception as e:
-        print(C_ERROR_BRIGHT+f"\n[!!!] CRITICAL ERROR: {e}"); import traceback; traceback.print_exc()
-        print(C_ERROR_BRIGHT+"Please report this issue."+C_RESET)
-    finally: print(C_PRIMARY_BRIGHT+f"\n✨ Thank you for using {APP_NAME}! ✨"+C_RESET)
+    run()
@@ -4,15 +4,27 @@
 
 import os
 import sys
+import io
 import shutil
 import re
+import argparse
+import contextlib
 from datetime import datetime, timedelta
-from collections import Counter, defaultdict
-import json
+from collections import defaultdict
+from functools import lru_cache
+from itertools import repeat
+import time
 
+import numpy as np
 from colorama import Fore, Style, init
 
-init(autoreset=True)
+from formula_registry import COMPOSE_TERMS, compile_formula_set, day_signature, generate_expressions, output_cache
+from headless import RecordWriter, add_output_arguments, plain_colors
+from ledger import LEDGER_FILE, append_entries, make_entry
+from market_data import ank_mask, load_day_records, mask_to_anks
+from profiling import PROFILER, add_profile_argument, enable_profiling
+from ranking import CHANCE_HUNDREDTHS_BY_MASK, SIGNIFICANCE_LEVEL, formula_scores, rank_formulas, score_formulas
+
 
 # --- Configuration & Constants ---
 APP_NAME = "OTC MATH ANALYZER"
@@ -20,12 +32,24 @@ APP_VERSION = "v1.0"
 POWERED_BY = "Anuj & AI God (Enhanced by Sachin & AI)"
 BOX_WIDTH = 90 # Wider for more detailed formula output
 DATA_DIR = "data"
-LOG_DIR = "logs"
+LEDGER_ENGINE = "otc-math" # Engine name of this script's suggestions in the ledger
 
-MIN_HIT_RATE_SUGGESTION = 0.39 # (40%+)
+# Formulas are ranked on their hit rate shrunk toward the chance rate of the anks they play (ranking.py)
+MAX_FALSE_DISCOVERY_RATE = 0.1 # Highest q-value a suggested formula may have: at most 10% of suggested formulas only beat chance by luck
+                               # (short histories often have none: then there is no suggestion that day)
 MIN_TRIES_SUGGESTION = 10    # Formula must have been tried at least this many times
+MIN_BACKTEST_DAYS = max(2, MIN_TRIES_SUGGESTION // 2) # Fewer days of history than this is not backtested
 NUM_ANK_SUGGESTIONS_COMBINED = 3 # Our target for combined OTC anks
 NUM_INDIVIDUAL_FORMULA_SUGGESTIONS_TO_DISPLAY = 7 # Show top N performing formulas
+ROLLING_WINDOWS = (30, 60, 90) # Recent-form windows (days) tracked next to the all-history rate
+RANKING_WINDOW = None # Days of history used to rank formulas for suggestions (None = all history)
+WALK_FORWARD_CHUNK = 4096 # Days per block when replaying the walk-forward ranking (bounds memory)
+# Formula search (--search): composed formulas, pruned by successive halving
+SEARCH_MAX_TERMS = 3 # Up to 3 primitive terms per expression (~44k variants with X and the cut)
+SEARCH_FIRST_SLICE = 30 # Most recent days every candidate is scored on in the first round
+SEARCH_ETA = 3 # Each round keeps the best 1/ETA of the candidates and scores them on ETA x more days
+SEARCH_SURVIVORS = 40 # Candidates kept after the full-history round and added to the formula pool
+SEARCH_BATCH = 512 # Expressions evaluated per numpy block (bounds memory on long histories)
 
 # Color Palette
 C_PRIMARY_BRIGHT = Fore.CYAN + Style.BRIGHT; C_SECONDARY_BRIGHT = Fore.MAGENTA + Style.BRIGHT
@@ -46,6 +70,8 @@ MARKETS = [
 def print_box_top(w=BOX_WIDTH, c=C_SECONDARY_BRIGHT): print(c + f"╔{'═'*(w-2)}╗" + C_RESET)
 def print_box_bottom(w=BOX_WIDTH, c=C_SECONDARY_BRIGHT): print(c + f"╚{'═'*(w-2)}╝" + C_RESET)
 def print_box_sep(w=BOX_WIDTH, c=C_SECONDARY_BRIGHT): print(c + f"╠{'═'*(w-2)}╣" + C_RESET)
+def clear_screen(): # ANSI clear (colorama translates it on Windows) instead of spawning `clear` / `cls`
+    if sys.stdout.isatty(): print("\033[H\033[2J\033[3J", end="")
 def strip_ansi(t): return re.sub(r'\x1b\[[0-9;]*[mK]', '', t)
 def print_box_line(t, w=BOX_WIDTH, bc=C_SECONDARY_BRIGHT, tc="", align="left", p=2):
     st, cw = strip_ansi(t), w-2-(p*2); dsp_t = t; cl_diff = len(t)-len(st)
@@ -64,208 +90,470 @@ def print_box_line(t, w=BOX_WIDTH, bc=C_SECONDARY_BRIGHT, tc="", align="left", p
 
 # --- Core Logic Functions ---
 def show_banner():
-    os.system("clear" if os.name == 'posix' else 'cls'); print_box_top();
+    clear_screen(); print_box_top();
     print_box_line(f"{C_BANNER_TITLE}{APP_NAME}", align="center"); print_box_line(f"{C_BANNER_SUBTITLE}{APP_VERSION}", align="center")
     print_box_sep(); print_box_line(f"{C_BANNER_TEXT}Math-Based OTC Ank Suggester", align="center"); print_box_bottom(); print("\n")
 
-def parse_data_line(line_str):
-    try:
-        date_part_str, result_part_str = map(str.strip, line_str.split('/', 1))
-        p1, jodi, p2 = map(str.strip, result_part_str.split('-', 2))
-        if not (re.fullmatch(r"\d{3}",p1) and re.fullmatch(r"\d{2}",jodi) and re.fullmatch(r"\d{3}",p2)): return None
-        dt = datetime.strptime(date_part_str, "%d-%m-%Y")
-        return {
-            "date_obj": dt, "p1": p1, "jodi": jodi, "p2": p2,
-            "open_ank": p1[-1], "close_ank": jodi[-1],
-            "jodi_d1": jodi[0], "jodi_d2": jodi[1], # For convenience
-            "p1_digits": [d for d in p1], "p2_digits": [d for d in p2] # For convenience
-        }
-    except: return None
-
 def read_data_file(market_name):
     filepath = os.path.join(DATA_DIR, f"{market_name}.txt")
     try:
-        with open(filepath, 'r', encoding='utf-8') as f: lines = [line.strip() for line in f if line.strip()]
-        parsed = [parse_data_line(line) for line in lines]
-        return sorted([d for d in parsed if d is not None], key=lambda x: x['date_obj'])
+        return load_day_records(filepath) # DayRecord objects, sorted by date
     except FileNotFoundError: print(C_ERROR_BRIGHT + f"[!] File missing: {filepath}"); return []
     except Exception as e: print(C_ERROR_BRIGHT + f"[!] Read error {filepath}: {e}"); return []
 
 # --- MATHEMATICAL FORMULA DEFINITIONS for OTC ANKS ---
-# Each formula returns a set of 1 to 4 anks (strings).
-
-def f_prev_oc_anks(prev_data, params=None): # Basic
-    if not prev_data: return set()
-    return {prev_data['open_ank'], prev_data['close_ank']}
-
-def f_prev_jodi_digits(prev_data, params=None): # Basic
-    if not prev_data: return set()
-    return {prev_data['jodi_d1'], prev_data['jodi_d2']}
-
-def f_sum_jodi_digits_plus_x(prev_data, params):
-    if not prev_data or "X" not in params: return set()
-    try:
-        jd1, jd2 = int(prev_data['jodi_d1']), int(prev_data['jodi_d2'])
-        x = int(params["X"])
-        return {str((jd1 + jd2 + x) % 10)}
-    except ValueError: return set()
-
-def f_diff_jodi_digits_plus_x(prev_data, params):
-    if not prev_data or "X" not in params: return set()
-    try:
-        jd1, jd2 = int(prev_data['jodi_d1']), int(prev_data['jodi_d2'])
-        x = int(params["X"])
-        return {str((abs(jd1 - jd2) + x) % 10)}
-    except ValueError: return set()
-
-def f_sum_oc_anks_plus_x(prev_data, params):
-    if not prev_data or "X" not in params: return set()
-    try:
-        oa, ca = int(prev_data['open_ank']), int(prev_data['close_ank'])
-        x = int(params["X"])
-        return {str((oa + ca + x) % 10)}
-    except ValueError: return set()
-
-def f_ank_plus_x_and_cut(prev_data, params):
-    """ Takes a specific ank (open or close), adds X, and returns that ank and its cut. """
-    if not prev_data or "ank_type" not in params or "X" not in params: return set()
-    try:
-        ank_val = int(prev_data[params["ank_type"]]) # 'open_ank' or 'close_ank'
-        x = int(params["X"])
-        base_ank = (ank_val + x) % 10
-        cut_ank = (base_ank + 5) % 10
-        return {str(base_ank), str(cut_ank)}
-    except ValueError: return set()
-
-def f_panel_digit_op_plus_x(prev_data, params):
-    """ Operates on two digits of a panel and adds X. """
-    if not prev_data or "panel" not in params or "idx1" not in params \
-        or "idx2" not in params or "op" not in params or "X" not in params: return set()
-    try:
-        panel_digits = prev_data[params["panel"] + "_digits"] # e.g., prev_data["p1_digits"]
-        d1, d2 = int(panel_digits[params["idx1"]]), int(panel_digits[params["idx2"]])
-        x = int(params["X"])
-        res = 0
-        if params["op"] == "add": res = d1 + d2
-        elif params["op"] == "sub": res = abs(d1 - d2)
-        elif params["op"] == "mul": res = d1 * d2 # Be careful with mul by 0
-        
-        return {str((res + x) % 10)}
-    except (IndexError, ValueError, KeyError): return set()
-
-
-ALL_FORMULA_SPECS = {} # Initialize
-
-# Basic Formulas
-ALL_FORMULA_SPECS["PrevOCAnks"] = {"func": f_prev_oc_anks, "params": {}, "display": "Prev O/C Anks", "type": "ank"}
-ALL_FORMULA_SPECS["PrevJodiDigits"] = {"func": f_prev_jodi_digits, "params": {}, "display": "Prev Jodi Digits", "type": "ank"}
-
-# Parameterized Formulas
-for x_val in range(10):
-    ALL_FORMULA_SPECS[f"SumJodiDigits_X{x_val}"] = {"func": f_sum_jodi_digits_plus_x, "params": {"X": x_val}, "display": f"SumJodi+({x_val})", "type": "ank"}
-    ALL_FORMULA_SPECS[f"DiffJodiDigits_X{x_val}"] = {"func": f_diff_jodi_digits_plus_x, "params": {"X": x_val}, "display": f"DiffJodi+({x_val})", "type": "ank"}
-    ALL_FORMULA_SPECS[f"SumOCAnks_X{x_val}"] = {"func": f_sum_oc_anks_plus_x, "params": {"X": x_val}, "display": f"SumO+C+({x_val})", "type": "ank"}
-
-for ank_t in ["open_ank", "close_ank"]:
-    for x_val in range(5): # Smaller range for X to reduce formula count
-        display_ank_t = "OA" if ank_t == "open_ank" else "CA"
-        ALL_FORMULA_SPECS[f"AnkPlusXCut_{display_ank_t}_X{x_val}"] = {
-            "func": f_ank_plus_x_and_cut, "params": {"ank_type": ank_t, "X": x_val},
-            "display": f"{display_ank_t}+{x_val} & Cut", "type": "ank"
-        }
-
-panel_indices = [(0,1), (0,2), (1,2)]
-panel_ops = {"add":"+", "sub":"-", "mul":"*"}
-for p_type in ["p1", "p2"]:
-    for id1, id2 in panel_indices:
-        for op_key, op_sym in panel_ops.items():
-            # Only few X for panel ops to keep formula count manageable
-            for x_val in [0, 1, 5]: 
-                ALL_FORMULA_SPECS[f"PanelOp_{p_type.upper()}{id1}{op_sym}{id2}_X{x_val}"] = {
-                    "func": f_panel_digit_op_plus_x,
-                    "params": {"panel":p_type, "idx1":id1, "idx2":id2, "op":op_key, "X":x_val},
-                    "display": f"{p_type.upper()}[{id1}]{op_sym}[{id2}]+{x_val}", "type": "ank"
-                }
+# Families are declared in formula_registry; each compiles to an evaluator that takes the
+# previous day's DayRecord and returns its 1 to 4 anks as a 10-bit mask (0 = no anks).
+OTC_MATH_FORMULA_SET = [
+    # Basic Formulas
+    {"family": "open_close_anks", "formula_id": lambda p: "PrevOCAnks", "display": lambda p: "Prev O/C Anks"},
+    {"family": "jodi_digits", "formula_id": lambda p: "PrevJodiDigits", "display": lambda p: "Prev Jodi Digits"},
+    # Parameterized Formulas (the three X families are listed X by X)
+    [{"family": "sum_jodi_digits_plus_x"}, {"family": "diff_jodi_digits_plus_x"}, {"family": "sum_oc_anks_plus_x"}],
+    {"family": "ank_plus_x_and_cut"}, # Smaller range for X to reduce formula count
+    {"family": "panel_digit_op_plus_x"},
+]
+# Compiled on first use, so importing the script (or running another subcommand of matka.py) skips it.
+@lru_cache(maxsize=None)
+def get_formula_specs():
+    """ ALL_FORMULA_SPECS: the compiled OTC_MATH_FORMULA_SET. """
+    return compile_formula_set(OTC_MATH_FORMULA_SET)
+
+def __getattr__(name): # Keeps ALL_FORMULA_SPECS available as a module attribute
+    if name == "ALL_FORMULA_SPECS": return get_formula_specs()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 # --- END FORMULA DEFINITIONS ---
 
-def backtest_all_formulas(historical_data):
-    print(C_INFO_BRIGHT + f"Backtesting {len(ALL_FORMULA_SPECS)} OTC Ank formula variants...")
-    stats = {f_id: {"hits":0,"tries":0,"type":spec["type"],"display_name":spec["display"],"params_str":str(spec["params"])} 
-             for f_id, spec in ALL_FORMULA_SPECS.items()}
-    if len(historical_data) < 2: print(C_WARNING+"Need min 2 days data for backtest."); return stats
+# --- COLUMNAR BACKTEST ENGINE ---
+# History is loaded once into integer columns and every formula family is scored
+# for all of its variants at once: a family returns its generated anks as an array
+# of shape (variants, anks_per_variant, days) and hits are checked column-wise.
+
+def build_history_arrays(historical_data):
+    """ Converts DayRecords into integer numpy columns (one entry per day). """
+    n = len(historical_data)
+    def col(key): return np.fromiter((getattr(d, key) for d in historical_data), dtype=np.int16, count=n)
+    def panel(key): return np.array([getattr(d, key) for d in historical_data], dtype=np.int16).reshape(n, 3)
+    return {
+        "open_ank": col("open_ank"), "close_ank": col("close_ank"),
+        "jodi_d1": col("jodi_d1"), "jodi_d2": col("jodi_d2"),
+        "p1_digits": panel("p1_digits"), "p2_digits": panel("p2_digits"),
+    }
+
+def _x_column(params_list):
+    return np.array([int(p["X"]) for p in params_list], dtype=np.int16)[:, None, None]
+
+def vec_prev_oc_anks(prev, params_list):
+    oc = np.stack([prev["open_ank"], prev["close_ank"]])
+    return np.broadcast_to(oc, (len(params_list),) + oc.shape)
+
+def vec_prev_jodi_digits(prev, params_list):
+    jd = np.stack([prev["jodi_d1"], prev["jodi_d2"]])
+    return np.broadcast_to(jd, (len(params_list),) + jd.shape)
+
+def vec_sum_jodi_digits_plus_x(prev, params_list):
+    return (prev["jodi_d1"] + prev["jodi_d2"])[None, None, :] + _x_column(params_list)
+
+def vec_diff_jodi_digits_plus_x(prev, params_list):
+    return np.abs(prev["jodi_d1"] - prev["jodi_d2"])[None, None, :] + _x_column(params_list)
+
+def vec_sum_oc_anks_plus_x(prev, params_list):
+    return (prev["open_ank"] + prev["close_ank"])[None, None, :] + _x_column(params_list)
+
+def vec_ank_plus_x_and_cut(prev, params_list):
+    base = (np.stack([prev[p["ank_type"]] for p in params_list])[:, None, :] + _x_column(params_list)) % 10
+    return np.concatenate([base, base + 5], axis=1)
+
+def vec_panel_digit_op_plus_x(prev, params_list):
+    op_results = {} # (panel, idx1, idx2, op) -> result column, shared by every X of that op
+    rows = []
+    for p in params_list:
+        key = (p["panel"], p["idx1"], p["idx2"], p["op"])
+        if key not in op_results:
+            digits = prev[p["panel"] + "_digits"]
+            d1, d2 = digits[:, p["idx1"]], digits[:, p["idx2"]]
+            if p["op"] == "add": op_results[key] = d1 + d2
+            elif p["op"] == "sub": op_results[key] = np.abs(d1 - d2)
+            elif p["op"] == "mul": op_results[key] = d1 * d2
+            else: op_results[key] = np.zeros_like(d1)
+        rows.append(op_results[key])
+    return np.stack(rows)[:, None, :] + _x_column(params_list)
+
+NP_COMPOSE_OPS = {"add": np.add, "sub": lambda a, b: np.abs(a - b), "mul": np.multiply}
+
+def term_columns(cols):
+    """ formula_registry.COMPOSE_TERMS as int32 columns, {term: column}, from build_history_arrays-style columns. """
+    terms = {"jodi_d1": cols["jodi_d1"], "jodi_d2": cols["jodi_d2"], "open_ank": cols["open_ank"], "close_ank": cols["close_ank"]}
+    for panel in ("p1", "p2"):
+        for i in range(3): terms[f"{panel}_{i}"] = cols[f"{panel}_digits"][:, i]
+    return {t: terms[t].astype(np.int32) for t in COMPOSE_TERMS}
+
+def expression_column(terms_cols, terms, ops):
+    value = terms_cols[terms[0]]
+    for op, term in zip(ops, terms[1:]): value = NP_COMPOSE_OPS[op](value, terms_cols[term])
+    return value
+
+def vec_composed(prev, params_list):
+    terms_cols = term_columns(prev)
+    rows = []
+    for p in params_list:
+        base = (expression_column(terms_cols, p["terms"], p["ops"]) + int(p["X"])) % 10
+        rows.append((base, base + 5) if p["cut"] else (base, base)) # Uncut variants repeat their one ank
+    return np.array(rows)
+
+# Registry family name -> vectorized family evaluator. Families without an entry here
+# are scored by calling their compiled evaluators day by day (see SignatureMasks).
+FAMILY_VECTORIZERS = {
+    "open_close_anks": vec_prev_oc_anks,
+    "jodi_digits": vec_prev_jodi_digits,
+    "sum_jodi_digits_plus_x": vec_sum_jodi_digits_plus_x,
+    "diff_jodi_digits_plus_x": vec_diff_jodi_digits_plus_x,
+    "sum_oc_anks_plus_x": vec_sum_oc_anks_plus_x,
+    "ank_plus_x_and_cut": vec_ank_plus_x_and_cut,
+    "panel_digit_op_plus_x": vec_panel_digit_op_plus_x,
+    "composed": vec_composed,
+}
+
+# --- Signature Output Cache ---
+# Formulas are scored on the distinct previous-day signatures of a history only
+# (formula_registry.day_signature) and their outputs scattered back to the days. The outputs are
+# kept as ank masks per signature in the run-wide cache of the specs dict (output_cache), so the
+# next market, or days appended later, only evaluate the signatures not seen yet.
+class SignatureMasks:
+    """ Ank masks of every formula of a specs dict, as a (formulas, signatures) array with sorted signatures. """
+    def __init__(self, formula_specs):
+        self.families = defaultdict(list) # family name -> [(f_id, spec), ...] in registry order
+        for f_id, spec in formula_specs.items(): self.families[spec["family"]].append((f_id, spec))
+        self.f_ids = [f_id for members in self.families.values() for f_id, _ in members]
+        self.signatures = np.zeros(0, dtype=np.int64)
+        self.masks = np.zeros((len(self.f_ids), 0), dtype=np.int16)
+
+    def lookup(self, days, signatures):
+        """ The (formulas, days) masks of DayRecords `days` with their signatures; new signatures are evaluated first. """
+        unique, first = np.unique(signatures, return_index=True)
+        new = ~np.isin(unique, self.signatures, assume_unique=True)
+        if new.any(): self._add(unique[new], [days[i] for i in first[new]])
+        return self.masks[:, np.searchsorted(self.signatures, signatures)]
+
+    def _add(self, signatures, days):
+        """ Evaluates every family on one day per new signature and merges the columns in. """
+        hist, blocks = build_history_arrays(days), []
+        for family, members in self.families.items():
+            vectorizer = FAMILY_VECTORIZERS.get(family)
+            start = time.perf_counter()
+            if vectorizer is None: # Compiled evaluators, day by day
+                block = np.array([[spec["func"](d) for d in days] for _, spec in members], dtype=np.int16)
+            else:
+                generated = vectorizer(hist, [spec["params"] for _, spec in members]) % 10 # (variants, anks, days)
+                block = np.bitwise_or.reduce(np.left_shift(1, generated), axis=1).astype(np.int16)
+            if PROFILER.enabled: # A family is evaluated as one block, so its time is split evenly over its variants
+                elapsed = time.perf_counter() - start
+                for f_id, _ in members: PROFILER.add_formula(f_id, family, elapsed / len(members), len(days))
+            blocks.append(block)
+        signatures = np.concatenate([self.signatures, signatures])
+        order = np.argsort(signatures, kind="stable")
+        self.signatures, self.masks = signatures[order], np.concatenate([self.masks] + [np.concatenate(blocks, axis=0)], axis=1)[:, order]
+
+def compute_hit_matrix(historical_data, formula_specs=None, chance=None):
+    """
+    Scores every formula in formula_specs (default ALL_FORMULA_SPECS) against every day of history.
+    If a chance dict is given, chance["daily"] is set to the chance hit rate of the anks every formula
+    played each day, in hundredths (ranking.chance_rate; int8, shaped like hit_matrix), and chance["hits"]
+    to its sums: every formula's expected hits by chance (ints in formula_ids order).
+    Returns:
+        tuple: (formula_ids, hit_matrix) where hit_matrix[f, i] is True when formula f,
+               fed with day i, hit the open or close ank of day i+1.
+    """
+    cache = output_cache(formula_specs or get_formula_specs(), SignatureMasks)
+    prev_days, n = historical_data[:-1], len(historical_data) - 1
+    signatures = np.fromiter((day_signature(d) for d in prev_days), dtype=np.int64, count=n)
+    actual = np.fromiter((ank_mask(d.open_ank, d.close_ank) for d in historical_data[1:]), dtype=np.int16, count=n)
+    masks = cache.lookup(prev_days, signatures)
+    if chance is not None:
+        chance["daily"] = CHANCE_HUNDREDTHS_BY_MASK[masks]
+        chance["hits"] = chance["daily"].sum(axis=1)
+    return list(cache.f_ids), (masks & actual) != 0
+
+# --- FORMULA SEARCH (successive halving) ---
+# The composed family (formula_registry.composed_grid) has tens of thousands of variants.
+# Rather than backtesting them all, every candidate is scored on a short recent slice, the
+# best 1/SEARCH_ETA survive into a SEARCH_ETA x longer slice, and so on until the slice is the
+# whole history. Only the final survivors join the normal backtest.
+
+def _score_expressions(terms_cols, expressions, actual_oa, actual_ca):
+    """ hits[e, x * 2 + cut] of every (expression, X 0-9, cut) variant over the given days. """
+    hits = np.zeros((len(expressions), 20), dtype=np.int64)
+    for lo in range(0, len(expressions), SEARCH_BATCH):
+        batch = expressions[lo:lo + SEARCH_BATCH]; n = len(batch)
+        values = np.stack([expression_column(terms_cols, terms, ops) for terms, ops in batch])
+        # The X that makes the generated ank equal the open / close ank of the next day
+        r_o, r_c = (actual_oa - values) % 10, (actual_ca - values) % 10
+        rows10, rows5 = np.arange(n)[:, None] * 10, np.arange(n)[:, None] * 5
+        plain = np.bincount((rows10 + r_o).ravel(), minlength=n * 10) \
+              + np.bincount((rows10 + r_c)[r_c != r_o], minlength=n * 10)
+        # With the cut, X hits when X = r or r - 5 (mod 10), i.e. X % 5 == r % 5
+        m_o, m_c = r_o % 5, r_c % 5
+        cut = np.bincount((rows5 + m_o).ravel(), minlength=n * 5) + np.bincount((rows5 + m_c)[m_c != m_o], minlength=n * 5)
+        hits[lo:lo + n, 0::2] = plain.reshape(n, 10)
+        hits[lo:lo + n, 1::2] = cut.reshape(n, 5)[:, np.arange(10) % 5]
+    return hits
+
+def search_composed_formulas(historical_data, max_terms=SEARCH_MAX_TERMS, survivors=SEARCH_SURVIVORS):
+    """
+    Successive-halving search over the composed formula family.
+    Returns:
+        tuple: (specs, summary) - compiled specs of the survivors (best first) and a dict with
+               candidates / rounds / survivors counts.
+    """
+    expressions = generate_expressions(max_terms)
+    if len(historical_data) < 2: return {}, {"candidates": len(expressions) * 15, "rounds": 0, "survivors": 0}
+    hist = build_history_arrays(historical_data)
+    terms_cols = {t: col[:-1] for t, col in term_columns(hist).items()}
+    actual_oa, actual_ca = hist["open_ank"][1:].astype(np.int32), hist["close_ank"][1:].astype(np.int32)
+    days = len(actual_oa)
+
+    alive = np.arange(len(expressions) * 20) # Candidate id = expression * 20 + X * 2 + cut
+    alive = alive[(alive % 2 == 0) | (alive % 20 < 10)] # Cut with X >= 5 repeats X - 5
+    slice_days, rounds = SEARCH_FIRST_SLICE, 0
+    while True:
+        n_days = min(slice_days, days)
+        live_exprs = np.unique(alive // 20)
+        hits = _score_expressions({t: col[-n_days:] for t, col in terms_cols.items()},
+                                  [expressions[e] for e in live_exprs], actual_oa[-n_days:], actual_ca[-n_days:])
+        scores = hits[np.searchsorted(live_exprs, alive // 20), alive % 20]
+        rounds += 1
+        final = n_days >= days or len(alive) <= survivors
+        keep = survivors if final else max(survivors, -(-len(alive) // SEARCH_ETA))
+        best = np.argsort(-scores, kind="stable")[:keep] # Ties keep candidate order
+        if final: alive = alive[best]; break
+        alive = alive[np.sort(best)]
+        slice_days *= SEARCH_ETA
+
+    grid = [{"terms": expressions[c // 20][0], "ops": expressions[c // 20][1], "X": int(c % 20 // 2), "cut": bool(c % 2)} for c in alive]
+    specs = compile_formula_set([{"family": "composed", "grid": grid}])
+    return specs, {"candidates": len(expressions) * 15, "rounds": rounds, "survivors": len(specs)}
+
+# --- ROLLING WINDOWS & WALK-FORWARD ---
+# All windowed metrics come from one cumulative-hits array per formula, so any window
+# (or every day's "prior data only" ranking) costs a subtraction instead of a re-backtest.
+
+def prefix_hits(hit_matrix):
+    """ Cumulative hits: prefix[f, i] = hits of formula f over its first i backtest days. """
+    prefix = np.zeros((hit_matrix.shape[0], hit_matrix.shape[1] + 1), dtype=np.int32)
+    np.cumsum(hit_matrix, axis=1, out=prefix[:, 1:])
+    return prefix
+
+def window_hits(prefix, window=None):
+    """ (hits per formula, tries) over the last `window` backtest days; all days if window is None. """
+    days = prefix.shape[1] - 1
+    tries = days if window is None else min(window, days)
+    return prefix[:, days] - prefix[:, days - tries], tries
+
+def walk_forward_series(hit_matrix, chance_daily, window=None, prefix=None):
+    """
+    Out-of-sample replay of the ranking: before each backtest day, formulas are ranked as for a
+    suggestion (ranking.score_formulas: edge of the shrunk rate over the chance rate, then p-value,
+    then formula order) on the prior `window` days only (all prior days if None), and the best
+    is_eligible one is played. chance_daily is compute_hit_matrix's chance["daily"].
+    Returns dict: picks (formula row per day, -1 while fewer than MIN_TRIES_SUGGESTION prior days
+    exist or no formula is eligible), hits (whether the pick hit), days_ranked (days with enough
+    prior days), days_played and hit_count.
+    """
+    if prefix is None: prefix = prefix_hits(hit_matrix)
+    chance_prefix = prefix_hits(chance_daily)
+    days, rows = hit_matrix.shape[1], np.arange(hit_matrix.shape[0])
+    picks, days_ranked = np.full(days, -1, dtype=np.int32), 0
+    for lo in range(0, days, WALK_FORWARD_CHUNK):
+        t = np.arange(lo, min(lo + WALK_FORWARD_CHUNK, days))
+        start = np.zeros_like(t) if window is None else np.maximum(t - window, 0)
+        t, start = t[t - start >= MIN_TRIES_SUGGESTION], start[t - start >= MIN_TRIES_SUGGESTION]
+        if not len(t): continue
+        days_ranked += len(t)
+        # As in rank_formula_stats, a window is scored against the chance rate over all (prior) days
+        scores = score_formulas(prefix[:, t] - prefix[:, start], t - start, chance_prefix[:, t] / 100 / t * (t - start))
+        eligible = (scores["shrunk_rate"] > scores["chance_rate"]) & (scores["q_value"] <= MAX_FALSE_DISCOVERY_RATE) # is_eligible
+        edge = np.where(eligible, scores["edge"], -np.inf)
+        best = np.lexsort((np.broadcast_to(rows[:, None], edge.shape), scores["p_value"], -edge), axis=0)[0] # Equal tries each day
+        picks[t] = np.where(eligible[best, np.arange(len(t))], best, -1)
+    played = np.flatnonzero(picks >= 0)
+    hits = np.zeros(days, dtype=bool)
+    hits[played] = hit_matrix[picks[played], played]
+    return {"window": window, "picks": picks, "hits": hits, "days_ranked": days_ranked, "days_played": len(played), "hit_count": int(hits.sum())}
+
+def verify_walk_forward_ranking(days=200):
+    """
+    Checks walk_forward_series on a made-up pair of formulas: one playing 4 anks (64% by chance) that
+    hits 70% of days, one playing 1 ank (19% by chance) that hits 40%. The second has fewer hits but
+    the larger edge over chance, so it must be the one played. Returns a list of problems (empty = ok).
+    """
+    day = np.arange(days)
+    hit_matrix = np.stack([day % 10 < 7, day % 5 < 2])
+    chance_daily = np.array([[64], [19]], dtype=np.int8).repeat(days, axis=1)
+    picks = walk_forward_series(hit_matrix, chance_daily)["picks"]
+    problems = []
+    if (picks == 0).any(): problems.append(f"the 4-ank formula with more raw hits was played on {int((picks == 0).sum())} days")
+    if picks[-1] != 1: problems.append(f"the 1-ank formula with the larger edge is not played on the last day (pick {picks[-1]})")
+    return problems
+
+def _formula_stats(formula_specs, windows, f_ids=None, hit_matrix=None, prefix=None, chance_hits=None):
+    """
+    Stats dict of every formula, with hits/tries (all history and per window) from a hit matrix if
+    given, and "chance": its expected hits by chance over all history, in hundredths (see compute_hit_matrix).
+    """
+    stats = {f_id: {"hits":0,"tries":0,"chance":0,"type":spec["type"],"display_name":spec["display"],"params_str":str(spec["params"]),
+                    "windows": {w: {"hits": 0, "tries": 0} for w in windows}}
+             for f_id, spec in formula_specs.items()}
+    if hit_matrix is None: return stats
+    prefix = prefix_hits(hit_matrix) if prefix is None else prefix
+    totals, tries = window_hits(prefix)
+    windowed = {w: window_hits(prefix, w) for w in windows}
+    for row, f_id in enumerate(f_ids):
+        stats[f_id]["hits"] = int(totals[row]); stats[f_id]["tries"] = tries
+        if chance_hits is not None: stats[f_id]["chance"] = int(chance_hits[row])
+        for w, (w_hits, w_tries) in windowed.items():
+            stats[f_id]["windows"][w] = {"hits": int(w_hits[row]), "tries": w_tries}
+    return stats
 
-    for i in range(1, len(historical_data)):
-        prev_d, curr_d = historical_data[i-1], historical_data[i]
-        actual_otc_relevant_anks = {curr_d['open_ank'], curr_d['close_ank']}
-        
-        for f_id, spec in ALL_FORMULA_SPECS.items():
-            if prev_d is None : continue
-            stats[f_id]["tries"] += 1
-            generated_values = spec["func"](prev_d, spec["params"]) 
-            if not generated_values: continue # Formula might return empty set
-            # All formulas here are "ank" type
-            if not actual_otc_relevant_anks.isdisjoint(generated_values): # Check if any generated ank hit
-                stats[f_id]["hits"] += 1
+def backtest_all_formulas(historical_data, windows=ROLLING_WINDOWS, walk_forward=None, formula_specs=None, hit_state=None):
+    """
+    Backtests every formula (of formula_specs, default ALL_FORMULA_SPECS). Each stats entry also
+    carries "windows": {days: {"hits", "tries"}} for every window in `windows`. If a walk_forward
+    dict is given (with an optional "window" key), it is filled with the walk_forward_series result.
+    If a hit_state dict is given, it is filled with the f_ids, hit_matrix and chance hits, for extend_backtest.
+    """
+    formula_specs = formula_specs or get_formula_specs()
+    print(C_INFO_BRIGHT + f"Backtesting {len(formula_specs)} OTC Ank formula variants...")
+    if len(historical_data) < 2: print(C_WARNING+"Need min 2 days data for backtest."); return _formula_stats(formula_specs, windows)
+
+    chance = {}
+    f_ids, hit_matrix = compute_hit_matrix(historical_data, formula_specs, chance)
+    prefix = prefix_hits(hit_matrix)
+    stats = _formula_stats(formula_specs, windows, f_ids, hit_matrix, prefix, chance["hits"])
+    if walk_forward is not None:
+        walk_forward.update(walk_forward_series(hit_matrix, chance["daily"], walk_forward.get("window"), prefix))
+        walk_forward["f_ids"] = f_ids
+    if hit_state is not None: hit_state.update(f_ids=f_ids, hit_matrix=hit_matrix, chance_hits=chance["hits"], last_day=historical_data[-1])
     return stats
 
-def get_otc_suggestions_for_tomorrow(latest_day_data, all_formula_stats):
+def extend_backtest(hit_state, new_days, windows=ROLLING_WINDOWS, formula_specs=None):
+    """
+    Pushes newly ingested days (market_data.MarketTail) into a backtest kept in hit_state (see
+    backtest_all_formulas): only the new days are scored, their columns are appended to the hit
+    matrix, and the updated stats are returned.
+    """
+    formula_specs = formula_specs or get_formula_specs()
+    if new_days:
+        chance = {}
+        f_ids, new_hits = compute_hit_matrix([hit_state["last_day"]] + list(new_days), formula_specs, chance)
+        if f_ids != hit_state["f_ids"]: raise ValueError("Formula set changed since the backtest was built")
+        hit_state.update(hit_matrix=np.concatenate([hit_state["hit_matrix"], new_hits], axis=1),
+                         chance_hits=hit_state["chance_hits"] + chance["hits"], last_day=new_days[-1])
+    return _formula_stats(formula_specs, windows, hit_state["f_ids"], hit_state["hit_matrix"], chance_hits=hit_state["chance_hits"])
+
+def ranking_perf(perf_data, window=None):
+    """ The {"hits", "tries"} a formula is ranked on: all history, or one of its rolling windows. """
+    return perf_data if window is None else perf_data["windows"][window]
+
+def rank_formula_stats(all_formula_stats, window=None):
+    """
+    (f_id, perf) of every tried formula, best first (ranking.rank_formulas), where perf is a copy of
+    its ranking_perf with its chance_rate, shrunk_rate, p_value and q_value added. A window is
+    ranked against the formula's chance rate over all history.
+    """
+    f_ids = list(all_formula_stats)
+    perfs = [dict(ranking_perf(all_formula_stats[f_id], window)) for f_id in f_ids]
+    chance_rates = [d["chance"] / 100 / d["tries"] if d["tries"] else 0.0 for d in all_formula_stats.values()]
+    ranked = rank_formulas([p["hits"] for p in perfs], [p["tries"] for p in perfs], [c * p["tries"] for c, p in zip(chance_rates, perfs)])
+    return [(f_ids[i], {**perfs[i], **formula_scores(ranked, i)}) for i in ranked["order"]]
+
+def is_eligible(perf_data):
+    """ Whether a rank_formula_stats entry may be suggested: enough tries, a shrunk rate above chance and a low enough q-value. """
+    return (perf_data["tries"] >= MIN_TRIES_SUGGESTION and perf_data["shrunk_rate"] > perf_data["chance_rate"]
+            and perf_data["q_value"] <= MAX_FALSE_DISCOVERY_RATE)
+
+def ranking_fields(perf_data):
+    """ The ranking scores of a rank_formula_stats entry (or suggestion) as record fields, rates in percent like hit_rate. """
+    if perf_data.get("q_value") is None: return {}
+    return {"chance_rate": round(perf_data["chance_rate"] * 100, 2), "shrunk_rate": round(perf_data["shrunk_rate"] * 100, 2),
+            "p_value": round(perf_data["p_value"], 6), "q_value": round(perf_data["q_value"], 6)}
+
+def get_otc_suggestions_for_tomorrow(latest_day_data, all_formula_stats, window=None, formula_specs=None):
     suggestions = [] # List of dicts
     if not latest_day_data: return suggestions
-    
-    eligible_formulas = []
-    for f_id, perf_data in all_formula_stats.items():
-        # All formulas are 'ank' type in this script
-        if perf_data['tries'] >= MIN_TRIES_SUGGESTION:
-            hit_rate = (perf_data['hits'] / perf_data['tries']) if perf_data['tries'] > 0 else 0
-            if hit_rate >= MIN_HIT_RATE_SUGGESTION:
-                eligible_formulas.append((f_id, perf_data, hit_rate))
-    
-    eligible_formulas.sort(key=lambda x: (x[2], x[1]['tries']), reverse=True) # Sort by hit_rate, then tries
+    for_date = (latest_day_data.date_obj + timedelta(days=1)).strftime("%d-%m-%Y") # The result day the anks are for
 
-    for f_id, perf_data, hit_rate in eligible_formulas:
-        spec = ALL_FORMULA_SPECS.get(f_id)
+    # All formulas are 'ank' type in this script; eligible ones come best first
+    eligible_formulas = [(f_id, perf_data) for f_id, perf_data in rank_formula_stats(all_formula_stats, window) if is_eligible(perf_data)]
+
+    for f_id, perf_data in eligible_formulas:
+        spec = (formula_specs or get_formula_specs()).get(f_id)
         if not spec: continue
-        generated_values = spec["func"](latest_day_data, spec["params"])
-        if generated_values: # Only add if formula actually produced anks
+        generated_mask = spec["func"](latest_day_data)
+        if generated_mask: # Only add if formula actually produced anks
             suggestions.append({
-                "display_name": perf_data["display_name"], "params_str": perf_data["params_str"],
-                "generated_anks": sorted(list(generated_values)), "hit_rate": hit_rate * 100,
-                "hits_tries_str": f"{perf_data['hits']}/{perf_data['tries']}" })
+                "formula_id": f_id, "display_name": all_formula_stats[f_id]["display_name"], "params_str": all_formula_stats[f_id]["params_str"],
+                "generated_anks": mask_to_anks(generated_mask), "hit_rate": perf_data['hits'] / perf_data['tries'] * 100,
+                "hits_tries_str": f"{perf_data['hits']}/{perf_data['tries']}", "for_date": for_date,
+                **{key: perf_data[key] for key in ("chance_rate", "shrunk_rate", "p_value", "q_value")} })
     return suggestions
 
 
-def log_top_suggestion(market_name, suggestion):
-    os.makedirs(LOG_DIR, exist_ok=True)
-    log_file = os.path.join(LOG_DIR, "otc_math_daily_suggestions.txt") # Different log file
-    today = datetime.now().strftime("%d-%m-%Y"); tomorrow = (datetime.now()+timedelta(days=1)).strftime("%d-%m-%Y")
-    entry = (f"{today} (For {tomorrow}) | Mkt: {market_name} | "
-             f"Formula: {suggestion['display_name']} {suggestion['params_str']} | "
-             f"Rate: {suggestion['hit_rate']:.0f}% ({suggestion['hits_tries_str']}) | "
-             f"Sugg. Anks: {' '.join(suggestion['generated_anks'])}\n")
+def format_log_entry(market_name, suggestion):
+    """ Ledger entry (see ledger.make_entry) of a suggestion from get_otc_suggestions_for_tomorrow. """
+    hits, tries = map(int, suggestion['hits_tries_str'].split("/"))
+    return make_entry(LEDGER_ENGINE, market_name, suggestion['for_date'], suggestion['formula_id'], suggestion['generated_anks'],
+                      display_name=suggestion['display_name'], params_str=suggestion['params_str'],
+                      rate=round(suggestion['hit_rate'], 2), hits=hits, tries=tries, **ranking_fields(suggestion))
+
+def write_log_entries(entries):
+    """ Appends a run's collected entries to the suggestion ledger in one locked write (already logged keys are skipped). """
+    if not entries: return
     try:
-        with open(log_file, 'a') as f: f.write(entry)
-    except IOError: print(C_ERROR + f"Log write error: {log_file}")
+        with PROFILER.stage("log write"): append_entries(entries)
+    except OSError as e: print(C_ERROR + f"Suggestion ledger write error {LEDGER_FILE}: {e}")
+
+def log_top_suggestion(market_name, suggestion):
+    write_log_entries([format_log_entry(market_name, suggestion)])
 
-def display_performance_summary(all_stats):
-    print_box_top(c=C_INFO_BRIGHT); print_box_line(f"{C_ACCENT_BRIGHT}Math Formula Performance (OTC Anks)", bc=C_INFO_BRIGHT, align="center")
+def display_performance_summary(all_stats, window=None):
+    title = "Math Formula Performance (OTC Anks)" + (f" - ranked on last {window} days" if window else "")
+    print_box_top(c=C_INFO_BRIGHT); print_box_line(f"{C_ACCENT_BRIGHT}{title}", bc=C_INFO_BRIGHT, align="center")
     print_box_sep(c=C_INFO_BRIGHT)
-    header = f"{'Formula Display Name'.ljust(35)} | {'Parameters'.ljust(20)} | {'Rate'.rjust(7)} | {'Hits/Tries'.rjust(10)}"
+    recent_label = "/".join(str(w) for w in ROLLING_WINDOWS) + "d%"
+    header = f"{'Formula Display Name'.ljust(30)} | {'Parameters'.ljust(16)} | {'Rate'.rjust(7)} | {'Hits/Tries'.rjust(10)} | {recent_label.rjust(11)}"
     print_box_line(C_WARNING_BRIGHT + header, bc=C_INFO_BRIGHT, p=1); print_box_sep(c=C_INFO_BRIGHT)
     
-    sorted_stats = sorted(all_stats.items(), key=lambda x: (x[1]['hits']/x[1]['tries'] if x[1]['tries']>0 else 0, x[1]['tries']), reverse=True)
+    def rate_of(d): return d['hits']/d['tries'] if d['tries']>0 else 0
+    sorted_stats = rank_formula_stats(all_stats, window)
 
     for f_id, data in sorted_stats[:20]: # Display top 20
-        rate = (data['hits']/data['tries']*100) if data['tries']>0 else 0
-        name = data.get('display_name', f_id)[:33]
-        param = data.get('params_str', "{}")[:18]
-        clr = C_SUCCESS if rate >= MIN_HIT_RATE_SUGGESTION*100 and data['tries'] >= MIN_TRIES_SUGGESTION else C_PRIMARY
-        line = f"{name.ljust(35)} | {param.ljust(20)} | {f'{rate:.0f}%'.rjust(7)} | {f'''{data['hits']}/{data['tries']}'''.rjust(10)}"
+        stats_entry = all_stats[f_id]
+        rate = rate_of(data)*100
+        name = stats_entry.get('display_name', f_id)[:28]
+        param = stats_entry.get('params_str', "{}")[:16]
+        recent = "/".join(f"{rate_of(stats_entry['windows'][w])*100:.0f}" if w in stats_entry.get('windows', {}) else "-" for w in ROLLING_WINDOWS)
+        clr = C_SUCCESS if is_eligible(data) else C_PRIMARY
+        line = f"{name.ljust(30)} | {param.ljust(16)} | {f'{rate:.0f}%'.rjust(7)} | {f'''{data['hits']}/{data['tries']}'''.rjust(10)} | {recent.rjust(11)}"
         print_box_line(clr + line, bc=C_INFO_BRIGHT, p=1)
-    if len(sorted_stats) > 20: print_box_line("... and more ...", bc=C_INFO_BRIGHT, align="center", p=1)
+    if len(all_stats) > 20: print_box_line("... and more ...", bc=C_INFO_BRIGHT, align="center", p=1)
+    print_box_line(C_INFO + "Ranked by hit rate shrunk toward the chance rate of each formula's anks", bc=C_INFO_BRIGHT, align="center", p=1)
     print_box_bottom(c=C_INFO_BRIGHT)
 
-def display_final_otc_suggestions(market_name, suggestions_from_formulas):
-    tomorrow = (datetime.now() + timedelta(days=1)).strftime('%d-%m-%Y (%A)')
+def display_walk_forward(walk_forward):
+    """ One-line summary of the walk-forward replay (see walk_forward_series). """
+    if not walk_forward.get("days_ranked"):
+        print(C_WARNING + f"Walk-forward: not enough history to rank formulas on prior data (need {MIN_TRIES_SUGGESTION}+ days)."); return
+    scope = f"prior {walk_forward['window']} days" if walk_forward["window"] else "all prior days"
+    if not walk_forward["days_played"]:
+        print(C_WARNING + f"Walk-forward (daily re-rank on {scope}): no formula was eligible on any of {walk_forward['days_ranked']} days."); return
+    rate = walk_forward["hit_count"] / walk_forward["days_played"] * 100
+    print(C_INFO_BRIGHT + f"Walk-forward (daily re-rank on {scope}): top eligible formula hit {walk_forward['hit_count']}/{walk_forward['days_played']} days "
+                          f"({rate:.0f}%; {walk_forward['days_ranked'] - walk_forward['days_played']} of {walk_forward['days_ranked']} days had none).")
+
+def display_final_otc_suggestions(market_name, suggestions_from_formulas, log_entries=None):
+    """ Shows the suggestion table. The top suggestion is logged at once, or collected into log_entries if given. """
+    for_date = suggestions_from_formulas[0]["for_date"] if suggestions_from_formulas else (datetime.now() + timedelta(days=1)).strftime('%d-%m-%Y')
+    tomorrow = datetime.strptime(for_date, '%d-%m-%Y').strftime('%d-%m-%Y (%A)') # The day after the latest result, as logged
     print_box_top(c=C_SUCCESS_BRIGHT)
     print_box_line(f"{C_ACCENT_BRIGHT}OTC Ank Suggestions for {market_name} - {tomorrow}", bc=C_SUCCESS_BRIGHT, align="center")
     print_box_sep(c=C_SUCCESS_BRIGHT)
@@ -283,10 +571,12 @@ def display_final_otc_suggestions(market_name, suggestions_from_formulas):
         for i, sug in enumerate(suggestions_from_formulas[:NUM_INDIVIDUAL_FORMULA_SUGGESTIONS_TO_DISPLAY]):
             name = sug['display_name'][:33]; param = sug['params_str'][:18]
             anks = ' '.join(sug['generated_anks'])[:8]; rate = f"{sug['hit_rate']:.0f}%"
-            clr = C_SUCCESS_BRIGHT # They already met criteria to be in this list
+            clr = C_SUCCESS_BRIGHT if sug['q_value'] <= SIGNIFICANCE_LEVEL else C_PRIMARY_BRIGHT # All beat chance; green ones at the display significance level
             line = f"{str(i+1).ljust(4)}| {name.ljust(35)}| {param.ljust(20)}| {anks.ljust(10)}| {rate.rjust(7)}"
             print_box_line(clr+line, bc=C_SUCCESS_BRIGHT, p=1)
-            if i == 0: log_top_suggestion(market_name, sug) # Log the absolute top one
+            if i == 0: # Log the absolute top one
+                if log_entries is None: log_top_suggestion(market_name, sug)
+                else: log_entries.append(format_log_entry(market_name, sug))
 
             for ank_val in sug['generated_anks']:
                 if len(final_combined_anks) < NUM_ANK_SUGGESTIONS_COMBINED:
@@ -310,7 +600,158 @@ def display_final_otc_suggestions(market_name, suggestions_from_formulas):
             print_box_line(C_WARNING+f"Could not determine a combined set of {NUM_ANK_SUGGESTIONS_COMBINED} OTC anks.", bc=C_SUCCESS_BRIGHT, align="center", p=1)
     print_box_bottom(c=C_SUCCESS_BRIGHT)
 
-def main():
+def backtest_market(market_name, window=RANKING_WINDOW, search=False, replay=False):
+    """
+    Load -> (search) -> backtest for one market.
+    Returns (historical_data, all_formula_stats, formula_specs, walk_forward), or None if there is not enough data.
+    window: rank formulas on their last `window` days instead of all history.
+    search: also search the composed formula space and backtest its survivors (see search_composed_formulas).
+    replay: also run the walk-forward replay (walk_forward_series) into walk_forward; it re-ranks every day, so only the display asks for it.
+    """
+    with PROFILER.stage("load"): historical_data = read_data_file(market_name)
+    if not historical_data or len(historical_data) < MIN_BACKTEST_DAYS:
+        print(C_ERROR_BRIGHT+f"Not enough data for {market_name} (found {len(historical_data)}). Backtesting needs more."); return None
+    return (historical_data,) + backtest_history(historical_data, window, search, replay=replay)
+
+def ranking_windows(window=RANKING_WINDOW):
+    """ Rolling windows the stats are kept for: ROLLING_WINDOWS plus the ranking window. """
+    return tuple(sorted(set(ROLLING_WINDOWS) | ({window} if window else set())))
+
+def backtest_history(historical_data, window=RANKING_WINDOW, search=False, hit_state=None, replay=False):
+    """ (all_formula_stats, formula_specs, walk_forward) of a loaded history; see backtest_market and backtest_all_formulas. """
+    windows = ranking_windows(window)
+    formula_specs = get_formula_specs()
+    if search:
+        with PROFILER.stage("search"): found_specs, summary = search_composed_formulas(historical_data)
+        print(C_INFO_BRIGHT + f"Formula search: {summary['candidates']} composed variants -> {summary['survivors']} survivors in {summary['rounds']} halving rounds.")
+        formula_specs = {**get_formula_specs(), **found_specs}
+    walk_forward = {"window": window}
+    with PROFILER.stage("backtest"): all_formula_stats = backtest_all_formulas(historical_data, windows, walk_forward if replay else None, formula_specs, hit_state)
+    return all_formula_stats, formula_specs, walk_forward
+
+def analyze_market(market_name, log_entries=None, window=RANKING_WINDOW, search=False):
+    """ Load -> backtest -> suggest for one market (see backtest_market). Returns False if there is not enough data. """
+    print(C_INFO_BRIGHT+f"\nAnalyzing Market: {C_ACCENT_BRIGHT}{market_name}{C_RESET} for OTC Anks using Math Formulas\n")
+    backtested = backtest_market(market_name, window, search, replay=True)
+    if backtested is None: return False
+    historical_data, all_formula_stats, formula_specs, walk_forward = backtested
+
+    with PROFILER.stage("display"):
+        if all_formula_stats: display_performance_summary(all_formula_stats, window)
+        else: print(C_WARNING+"No formula performance data from backtest.")
+        if "picks" in walk_forward: display_walk_forward(walk_forward)
+
+    latest_day_data = historical_data[-1] if historical_data else None
+    with PROFILER.stage("ranking"): # Eligibility, sort and next-day anks of the eligible formulas
+        otc_ank_suggestions = get_otc_suggestions_for_tomorrow(latest_day_data, all_formula_stats, window, formula_specs)
+
+    if otc_ank_suggestions:
+        with PROFILER.stage("display"): display_final_otc_suggestions(market_name, otc_ank_suggestions, log_entries)
+    else: 
+        print(C_WARNING_BRIGHT + f"\nNo Math Formulas for {market_name} significantly beat the chance rate of their anks (min tries {MIN_TRIES_SUGGESTION}, "
+                                 f"max q-value {MAX_FALSE_DISCOVERY_RATE:g}) for an OTC Ank suggestion today.")
+    return True
+
+# --- Headless Output (--format json / csv) ---
+HEADLESS_FIELDS = ("record", "market", "rank", "formula_id", "display_name", "params", "hits", "tries", "hit_rate",
+                   "chance_rate", "shrunk_rate", "p_value", "q_value", "windows", "anks", "for_date")
+
+def market_records(market_name, log_entries, window=RANKING_WINDOW, search=False):
+    """
+    analyze_market without the display: formula_stat records for every formula (with its rolling
+    windows and its scores in the ranking on `window`), then suggestion records in rank order
+    ([] if there is not enough data). The top suggestion is added to log_entries.
+    """
+    backtested = backtest_market(market_name, window, search)
+    if backtested is None: return []
+    historical_data, all_formula_stats, formula_specs, walk_forward = backtested
+    with PROFILER.stage("ranking"): ranked = dict(rank_formula_stats(all_formula_stats, window))
+    records = [{"record": "formula_stat", "market": market_name, "formula_id": f_id, "display_name": d["display_name"],
+                "params": formula_specs[f_id]["params"], "hits": d["hits"], "tries": d["tries"],
+                "hit_rate": round(d["hits"] / d["tries"] * 100, 2) if d["tries"] else 0.0, **ranking_fields(ranked.get(f_id, {})),
+                "windows": {str(w): wd for w, wd in d["windows"].items()}}
+               for f_id, d in all_formula_stats.items()]
+    with PROFILER.stage("ranking"):
+        suggestions = get_otc_suggestions_for_tomorrow(historical_data[-1], all_formula_stats, window, formula_specs)
+    for rank, sug in enumerate(suggestions, 1):
+        perf = ranking_perf(all_formula_stats[sug["formula_id"]], window)
+        records.append({"record": "suggestion", "market": market_name, "rank": rank, "formula_id": sug["formula_id"],
+                        "display_name": sug["display_name"], "params": formula_specs[sug["formula_id"]]["params"],
+                        "hits": perf["hits"], "tries": perf["tries"], "hit_rate": round(sug["hit_rate"], 2), **ranking_fields(sug),
+                        "anks": sug["generated_anks"], "for_date": sug["for_date"]})
+    if suggestions: log_entries.append(format_log_entry(market_name, suggestions[0]))
+    return records
+
+def headless_market_batch(market_name, window=RANKING_WINDOW, search=False):
+    """ Headless worker: one market's records; its progress and warnings go to stderr. """
+    plain_colors(globals()) # Workers that import the script afresh (spawn start method) start coloured
+    log_entries = []
+    with contextlib.redirect_stdout(sys.stderr):
+        try: records = market_records(market_name, log_entries, window, search)
+        except Exception as e: print(C_ERROR_BRIGHT+f"[!] Analysis failed for {market_name}: {e}"); records = []
+    return market_name, records, log_entries, PROFILER.take()
+
+def run_headless(markets, fmt, max_workers=None, window=RANKING_WINDOW, search=False):
+    """ Writes the records of every market to stdout as JSON lines or CSV, in market order (parallel for several markets). """
+    writer = RecordWriter(fmt, HEADLESS_FIELDS)
+    if len(markets) == 1: results = [headless_market_batch(markets[0], window, search)]
+    else:
+        from concurrent.futures import ProcessPoolExecutor # Only parallel runs pay for multiprocessing
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(headless_market_batch, markets, repeat(window), repeat(search)))
+    all_log_entries = []
+    for market_name, records, log_entries, profile in results:
+        writer.write_all(records); all_log_entries.extend(log_entries); PROFILER.merge(profile)
+    with contextlib.redirect_stdout(sys.stderr): write_log_entries(all_log_entries)
+
+def run_market_batch(market_name, window=RANKING_WINDOW, search=False):
+    """ --all-markets worker: analyzes one market with its output captured and log writes deferred. """
+    output, log_entries = io.StringIO(), []
+    with contextlib.redirect_stdout(output):
+        try: analyze_market(market_name, log_entries, window, search)
+        except Exception as e: print(C_ERROR_BRIGHT+f"[!] Analysis failed for {market_name}: {e}")
+    return market_name, output.getvalue(), log_entries, PROFILER.take()
+
+def run_all_markets(max_workers=None, window=RANKING_WINDOW, search=False):
+    """ Analyzes every market in parallel; output is printed in MARKETS order and logs are written once. """
+    from concurrent.futures import ProcessPoolExecutor
+    print(C_INFO_BRIGHT+f"Analyzing {len(MARKETS)} markets in parallel...")
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(run_market_batch, MARKETS, repeat(window), repeat(search)))
+    all_log_entries = []
+    for market_name, output, log_entries, profile in results:
+        print(output, end=""); all_log_entries.extend(log_entries); PROFILER.merge(profile)
+    write_log_entries(all_log_entries)
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description=f"{APP_NAME} {APP_VERSION}")
+    parser.add_argument("--all-markets", action="store_true", help="Analyze every market non-interactively, in parallel processes")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for --all-markets (default: CPU count)")
+    parser.add_argument("--window", type=int, default=RANKING_WINDOW, metavar="DAYS", help="Rank formulas on their last DAYS days only (default: all history)")
+    parser.add_argument("--search", action="store_true", help="Also search composed formulas (successive halving) and backtest the survivors")
+    parser.add_argument("--verify-ranking", action="store_true", help="Check that the walk-forward replay plays formulas by edge over chance, not raw hits, and exit")
+    add_profile_argument(parser)
+    add_output_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(args=None):
+    args = args or parse_args()
+    if args.format == "box": init(autoreset=True) # Colour/box display only; json/csv stdout stays a plain stream
+    else: plain_colors(globals()) # json/csv: progress and warnings on stderr without colour codes
+    enable_profiling(args.profile, APP_NAME)
+    if args.window is not None and args.window < 1: print(C_ERROR_BRIGHT+"--window must be a positive number of days.", file=sys.stderr); sys.exit(2)
+    if args.verify_ranking:
+        problems = verify_walk_forward_ranking()
+        if not problems: print(C_SUCCESS_BRIGHT + "Walk-forward replay plays the formula with the largest edge over chance.")
+        for problem in problems: print(C_ERROR + problem)
+        sys.exit(1 if problems else 0)
+    if args.format != "box":
+        run_headless([args.market] if args.market else MARKETS, args.format, args.workers, args.window, args.search); return
+    if args.all_markets: run_all_markets(args.workers, args.window, args.search); return
+    if args.market:
+        if not analyze_market(args.market, window=args.window, search=args.search): sys.exit(1)
+        return
+
     show_banner()
     print_box_top(w=BOX_WIDTH//2,c=C_PRIMARY_BRIGHT); print_box_line("Select Market",w=BOX_WIDTH//2,bc=C_PRIMARY_BRIGHT,align="center")
     for i,m in enumerate(MARKETS): print_box_line(f"{C_WARNING}{i+1}. {C_SECONDARY}{m}",w=BOX_WIDTH//2,bc=C_PRIMARY_BRIGHT)
@@ -320,29 +761,18 @@ def main():
         try: mk_idx = int(input(C_PRIMARY_BRIGHT+"Enter market number: "+C_RESET))-1
         except ValueError: print(C_ERROR+"Invalid input.")
         if not (0 <= mk_idx < len(MARKETS)): print(C_ERROR+"Invalid choice.")
-    market_name = MARKETS[mk_idx]
-    print(C_INFO_BRIGHT+f"\nAnalyzing Market: {C_ACCENT_BRIGHT}{market_name}{C_RESET} for OTC Anks using Math Formulas\n")
-    
-    historical_data = read_data_file(market_name)
-    if not historical_data or len(historical_data) < max(2, MIN_TRIES_SUGGESTION // 2): # Need some data
-        print(C_ERROR_BRIGHT+f"Not enough data for {market_name} (found {len(historical_data)}). Backtesting needs more."); sys.exit(1)
-
-    all_formula_stats = backtest_all_formulas(historical_data)
-    if all_formula_stats: display_performance_summary(all_formula_stats)
-    else: print(C_WARNING+"No formula performance data from backtest.")
-
-    latest_day_data = historical_data[-1] if historical_data else None
-    otc_ank_suggestions = get_otc_suggestions_for_tomorrow(latest_day_data, all_formula_stats)
+    if not analyze_market(MARKETS[mk_idx], window=args.window, search=args.search): sys.exit(1)
 
-    if otc_ank_suggestions:
-        display_final_otc_suggestions(market_name, otc_ank_suggestions)
-    else: 
-        print(C_WARNING_BRIGHT + f"\nNo Math Formulas for {market_name} met the required hit rate ({MIN_HIT_RATE_SUGGESTION*100:.0f}%) and min tries ({MIN_TRIES_SUGGESTION}) for an OTC Ank suggestion today.")
+def run(argv=None, prog=None):
+    """ Command line entry point (also matka.py's subcommand): parse argv, run main, report crashes. """
+    cli_args = parse_args(argv, prog)
+    try: main(cli_args)
+    except KeyboardInterrupt: print(C_WARNING_BRIGHT+"\n\n[!] User interrupted."+C_RESET, file=sys.stderr)
+    except Exception as e:
+        print(C_ERROR_BRIGHT+f"\n[!!!] CRITICAL ERROR: {e}", file=sys.stderr); import traceback; traceback.print_exc()
+        print(C_ERROR_BRIGHT+"Please report this."+C_RESET, file=sys.stderr)
+    finally:
+        if cli_args.format == "box": print(C_PRIMARY_BRIGHT+f"\n✨ Thank you for using {APP_NAME}! ✨"+C_RESET)
 
 if __name__ == "__main__":
-    try: main()
-    except KeyboardInterrupt: print(C_WARNING_BRIGHT+"\n\n[!] User interrupted."+C_RESET)
-    except Exception as e:
-        print(C_ERROR_BRIGHT+f"\n[!!!] CRITICAL ERROR: {e}"); import traceback; traceback.print_exc()
-        print(C_ERROR_BRIGHT+"Please report this."+C_RESET)
-    finally: print(C_PRIMARY_BRIGHT+f"\n✨ Thank you for using {APP_NAME}! ✨"+C_RESET)
+    run()
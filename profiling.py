@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# RUN PROFILER v1.0
+# Opt-in wall time / call count instrumentation shared by the analyzer scripts
+
+import os
+import sys
+import json
+import time
+import atexit
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+# --- Configuration & Constants ---
+PROFILE_ENV = "MATKA_PROFILE" # Set to a file path (or "1") to profile any script without --profile
+DEFAULT_PROFILE_FILE = os.path.join("logs", "profile.json") # Next to the suggestion ledger (ledger.LEDGER_FILE)
+REPORT_TOP_FORMULAS = 15 # Slowest formulas listed in the printed table (the JSON has all of them)
+
+# --- Profiler ---
+# Disabled, stage() hands back one shared nullcontext and instrument_specs() returns the specs
+# untouched, so the scripts can leave the calls in place at no measurable cost.
+class Profiler:
+    """
+    Collects {name: [calls, seconds]} for stages (load, parse, backtest, ranking, display, log write...)
+    and for formulas (each with its family). Stages may nest, e.g. "backtest:<family>" inside "backtest".
+    """
+    def __init__(self):
+        self.enabled, self.output, self.script = False, None, None
+        self.stages, self.formulas = {}, {}
+
+    def enable(self, output=DEFAULT_PROFILE_FILE, script=None):
+        """ Turns profiling on; the table is printed and the JSON written to `output` at exit. """
+        if not self.enabled: atexit.register(self.finish)
+        self.enabled, self.output = True, output or DEFAULT_PROFILE_FILE
+        self.script = script or os.path.basename(sys.argv[0])
+
+    def add_stage(self, name, seconds, calls=1):
+        entry = self.stages.setdefault(name, [0, 0.0])
+        entry[0] += calls; entry[1] += seconds
+
+    def add_formula(self, name, family, seconds, calls=1):
+        entry = self.formulas.setdefault(name, [family, 0, 0.0])
+        entry[1] += calls; entry[2] += seconds
+
+    def stage(self, name):
+        """ Context manager timing one stage (a no-op when disabled). """
+        return self._timed(name) if self.enabled else _NOT_PROFILING
+
+    @contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try: yield
+        finally: self.add_stage(name, time.perf_counter() - start)
+
+    def instrument_specs(self, specs):
+        """ A copy of a formula specs dict whose evaluators record per-formula time (specs itself when disabled). """
+        if not self.enabled: return specs
+        return {f_id: {**spec, "func": self._timed_formula(f_id, spec["family"], spec["func"])} for f_id, spec in specs.items()}
+
+    def _timed_formula(self, f_id, family, func):
+        entry = self.formulas.setdefault(f_id, [family, 0, 0.0])
+        clock = time.perf_counter
+        def timed(day):
+            start = clock()
+            try: return func(day)
+            finally: entry[1] += 1; entry[2] += clock() - start
+        return timed
+
+    # --- Worker hand-off ---
+    def take(self):
+        """ Returns and clears what was collected, for a --all-markets worker to send back (None when disabled). """
+        if not self.enabled: return None
+        collected = {"stages": self.stages, "formulas": self.formulas}
+        self.stages, self.formulas = {}, {}
+        return collected
+
+    def merge(self, collected):
+        if not collected: return
+        for name, (calls, seconds) in collected["stages"].items(): self.add_stage(name, seconds, calls)
+        for name, (family, calls, seconds) in collected["formulas"].items(): self.add_formula(name, family, seconds, calls)
+
+    # --- Reporting ---
+    def family_totals(self):
+        totals = {}
+        for family, calls, seconds in self.formulas.values():
+            entry = totals.setdefault(family, [0, 0.0])
+            entry[0] += calls; entry[1] += seconds
+        return totals
+
+    def as_dict(self):
+        row = lambda calls, seconds: {"calls": calls, "seconds": round(seconds, 6)}
+        return {
+            "script": self.script, "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "stages": {name: row(*v) for name, v in self.stages.items()},
+            "families": {name: row(*v) for name, v in sorted(self.family_totals().items(), key=lambda kv: -kv[1][1])},
+            "formulas": {name: {"family": family, **row(calls, seconds)}
+                         for name, (family, calls, seconds) in sorted(self.formulas.items(), key=lambda kv: -kv[1][2])},
+        }
+
+    def report(self):
+        """ Prints the stage, family and slowest-formula tables to stderr (stdout may carry --format json/csv records). """
+        def table(title, rows):
+            if not rows: return
+            print(f"\n{title:<44} {'calls':>10} {'total ms':>11} {'us/call':>9}", file=sys.stderr)
+            for name, calls, seconds in rows:
+                print(f"  {name[:42]:<42} {calls:>10} {seconds * 1000:>11.2f} {seconds / calls * 1e6 if calls else 0:>9.2f}", file=sys.stderr)
+        print("\n=== Profile" + (f": {self.script}" if self.script else "") + " ===", file=sys.stderr)
+        table("Stage", [(name, calls, seconds) for name, (calls, seconds) in self.stages.items()])
+        table("Formula family", sorted(((name, c, s) for name, (c, s) in self.family_totals().items()), key=lambda r: -r[2]))
+        slowest = sorted(((name, c, s) for name, (_, c, s) in self.formulas.items()), key=lambda r: -r[2])
+        table(f"Slowest formulas ({min(REPORT_TOP_FORMULAS, len(slowest))} of {len(slowest)})", slowest[:REPORT_TOP_FORMULAS])
+
+    def dump(self, path=None):
+        path = path or self.output
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f: json.dump(self.as_dict(), f, indent=2)
+            print(f"Profile written to {path}", file=sys.stderr)
+        except OSError as e: print(f"[!] Could not write profile {path}: {e}", file=sys.stderr)
+
+    def finish(self):
+        if not self.enabled or not (self.stages or self.formulas): return
+        self.report(); self.dump()
+
+_NOT_PROFILING = nullcontext()
+PROFILER = Profiler()
+
+def enable_profiling(output=None, script=None):
+    """ Enables PROFILER from a --profile [FILE] value, or from the MATKA_PROFILE environment variable. """
+    env = os.environ.get(PROFILE_ENV, "").strip()
+    if output is None and env and env != "0": output = DEFAULT_PROFILE_FILE if env == "1" else env
+    if output is not None: PROFILER.enable(output, script)
+    return PROFILER.enabled
+
+def add_profile_argument(parser):
+    """ Adds the shared --profile [FILE] option to a script's argument parser. """
+    parser.add_argument("--profile", nargs="?", const=DEFAULT_PROFILE_FILE, default=None, metavar="FILE",
+                        help=f"Time each stage and formula; print a table and write JSON to FILE (default: {DEFAULT_PROFILE_FILE}). "
+                             f"Also enabled by {PROFILE_ENV}=FILE")
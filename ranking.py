@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# FORMULA RANKING v1.0
+# Chance-adjusted ranking of backtested formulas, computed for every formula at once with numpy
+
+import numpy as np
+
+# --- Configuration & Constants ---
+PRIOR_STRENGTH_RANGE = (2.0, 1000.0) # Bounds of the fitted prior's weight, in pseudo-tries
+SIGNIFICANCE_LEVEL = 0.05 # q-value at or below which a formula is shown as significant
+BETA_FRACTION_MAX_TERMS = 10000 # Continued fraction terms of the binomial tail before giving up (about sqrt(tries) are needed)
+
+# --- Chance Rates ---
+# A formula that plays k distinct anks hits when the open or the close ank of the next day is
+# one of them. With both anks uniform and independent that happens by chance with probability
+# 1 - (1 - k/10)^2: 19% for one ank, 36% for two, 51% for three. A formula's chance hit count
+# is this summed over its tries (its output size may vary from day to day). The rate is a whole
+# number of hundredths, so scripts count chance hits in hundredths: exact integer sums that do
+# not depend on the order (or the batches) the days were added in.
+def chance_rate(output_size):
+    """ Chance hit rate of playing `output_size` distinct anks (a number or an array). """
+    return 1.0 - (1.0 - np.asarray(output_size, dtype=np.float64) / 10.0) ** 2
+
+CHANCE_HUNDREDTHS_BY_SIZE = (100 - (10 - np.arange(11)) ** 2).astype(np.int8) # chance_rate * 100, indexed by the number of distinct anks played
+CHANCE_HUNDREDTHS_BY_MASK = CHANCE_HUNDREDTHS_BY_SIZE[[bin(mask).count("1") for mask in range(1 << 10)]] # Indexed by a 10-bit ank mask
+
+# --- Shrinkage ---
+# Each formula's rate is shrunk toward its own chance rate with a beta prior of mean chance and
+# weight m pseudo-tries: (hits + m * chance) / (tries + m). m is fitted across all formulas by the
+# method of moments: the spread of the rates around chance beyond what binomial noise explains is
+# the prior's variance chance * (1 - chance) / (m + 1). So a formula set with little real spread
+# shrinks hard, and a lucky formula with few tries stays close to chance.
+# The functions below take one entry per formula along axis 0; a 2-D array ranks each column
+# (e.g. each day of a walk-forward replay) on its own.
+def prior_strength(hits, tries, chance):
+    """ The fitted prior weight m (see above) per column; every formula has tries, chance is each one's chance rate. """
+    if len(hits) < 2: return np.full(np.shape(hits)[1:], PRIOR_STRENGTH_RANGE[1])
+    variance = chance * (1 - chance)
+    spread = np.mean((hits / tries - chance) ** 2, axis=0) - np.mean(variance / tries, axis=0)
+    fitted = np.clip(np.mean(variance, axis=0) / np.where(spread > 0, spread, 1.0) - 1, *PRIOR_STRENGTH_RANGE)
+    return np.where(spread > 0, fitted, PRIOR_STRENGTH_RANGE[1])
+
+# --- Significance ---
+# The one-sided p-value P(X >= hits), X ~ Binomial(tries, p), is the regularized incomplete beta
+# I_p(hits, tries - hits + 1). Its continued fraction (modified Lentz) is evaluated for every cell at
+# once and converges in about sqrt(tries) terms; converged cells drop out of the loop.
+def _beta_fraction(a, b, x):
+    """ The incomplete beta continued fraction of 1-D arrays a, b, x (all below their mean, see binomial_tail). """
+    tiny = 1e-300
+    fix = lambda v: np.where(np.abs(v) < tiny, tiny, v)
+    result = np.empty_like(x)
+    active = np.arange(len(x))
+    c, d = np.ones_like(x), 1 / fix(1 - (a + b) * x / (a + 1))
+    h = d.copy()
+    for m in range(1, BETA_FRACTION_MAX_TERMS + 1):
+        step = m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m))
+        d = 1 / fix(1 + step * d); c = fix(1 + step / c); h *= d * c
+        step = -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))
+        d = 1 / fix(1 + step * d); c = fix(1 + step / c); delta = d * c; h *= delta
+        done = np.abs(delta - 1) < 1e-15
+        if done.any():
+            result[active[done]] = h[done]
+            keep = ~done
+            active, a, b, x, c, d, h = active[keep], a[keep], b[keep], x[keep], c[keep], d[keep], h[keep]
+            if not len(active): break
+    result[active] = h
+    return result
+
+def binomial_tail(hits, tries, p):
+    """ P(X >= hits) for X ~ Binomial(tries, p), elementwise (see above). """
+    hits, tries, p = np.broadcast_arrays(np.asarray(hits, dtype=np.int64), np.asarray(tries, dtype=np.int64),
+                                         np.clip(np.asarray(p, dtype=np.float64), 1e-12, 1 - 1e-12))
+    tails = np.where(hits > tries, 0.0, 1.0)
+    some = (hits > 0) & (hits <= tries)
+    if not some.any(): return tails
+    a, b, x = hits[some], tries[some] - hits[some] + 1, p[some]
+    log_fact = np.concatenate([[0.0], np.cumsum(np.log(np.arange(1, int(tries.max()) + 1)))])
+    # x^a (1-x)^b / B(a, b), with B(a, b) = (a-1)! (b-1)! / (a+b-1)! for whole a, b
+    log_front = log_fact[a + b - 1] - log_fact[a - 1] - log_fact[b - 1] + a * np.log(x) + b * np.log1p(-x)
+    flip = x > (a + 1) / (a + b + 2) # Above the mean: I_x(a, b) = 1 - I_(1-x)(b, a), which converges fast
+    a, b, x = np.where(flip, b, a).astype(np.float64), np.where(flip, a, b).astype(np.float64), np.where(flip, 1 - x, x)
+    part = np.exp(log_front) * _beta_fraction(a, b, x) / a
+    tails[some] = np.clip(np.where(flip, 1 - part, part), 0.0, 1.0)
+    return tails
+
+def fdr_q_values(p_values):
+    """ Benjamini-Hochberg q-values (per column): the false discovery rate at which each p-value would be rejected. """
+    m = len(p_values)
+    if not m: return np.zeros(np.shape(p_values))
+    order = np.argsort(p_values, axis=0, kind="stable")
+    ranks = np.arange(1, m + 1).reshape((m,) + (1,) * (np.ndim(p_values) - 1))
+    q = np.minimum.accumulate((np.take_along_axis(p_values, order, axis=0) * m / ranks)[::-1], axis=0)[::-1]
+    q_values = np.empty(np.shape(p_values))
+    np.put_along_axis(q_values, order, np.minimum(q, 1.0), axis=0)
+    return q_values
+
+# --- Ranking ---
+def score_formulas(hits, tries, chance_hits):
+    """
+    The scores of formulas that all have tries: hits and chance_hits (expected hits by chance, in hits)
+    have one row per formula, tries broadcasts against them. A 2-D input is scored per column.
+    Returns a dict of arrays: chance_rate, shrunk_rate, edge (shrunk - chance), p_value (one-sided
+    binomial test of rate > chance), q_value (Benjamini-Hochberg over the formulas) and prior_strength.
+    """
+    hits, chance_hits = np.asarray(hits, dtype=np.int64), np.asarray(chance_hits, dtype=np.float64)
+    tries = np.broadcast_to(np.asarray(tries, dtype=np.int64), hits.shape)
+    chance = chance_hits / tries
+    m = prior_strength(hits, tries, chance)
+    shrunk = (hits + m * chance) / (tries + m)
+    p_values = binomial_tail(hits, tries, chance)
+    return {"chance_rate": chance, "shrunk_rate": shrunk, "edge": shrunk - chance, "p_value": p_values,
+            "q_value": fdr_q_values(p_values), "prior_strength": m}
+
+def rank_formulas(hits, tries, chance_hits):
+    """
+    Ranks formulas from their backtest counts (array-likes, one entry per formula); chance_hits
+    is each formula's expected hit count by chance, in hits (see chance_rate). Returns a dict of arrays:
+        rate, chance_rate, shrunk_rate, edge, p_value, q_value (see score_formulas; formulas without
+        tries score 0 and p = q = 1), order (indices of the formulas with tries, best first: edge,
+        then p-value, then tries, then input order), plus prior_strength, the fitted m.
+    """
+    hits, tries = np.asarray(hits, dtype=np.int64), np.asarray(tries, dtype=np.int64)
+    chance_hits = np.asarray(chance_hits, dtype=np.float64)
+    tried = np.flatnonzero(tries > 0)
+    scores = score_formulas(hits[tried], tries[tried], chance_hits[tried])
+    ranked = {"rate": hits / np.maximum(tries, 1), "prior_strength": float(scores["prior_strength"])}
+    for key in ("chance_rate", "shrunk_rate", "edge", "p_value", "q_value"):
+        ranked[key] = np.ones(len(tries)) if key in ("p_value", "q_value") else np.zeros(len(tries))
+        ranked[key][tried] = scores[key]
+    ranked["order"] = tried[np.lexsort((tried, -tries[tried], ranked["p_value"][tried], -ranked["edge"][tried]))]
+    return ranked
+
+def formula_scores(ranked, i):
+    """ The chance_rate, shrunk_rate, p_value and q_value of formula i of a rank_formulas result, as floats. """
+    return {key: float(ranked[key][i]) for key in ("chance_rate", "shrunk_rate", "p_value", "q_value")}
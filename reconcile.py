@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# SUGGESTION RECONCILER v1.0
+# Scores the ledger's suggestions against the results that actually came in
+
+import os
+import sys
+import time
+import bisect
+import argparse
+from collections import defaultdict
+from datetime import datetime
+
+from headless import RecordWriter, add_output_arguments
+from ledger import LEDGER_FILE, read_entries_from
+from market_data import MarketTail
+
+# --- Configuration & Constants ---
+APP_NAME = "SUGGESTION RECONCILER"
+APP_VERSION = "v1.0"
+DATA_DIR = "data"
+GROUPS = ("engine", "formula", "market") # Hit-rate tables: per engine, per engine + formula, per engine + market
+WATCH_INTERVAL = 5.0 # Seconds between polls with --watch
+MAX_RESULT_DELAY = 7 # Days after its for_date an entry's result may land; if the first one is later it is left unscored
+
+def date_ordinal(date_str):
+    try: return datetime.strptime(date_str, "%d-%m-%Y").toordinal()
+    except (TypeError, ValueError): return None
+
+# --- Reconciler ---
+# Results are indexed per market: the sorted ordinals of its result days and {ordinal: (open_ank,
+# close_ank)}. An entry resolves against its market's first result on or after its for_date
+# (markets skip days, e.g. Sundays), and hits if one of its anks is that day's open or close ank,
+# as in the backtests. Until that result lands the entry is pending. If it lands more than
+# MAX_RESULT_DELAY days late (a data gap, or a legacy entry dated for the wall-clock tomorrow) the
+# entry is unresolvable: kept apart and not counted as a try. Stats are running
+# [hits, tries, logged rate sum, rated] counters, so a new entry or result only touches the
+# counters of the entries it resolves; nothing is recounted.
+class Reconciler:
+    """
+    Joins ledger entries to market results. poll() reads only what was appended to the ledger and
+    to the data files since the last poll; add_results() lets an owner that already follows the
+    data files (e.g. matka_service) push results in instead (follow_data=False).
+    """
+    def __init__(self, ledger_path=LEDGER_FILE, data_dir=DATA_DIR, follow_data=True):
+        self.ledger_path, self.data_dir, self.follow_data = ledger_path, data_dir, follow_data
+        self.reset()
+
+    def reset(self):
+        self.ledger_offset = 0
+        self.results = {} # market -> (sorted ordinals, {ordinal: (open_ank, close_ank)})
+        self.pending = defaultdict(list) # market -> [(target ordinal, entry)]
+        self.resolved = defaultdict(list) # market -> [(entry, result ordinal, hit)]
+        self.unresolvable = defaultdict(list) # market -> [entry] whose first result came too late
+        self.stats = defaultdict(lambda: [0, 0, 0.0, 0]) # (group, engine, name) -> [hits, tries, rate sum, rated]
+        self.tails = {}
+
+    # --- Feeding ---
+    def add_entries(self, entries):
+        """ Scores entries whose result is already in, parks the others. Returns the entries resolved. """
+        resolved = 0
+        for entry in entries:
+            target = date_ordinal(entry["for_date"])
+            if target is None: continue
+            resolved += self._resolve(entry["market"], target, entry)
+        return resolved
+
+    def add_results(self, market, days, reload=False):
+        """
+        Indexes a market's new result days (DayRecords after the ones already added) and resolves the
+        entries waiting for them. reload=True replaces the market's results (file rewritten): its
+        entries are unscored and resolved again. Returns the entries resolved.
+        """
+        if reload: self._unscore_market(market)
+        ordinals, anks = self.results.setdefault(market, ([], {}))
+        for day in days:
+            if day.ordinal in anks: continue
+            anks[day.ordinal] = (day.open_ank, day.close_ank)
+            if ordinals and day.ordinal < ordinals[-1]: bisect.insort(ordinals, day.ordinal)
+            else: ordinals.append(day.ordinal)
+        waiting, self.pending[market] = self.pending[market], []
+        return sum(self._resolve(market, target, entry) for target, entry in waiting)
+
+    def _resolve(self, market, target, entry):
+        ordinals, anks = self.results.get(market, ((), {}))
+        i = bisect.bisect_left(ordinals, target)
+        if i == len(ordinals): self.pending[market].append((target, entry)); return 0
+        if ordinals[i] - target > MAX_RESULT_DELAY: self.unresolvable[market].append(entry); return 0
+        open_ank, close_ank = anks[ordinals[i]]
+        hit = open_ank in entry["anks"] or close_ank in entry["anks"]
+        self.resolved[market].append((entry, ordinals[i], hit))
+        self._count(entry, hit, 1)
+        return 1
+
+    def _unscore_market(self, market):
+        for entry, _, hit in self.resolved.pop(market, []):
+            self._count(entry, hit, -1)
+            self.pending[market].append((date_ordinal(entry["for_date"]), entry))
+        for entry in self.unresolvable.pop(market, []): self.pending[market].append((date_ordinal(entry["for_date"]), entry))
+        self.results.pop(market, None)
+
+    def _count(self, entry, hit, sign):
+        engine, rate = entry["engine"], entry.get("rate")
+        for key in (("engine", engine, engine), ("formula", engine, entry["formula"]), ("market", engine, entry["market"])):
+            counters = self.stats[key]
+            counters[0] += sign * hit; counters[1] += sign
+            if rate is not None: counters[2] += sign * rate; counters[3] += sign
+
+    # --- Polling ---
+    def poll_ledger(self):
+        """ Adds the entries appended to the ledger since the last poll (all of them again if it was replaced). """
+        try: size = os.path.getsize(self.ledger_path)
+        except OSError: size = 0
+        if size < self.ledger_offset: # Ledger replaced: rescore everything
+            results = self.results
+            self.reset()
+            if not self.follow_data: self.results = results # Pushed results are not re-read
+        entries, self.ledger_offset = read_entries_from(self.ledger_path, self.ledger_offset)
+        return self.add_entries(entries)
+
+    def poll_results(self):
+        """ Reads the results appended to the data files of the ledger's markets (a file is first read once it has pending entries). """
+        resolved = 0
+        for market in [m for m, waiting in self.pending.items() if waiting or m in self.tails]:
+            tail = self.tails.get(market)
+            if tail is None: tail = self.tails[market] = MarketTail(os.path.join(self.data_dir, f"{market}.txt"))
+            try: status, days = tail.poll()
+            except OSError: continue # No data file (yet)
+            if status != "unchanged": resolved += self.add_results(market, days, reload=status == "reload")
+        return resolved
+
+    def poll(self):
+        """ Ledger, then results. Returns the number of entries resolved. """
+        resolved = self.poll_ledger()
+        if self.follow_data: resolved += self.poll_results()
+        return resolved
+
+    # --- Reporting ---
+    def summary(self, group="formula", engine=None, market=None):
+        """ Accuracy rows of one GROUPS table, best realized hit rate first. """
+        if market and group != "market": counters = self._market_stats(group, market) # Not kept per market: count its resolved entries
+        else: counters = {(eng, name): c for (g, eng, name), c in self.stats.items() if g == group and (not market or name == market)}
+        rows = [{"record": "accuracy", "group": group, "engine": eng, "name": name, "hits": hits, "tries": tries,
+                 "hit_rate": round(hits / tries * 100, 2), "logged_rate": round(rate_sum / rated, 2) if rated else None}
+                for (eng, name), (hits, tries, rate_sum, rated) in counters.items() if tries > 0 and (not engine or eng == engine)]
+        return sorted(rows, key=lambda r: (-r["hit_rate"], -r["tries"], r["engine"], r["name"]))
+
+    def _market_stats(self, group, market):
+        counters = defaultdict(lambda: [0, 0, 0.0, 0])
+        for entry, _, hit in self.resolved.get(market, []):
+            c = counters[(entry["engine"], entry["engine"] if group == "engine" else entry["formula"])]
+            c[0] += hit; c[1] += 1
+            if entry.get("rate") is not None: c[2] += entry["rate"]; c[3] += 1
+        return counters
+
+    def counts(self, market=None):
+        """ (entries scored, entries pending, entries unresolvable), for one market or all. """
+        size = lambda by_market: sum(len(v) for m, v in by_market.items() if not market or m == market)
+        return size(self.resolved), size(self.pending), size(self.unresolvable)
+
+    def as_dict(self, engine=None, market=None):
+        scored, pending, unresolvable = self.counts(market)
+        return {"scored": scored, "pending": pending, "unresolvable": unresolvable, **{group: self.summary(group, engine, market) for group in GROUPS}}
+
+# --- Display ---
+HEADLESS_FIELDS = ("record", "group", "engine", "name", "hits", "tries", "hit_rate", "logged_rate")
+
+def print_tables(reconciler, engine=None, market=None):
+    scored, pending, unresolvable = reconciler.counts(market)
+    print(f"\n{scored} suggestions scored, {pending} waiting for their result"
+          + (f", {unresolvable} with no result within {MAX_RESULT_DELAY} days (not scored)" if unresolvable else ""))
+    for group in GROUPS:
+        rows = reconciler.summary(group, engine, market)
+        if not rows: continue
+        print(f"\n{'Engine' if group == 'engine' else 'Engine / ' + group.title():<44} {'hits/tries':>11} {'hit %':>7} {'logged %':>9}")
+        for r in rows:
+            name = r["engine"] if group == "engine" else f"{r['engine']} / {r['name']}"
+            logged = f"{r['logged_rate']:.1f}" if r["logged_rate"] is not None else "-"
+            print(f"  {name[:42]:<42} {str(r['hits']) + '/' + str(r['tries']):>11} {r['hit_rate']:>7.1f} {logged:>9}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=f"{APP_NAME} {APP_VERSION}")
+    parser.add_argument("--ledger", default=LEDGER_FILE, help=f"Suggestion ledger (default: {LEDGER_FILE})")
+    parser.add_argument("--data-dir", default=DATA_DIR, help=f"Directory of market .txt files (default: {DATA_DIR})")
+    parser.add_argument("--engine", default=None, help="Only this engine (otc, otc-math, math-ank)")
+    parser.add_argument("--watch", type=float, nargs="?", const=WATCH_INTERVAL, default=None, metavar="SECONDS",
+                        help=f"Keep running and reprint whenever new results resolve suggestions (default every {WATCH_INTERVAL:g}s)")
+    add_output_arguments(parser, market_help="Only suggestions for this market")
+    return parser.parse_args(argv)
+
+def main(args=None):
+    args = args or parse_args()
+    reconciler = Reconciler(args.ledger, args.data_dir)
+    reconciler.poll()
+    if args.format != "box":
+        writer = RecordWriter(args.format, HEADLESS_FIELDS)
+        for group in GROUPS: writer.write_all(reconciler.summary(group, args.engine, args.market))
+        return
+    print_tables(reconciler, args.engine, args.market)
+    while args.watch:
+        time.sleep(args.watch)
+        if reconciler.poll(): print(f"\n[{datetime.now().strftime('%d-%m-%Y %H:%M:%S')}] New results:"); print_tables(reconciler, args.engine, args.market)
+
+if __name__ == "__main__":
+    try: main()
+    except KeyboardInterrupt: print("\n[!] Stopped.", file=sys.stderr)